@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+#author markpurcell@ie.ibm.com
+
+"""Transport benchmark program.
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+Measures publish and receive throughput and invoke_service latency over a
+sweep of payload sizes, writing the results as JSON. Runs against the
+in-process broker unless --credentials names a real one; all queues used are
+temporary, so no provisioning is required.
+
+Each measurement follows an untimed warm-up and repeats its round of messages
+until at least --min-seconds have been timed, so small payloads and fast
+brokers still give stable rates and percentiles.
+
+    python3 -m examples.benchmark.transport --output results.json
+"""
+
+# Suppress line-too-long and broad-except
+# pylint: disable=C0301, W0703
+
+import os
+import sys
+import time
+import json
+import argparse
+import logging
+import platform
+import threading
+import pycloudmessenger.rabbitmq as rabbitmq
+import pycloudmessenger.rabbitmemory as rabbitmemory
+
+#Set up logger
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s.%(msecs)03d %(levelname)-6s %(name)s %(thread)d :: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S')
+
+LOGGER = logging.getLogger(__package__)
+logging.getLogger("pika").setLevel(logging.WARNING)
+
+MEMORY_ARGS = {'broker_host': 'memory', 'broker_port': 5672, 'broker_vhost': '/',
+               'broker_user': 'benchmark', 'broker_password': 'benchmark'}
+
+
+def percentiles(samples: list) -> dict:
+    """ Summarise latencies, in milliseconds """
+    samples = sorted(samples)
+    pick = lambda fraction: samples[min(len(samples) - 1, int(fraction * len(samples)))]
+    return {'p50': pick(0.5) * 1000, 'p90': pick(0.9) * 1000, 'p99': pick(0.99) * 1000,
+            'max': samples[-1] * 1000, 'mean': sum(samples) / len(samples) * 1000}
+
+
+def throughput(name: str, size: int, count: int, elapsed: float, **settings) -> dict:
+    """ Build a throughput result """
+    result = {'benchmark': name, 'payload': size, 'messages': count,
+              'seconds': elapsed, 'msgs_per_sec': count / elapsed,
+              'mb_per_sec': count * size / elapsed / 1024 / 1024}
+    result.update(settings)
+    return result
+
+
+def repeat(run, count: int, warmup: int, min_seconds: float) -> tuple:
+    """
+        Call run(messages), which returns the seconds it timed, once untimed
+        with 'warmup' messages, then with 'count' until 'min_seconds' are timed
+        Returns the messages and seconds timed
+    """
+    if warmup:
+        run(warmup)
+    messages, elapsed = 0, 0.0
+    while not messages or elapsed < min_seconds:
+        elapsed += run(count)
+        messages += count
+    return messages, elapsed
+
+
+def bench_publish(client_class, context, size: int, count: int, window: int,
+                  warmup: int, min_seconds: float) -> dict:
+    """ RabbitClient.publish, one confirm per message unless windowed """
+    payload = os.urandom(size)
+    with client_class(context) as client:
+        queue = rabbitmq.RabbitQueue(confirm_window=window)
+        client.start(publish=queue, subscribe=queue)
+
+        def run(messages: int) -> float:
+            start = time.perf_counter()
+            for _ in range(messages):
+                client.publish(payload)
+            client.wait_for_confirms()
+            elapsed = time.perf_counter() - start
+            #Not consumed, so emptied between rounds
+            client.channel.queue_purge(queue=queue.name)
+            return elapsed
+
+        count, elapsed = repeat(run, count, warmup, min_seconds)
+    return throughput('publish', size, count, elapsed, confirm_window=window)
+
+
+def bench_receive(client_class, context, size: int, count: int, prefetch: int,
+                  ack_batch: int, warmup: int, min_seconds: float) -> dict:
+    """ RabbitClient.receive with a handler, from a pre-filled queue """
+    payload = os.urandom(size)
+    with client_class(context) as client:
+        queue = rabbitmq.RabbitQueue(confirm_window=100, prefetch=prefetch,
+                                     ack_batch=ack_batch, persistent=True)
+        client.start(publish=queue, subscribe=queue)
+
+        def run(messages: int) -> float:
+            client.publish_many([payload] * messages)
+            start = time.perf_counter()
+            client.receive(lambda body: None, timeout=30, max_messages=messages)
+            return time.perf_counter() - start
+
+        count, elapsed = repeat(run, count, warmup, min_seconds)
+    return throughput('receive', size, count, elapsed, prefetch=prefetch, ack_batch=ack_batch)
+
+
+def echo_service(client_class, context, queue: rabbitmq.RabbitQueue, reply_queue: str,
+                 started: threading.Event, stopping: threading.Event):
+    """ Send each request back to the reply queue """
+    with client_class(context) as server:
+        server.start(subscribe=queue)
+        started.set()
+        replies = rabbitmq.RabbitQueue(reply_queue)
+
+        while not stopping.is_set():
+            try:
+                server.receive(lambda body: server.publish(body, replies), timeout=0.5)
+            except (rabbitmq.RabbitTimedOutException, rabbitmq.RabbitConsumerException):
+                pass
+
+
+def bench_invoke(client_class, context, size: int, count: int, warmup: int,
+                 min_seconds: float) -> dict:
+    """ RabbitDualClient.invoke_service round trips against an echo service """
+    payload = os.urandom(size)
+    client = rabbitmq.RabbitDualClient(context)
+    client.transport = client_class
+    client.start_subscriber(rabbitmq.RabbitQueue(persistent=True))
+
+    service_queue = rabbitmq.RabbitQueue(persistent=True)
+    started, stopping = threading.Event(), threading.Event()
+    service = threading.Thread(target=echo_service,
+                               args=(client_class, context, service_queue,
+                                     client.get_subscribe_queue(), started, stopping))
+    service.start()
+    started.wait(30)
+
+    try:
+        client.start_publisher(rabbitmq.RabbitQueue(service_queue.name))
+
+        latencies = []
+
+        def run(messages: int) -> float:
+            timed = []
+            for _ in range(messages):
+                start = time.perf_counter()
+                client.invoke_service(payload, timeout=30)
+                timed.append(time.perf_counter() - start)
+            latencies.extend(timed)
+            return sum(timed)
+
+        repeat(run, count, warmup, min_seconds)
+        #Only the timed rounds count
+        del latencies[:warmup]
+        count = len(latencies)
+    finally:
+        stopping.set()
+        service.join()
+        client.stop()
+
+    result = {'benchmark': 'invoke_service', 'payload': size, 'messages': count,
+              'seconds': sum(latencies), 'msgs_per_sec': count / sum(latencies)}
+    result.update({f'latency_ms_{key}': value for key, value in percentiles(latencies).items()})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transport Benchmark')
+    parser.add_argument('--credentials', help='Real broker, defaults to the in-process one')
+    parser.add_argument('--broker_user', help='Defaults to credentials file')
+    parser.add_argument('--broker_password', help='Defaults to credentials file')
+    parser.add_argument('--sizes', default='128,4096,65536,1048576', help='Payload sizes, in bytes')
+    parser.add_argument('--messages', type=int, default=1000, help='Messages per round')
+    parser.add_argument('--calls', type=int, default=200, help='Round trips per latency round')
+    parser.add_argument('--warmup', type=int, default=50, help='Untimed messages before each measurement')
+    parser.add_argument('--min-seconds', type=float, default=1.0, help='Least time measured per result')
+    parser.add_argument('--output', help='JSON results file, defaults to stdout')
+    cmdline = parser.parse_args()
+
+    if cmdline.credentials:
+        context = rabbitmq.RabbitContext.from_credentials_file(cmdline.credentials, cmdline.broker_user, cmdline.broker_password)
+        client_class, broker = rabbitmq.RabbitClient, context.host()
+    else:
+        context = rabbitmq.RabbitContext(MEMORY_ARGS)
+        client_class, broker = rabbitmemory.MemoryClient.on(rabbitmemory.MemoryBroker()), 'memory'
+
+    results = []
+    for size in [int(size) for size in cmdline.sizes.split(',')]:
+        #Keep each round to a similar volume of data, the minimum time sets the total
+        count = max(100, min(cmdline.messages, cmdline.messages * 4096 // size))
+        timing = (cmdline.warmup, cmdline.min_seconds)
+        LOGGER.info(f"Payload {size} bytes, rounds of {count} messages")
+
+        for window in (1, 100):
+            results.append(bench_publish(client_class, context, size, count, window, *timing))
+        for prefetch, ack_batch in ((1, 1), (100, 1), (100, 50)):
+            results.append(bench_receive(client_class, context, size, count, prefetch, ack_batch,
+                                         *timing))
+        results.append(bench_invoke(client_class, context, size,
+                                    max(100, min(cmdline.calls, count)), *timing))
+
+    report = {'broker': broker, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'results': results}
+
+    if cmdline.output:
+        with open(cmdline.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+if __name__ == '__main__':
+    main()
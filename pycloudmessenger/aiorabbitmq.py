@@ -0,0 +1,603 @@
+#!/usr/bin/env python3
+#author markpurcell@ie.ibm.com
+
+"""RabbitMQ asyncio helper class.
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import time
+import asyncio
+import logging
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+import pycloudmessenger.rabbitmq as rabbitmq
+
+# pylint: disable=R0903, R0913
+
+LOGGER = logging.getLogger(__package__)
+
+
+def _resolve(future: asyncio.Future, value=None, exc: Exception = None):
+    """ Complete a future once, ignoring late callbacks """
+    if future.done():
+        return
+    if exc:
+        future.set_exception(exc)
+    else:
+        future.set_result(value)
+
+
+class AsyncRabbitClient(rabbitmq.AbstractRabbitMessenger):
+    """
+        Communicates with a RabbitMQ service from an asyncio event loop
+    """
+    def __init__(self, context: rabbitmq.RabbitContext):
+        super().__init__(context)
+        self.loop = None
+        self.closed = None
+        self.deliveries = {}
+        self.confirms = {}
+        self.delivery_tag = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def _call(self, method, *args, **kwargs):
+        """ Invoke a pika channel RPC method and wait for its reply frame """
+        future = self.loop.create_future()
+        method(lambda frame: _resolve(future, frame), *args, **kwargs)
+        return await asyncio.wait_for(future, self.context.timeout())
+
+    async def declare_queue(self, queue: rabbitmq.RabbitQueue) -> rabbitmq.RabbitQueue:
+        """
+            Declare a queue, creating if required
+
+            Throws:
+                An exception if connection attempt is not successful
+
+            Returns:
+                The queue
+        """
+        if queue.exclusive or queue.durable or queue.arguments():
+            frame = await self._call(self.channel.queue_declare,
+                                     queue=queue.name,
+                                     exclusive=queue.exclusive,
+                                     auto_delete=queue.auto_delete,
+                                     durable=queue.durable,
+                                     arguments=queue.arguments())
+            queue.name = frame.method.queue
+
+        if queue.purge:
+            await self._call(self.channel.queue_purge, queue=queue.name)
+        return queue
+
+    async def establish_connection(self, parameters: pika.ConnectionParameters):
+        """
+            Connect to RabbitMQ service
+
+            Throws:
+                An exception if connection attempt is not successful
+
+            Returns:
+                None
+        """
+        self.loop = asyncio.get_running_loop()
+        self.closed = self.loop.create_future()
+        opened = self.loop.create_future()
+
+        def on_open_error(_connection, error):
+            _resolve(opened, exc=pika.exceptions.AMQPConnectionError(error))
+
+        def on_close(_connection, reply_code, reply_text):
+            _resolve(opened, exc=self.on_close(reply_code, reply_text))
+
+        self.connection = AsyncioConnection(parameters,
+                                            on_open_callback=lambda conn: _resolve(opened, conn),
+                                            on_open_error_callback=on_open_error,
+                                            on_close_callback=on_close,
+                                            custom_ioloop=self.loop)
+        await opened
+
+        channel = self.loop.create_future()
+        self.connection.channel(on_open_callback=lambda chan: _resolve(channel, chan))
+        self.channel = await channel
+
+    def on_close(self, reply_code: int, reply_text: str) -> Exception:
+        """
+            Fail the confirms and consumers waiting on a closed connection
+
+            Throws:
+                Nothing
+
+            Returns:
+                The exception they were failed with
+        """
+        exc = rabbitmq.RabbitConsumerException(f'Connection closed ({reply_code}): {reply_text}')
+        _resolve(self.closed, exc)
+        for future in list(self.confirms.values()):
+            _resolve(future, exc=exc)
+        return exc
+
+    async def connect(self, connection_attempts: int, retry_delay: int):
+        """
+            Setup connection settings to RabbitMQ service, failing over to the
+            other nodes of a cluster for 'connection_attempts' rounds
+
+            Throws:
+                ValueError if connection_attempts is less than 1
+                An exception if connection attempt is not successful
+
+            Returns:
+                None
+        """
+        if connection_attempts < 1:
+            raise ValueError(f'connection_attempts must be at least 1, not {connection_attempts}')
+
+        candidates = self.candidates(connection_attempts, retry_delay)
+        if not candidates:
+            raise pika.exceptions.AMQPConnectionError('No broker hosts to connect to.')
+        rounds = connection_attempts if len(candidates) > 1 else 1
+
+        for attempt in range(rounds):
+            if attempt:
+                await asyncio.sleep(retry_delay)
+            for parameters in candidates:
+                try:
+                    await self.establish_connection(parameters)
+                    return
+                except rabbitmq.AUTHENTICATION_ERRORS:
+                    raise
+                except pika.exceptions.AMQPConnectionError as exc:
+                    if len(candidates) == 1:
+                        raise
+                    LOGGER.warning(f"Broker {parameters.host}:{parameters.port} unavailable: {exc}")
+                    error = exc
+        raise error
+
+    async def start(self, publish: rabbitmq.RabbitQueue = None,
+                    subscribe: rabbitmq.RabbitQueue = None,
+                    connection_attempts: int = 10, retry_delay: int = 1):
+        """
+            Start the client connection to the broker
+        """
+        if publish:
+            self.pub_queue = publish
+
+        if subscribe:
+            self.sub_queue = subscribe
+
+        await self.connect(connection_attempts, retry_delay)
+
+        if self.pub_queue:
+            await self.declare_queue(self.pub_queue)
+            #Confirmations arrive asynchronously, see _on_confirm
+            self.channel.confirm_delivery(self._on_confirm)
+
+        if self.sub_queue:
+            await self.declare_queue(self.sub_queue)
+            #Ensure the consumer only gets 'prefetch' unacknowledged message
+            await self._call(self.channel.basic_qos, prefetch_count=self.sub_queue.prefetch)
+
+    def get_subscribe_queue(self):
+        """ Get the clients subscribe queue, default to None """
+        return self.sub_queue.name if self.sub_queue else None
+
+    def _on_confirm(self, frame):
+        """ Resolve the publishes acknowledged (or rejected) by the broker """
+        method = frame.method
+        tags = [method.delivery_tag]
+        if method.multiple:
+            tags = [tag for tag in self.confirms if tag <= method.delivery_tag]
+
+        for tag in tags:
+            future = self.confirms.pop(tag, None)
+            if not future:
+                continue
+            if isinstance(method, pika.spec.Basic.Nack):
+                _resolve(future, exc=pika.exceptions.NackError([]))
+            else:
+                _resolve(future, True)
+
+    async def basic_publish(self, message, queue: str, exchange: str = None,
+                            mode: int = 1, delay: int = 0, correlation: str = None,
+                            priority: int = None, expiration: float = None):
+        """
+            Publish a message to a queue, waiting for the broker confirmation
+            Concurrent publishes from many tasks share the confirm round trip
+
+            Throws:
+                Exception - maybe access rights are insufficient on the queue
+
+            Returns:
+                None
+        """
+        if not exchange:
+            exchange = ''
+
+        body, encoding = self.encode_body(message)
+        properties = self.message_properties(mode, delay, correlation, encoding,
+                                             priority, expiration)
+        self.channel.basic_publish(exchange=exchange, routing_key=queue,
+                                   body=body, properties=properties)
+        self.outbound += 1
+        self.metrics.sent(queue, body)
+
+        if not self.pub_queue:
+            return
+
+        self.delivery_tag += 1
+        confirmed = self.loop.create_future()
+        self.confirms[self.delivery_tag] = confirmed
+        start = time.monotonic()
+        await confirmed
+        self.metrics.confirmed(time.monotonic() - start)
+
+    async def publish(self, message, queue: rabbitmq.RabbitQueue = None, exchange: str = None,
+                      mode: int = 1, delay: int = 0, correlation: str = None,
+                      priority: int = None, expiration: float = None):
+        """
+            Publish a message to a queue, optionally with a priority and
+            expiring after 'expiration' seconds
+
+            Throws:
+                Exception - maybe access rights are insufficient on the queue
+
+            Returns:
+                None
+        """
+        if not queue:
+            queue = self.pub_queue
+
+        if not exchange:
+            exchange = self.context.delayed_exchange() if delay else None
+
+        await self.basic_publish(message, queue.name, exchange, mode, delay, correlation,
+                                 priority, expiration)
+
+    def _consumer(self, queue: rabbitmq.RabbitQueue) -> asyncio.Queue:
+        """ Start consuming a queue for the session, returning its delivery buffer """
+        if queue.name not in self.deliveries:
+            buffer = asyncio.Queue()
+
+            def on_message(_channel, method, properties, body):
+                buffer.put_nowait((method, properties, body))
+
+            def on_cancel(frame):
+                if frame.method.consumer_tag == tag:
+                    self.metrics.cancelled()
+                    buffer.put_nowait(None)
+
+            self.deliveries[queue.name] = buffer
+            self.channel.add_on_cancel_callback(on_cancel)
+            tag = self.channel.basic_consume(on_message, queue.name, exclusive=queue.exclusive)
+        return self.deliveries[queue.name]
+
+    async def next_message(self, queue: rabbitmq.RabbitQueue, timeout: int = 30):
+        """
+            Wait for the next message on a queue, acknowledging it
+
+            Throws:
+                RabbitTimedOutException on timeout
+                RabbitConsumerException if the consumer was cancelled
+
+            Returns:
+                Tuple of (body, properties)
+        """
+        buffer = self._consumer(queue)
+        waiter = asyncio.ensure_future(buffer.get())
+        start = time.monotonic()
+        try:
+            done, _ = await asyncio.wait([waiter, self.closed], timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            #Otherwise the abandoned get would swallow the next message
+            waiter.cancel()
+            raise
+        if waiter not in done:
+            waiter.cancel()
+            if self.closed in done:
+                raise self.closed.result()
+            self.metrics.waited(time.monotonic() - start, timed_out=True)
+            raise rabbitmq.RabbitTimedOutException("Operation timeout reached.")
+        self.metrics.waited(time.monotonic() - start)
+
+        msg = waiter.result()
+        if not msg:
+            raise rabbitmq.RabbitConsumerException('Consumer cancelled by broker.')
+
+        method, properties, body = msg
+        self.inbound += 1
+        self.metrics.received(queue.name, body)
+        self.channel.basic_ack(method.delivery_tag)
+        return self.decode_body(body, properties), properties
+
+    async def receive(self, handler=None, timeout: int = 30, max_messages: int = 0,
+                      queue: rabbitmq.RabbitQueue = None, with_properties: bool = False) -> str:
+        """
+            Start receiving messages, up to max_messages
+            The handler may be a plain function or a coroutine function
+
+            Throws:
+                Exception if consume fails
+
+            Returns:
+                The last message received
+        """
+        msgs = 0
+        body = None
+
+        if not queue:
+            queue = self.sub_queue
+
+        while True:
+            body, properties = await self.next_message(queue, timeout)
+            msgs += 1
+
+            if handler:
+                result = handler(body, properties) if with_properties else handler(body)
+                if asyncio.iscoroutine(result):
+                    await result
+            elif not max_messages:
+                break
+
+            #Stop consuming if message limit reached
+            if msgs == max_messages:
+                break
+        return body
+
+    async def stop(self):
+        """
+            Closes open channels and connections
+
+            Throws:
+                Nothing
+
+            Returns:
+                None
+        """
+        try:
+            if self.connection and self.connection.is_open:
+                self.connection.close()
+                await asyncio.wait_for(asyncio.shield(self.closed), self.context.timeout())
+        except Exception:
+            pass
+
+
+class AsyncRabbitDualClient():
+    """
+        Communicates with a RabbitMQ service from an asyncio event loop
+    """
+    #Client class used unless start_subscriber/start_publisher are given one
+    transport = None
+
+    def __init__(self, context):
+        """
+            Class initializer
+        """
+        self.context = context
+        self.subscriber = None
+        self.publisher = None
+        self.last_recv_msg = None
+        #Concurrent requests awaiting a reply, by reply queue then correlation id
+        self.pending = {}
+        #Tasks routing replies to the pending requests, by reply queue
+        self.reply_pumps = {}
+        #Shared by the subscriber and publisher
+        self.metrics = rabbitmq.RabbitMetrics()
+
+    async def start_subscriber(self, queue: rabbitmq.RabbitQueue, client=None):
+        """
+            Start the subscriber connection to the broker
+
+            Throws:
+                An exception if connection attempt is not successful
+
+            Returns:
+                Nothing
+        """
+        if not client:
+            client = self.transport if self.transport else AsyncRabbitClient
+        self.subscriber = client(self.context)
+        self.subscriber.metrics = self.metrics
+        await self.subscriber.start(subscribe=queue)
+
+    def get_subscribe_queue(self):
+        """ Get the clients subscribe queue, default to None """
+        return self.subscriber.get_subscribe_queue()
+
+    async def start_publisher(self, queue: rabbitmq.RabbitQueue, client=None):
+        """
+            Start the publisher connection to the broker
+
+            Throws:
+                An exception if connection attempt is not successful
+
+            Returns:
+                Nothing
+        """
+        if not client:
+            client = self.transport if self.transport else AsyncRabbitClient
+        self.publisher = client(self.context)
+        self.publisher.metrics = self.metrics
+        await self.publisher.start(publish=queue)
+
+    async def send_message(self, message, queue: rabbitmq.RabbitQueue = None, delay: int = 0,
+                           correlation: str = None, priority: int = None,
+                           expiration: float = None):
+        """
+            Publish a message, delaying delivery by 'delay' seconds
+
+            Throws:
+                An exception if publish is not successful
+
+            Returns:
+                Nothing
+        """
+        await self.publisher.publish(message, queue, delay=delay, correlation=correlation,
+                                     priority=priority, expiration=expiration)
+
+    async def receive_message(self, handler, timeout: int, max_messages: int):
+        """
+            Receive messages
+
+            Throws:
+                An exception if receive is not successful
+
+            Returns:
+                Nothing
+        """
+        await self.subscriber.receive(handler, timeout, max_messages)
+
+    def internal_handler(self, message):
+        """
+            Handler for invoke_service method
+
+            Throws:
+                Nothing
+
+            Returns:
+                Nothing
+        """
+        self.last_recv_msg = message
+
+    def reply_correlation(self, message, properties) -> str:
+        """
+            Determine the correlation id of a reply, over-ride for
+            services that only echo the id in the message body
+
+            Throws:
+                Nothing
+
+            Returns:
+                The correlation id, or None
+        """
+        return properties.correlation_id if properties else None
+
+    async def _pump_replies(self, queue: rabbitmq.RabbitQueue):
+        """
+            Route the replies arriving on a queue to the requests waiting on it,
+            failing those still waiting once the pump stops for any reason
+
+            Throws:
+                Nothing
+
+            Returns:
+                Nothing
+        """
+        pending = self.pending.setdefault(queue.name, {})
+        error = rabbitmq.RabbitConsumerException('Reply consumer stopped.')
+        try:
+            while True:
+                try:
+                    message, properties = await self.subscriber.next_message(queue, None)
+                    correlation = self.reply_correlation(message, properties)
+                except (asyncio.CancelledError, rabbitmq.RabbitConsumerException):
+                    raise
+                except Exception as exc:
+                    #One unreadable reply must not strand the other requests
+                    LOGGER.error(f"Discarding unreadable reply on {queue.name}: {exc}")
+                    continue
+
+                if correlation is None and len(pending) == 1:
+                    #Service does not echo correlation ids, only one candidate
+                    correlation = next(iter(pending))
+                future = pending.pop(str(correlation), None)
+                if future:
+                    _resolve(future, message)
+                else:
+                    LOGGER.warning(f"Discarding unmatched reply ({correlation})")
+        except rabbitmq.RabbitConsumerException as exc:
+            error = exc
+        except Exception as exc:
+            LOGGER.error(f"Reply consumer on {queue.name} failed: {exc}")
+            error = rabbitmq.RabbitConsumerException(f'Reply consumer failed: {exc}')
+        finally:
+            for future in list(pending.values()):
+                _resolve(future, exc=error)
+
+    async def invoke_service(self, message, timeout: int = 30,
+                             queue: rabbitmq.RabbitQueue = None, correlation: str = None,
+                             priority: int = None) -> str:
+        """
+            Publish a message and wait for the reply
+            With a correlation id, many requests may be awaited concurrently
+            on the same reply queue
+            The request expires unread once the caller has stopped waiting
+
+            Throws:
+                An exception if not successful or timedout
+
+            Returns:
+                The reply
+        """
+        start = time.monotonic()
+        if correlation is None:
+            self.last_recv_msg = None
+            await self.send_message(message, priority=priority,
+                                    expiration=timeout if timeout else None)
+            await self.subscriber.receive(self.internal_handler, timeout, 1, queue)
+            self.metrics.replied(time.monotonic() - start)
+            return self.last_recv_msg
+
+        correlation = str(correlation)
+        if not queue:
+            queue = self.subscriber.sub_queue
+        pending = self.pending.setdefault(queue.name, {})
+        future = asyncio.get_running_loop().create_future()
+        pending[correlation] = future
+
+        #Each reply queue has its own pump, restarted if it has died
+        pump = self.reply_pumps.get(queue.name)
+        if not pump or pump.done():
+            self.reply_pumps[queue.name] = asyncio.ensure_future(self._pump_replies(queue))
+
+        try:
+            await self.send_message(message, correlation=correlation, priority=priority,
+                                    expiration=timeout if timeout else None)
+            reply = await asyncio.wait_for(future, timeout)
+            self.metrics.replied(time.monotonic() - start)
+            return reply
+        except asyncio.TimeoutError as exc:
+            raise rabbitmq.RabbitTimedOutException("Operation timeout reached.") from exc
+        finally:
+            pending.pop(correlation, None)
+
+    async def mktemp_queue(self) -> rabbitmq.RabbitQueue:
+        """ Create a temporary, broker defined queue """
+        queue = rabbitmq.RabbitQueue()
+        await self.subscriber.declare_queue(queue)
+        return queue
+
+    async def stop(self):
+        """
+            Close connection to service
+
+            Throws:
+                An exception if not successful
+
+            Returns:
+                Nothing
+        """
+        for pump in self.reply_pumps.values():
+            pump.cancel()
+        self.reply_pumps.clear()
+        await self.subscriber.stop()
+        await self.publisher.stop()
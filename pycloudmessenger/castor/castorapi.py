@@ -24,6 +24,7 @@
 
 import logging
 import pycloudmessenger.rabbitmq as rabbitmq
+import pycloudmessenger.aiorabbitmq as aiorabbitmq
 import pycloudmessenger.serializer as serializer
 import pycloudmessenger.castor.message_catalog as catalog
 import pycloudmessenger.castor.api_abc as api
@@ -42,6 +43,24 @@ class TimedOutException(rabbitmq.RabbitTimedOutException):
 class ConsumerException(rabbitmq.RabbitConsumerException):
     '''Over-ride exception'''
 
+#Transport failures and the exceptions they are raised as
+SERVICE_ERRORS = {rabbitmq.RabbitTimedOutException: TimedOutException,
+                  rabbitmq.RabbitConsumerException: ConsumerException}
+
+
+def request_correlation(message: dict) -> str:
+    """
+        The correlationID replies to a request are matched by
+
+        Throws:
+            ValueError if the request has none, e.g. not built by the message catalog
+    """
+    try:
+        return message['serviceRequest']['requestor']['correlationID']
+    except (KeyError, TypeError):
+        raise ValueError('Request has no serviceRequest.requestor.correlationID '
+                         'to match its reply by.') from None
+
 
 class CastorMessenger(rabbitmq.RabbitDualClient, api.CastorABC):
     """
@@ -58,14 +77,28 @@ class CastorMessenger(rabbitmq.RabbitDualClient, api.CastorABC):
 
         self.publish_queue = publish_queue
         self.subscribe_queue = subscribe_queue
+        self.reply_queue = None
         self.serializer = serializer.JsonSerializer()
 
     def __enter__(self):
-        self.start_subscriber(queue=rabbitmq.RabbitQueue(self.subscribe_queue))
-        self.start_publisher(queue=rabbitmq.RabbitQueue(self.publish_queue))
-        self.catalog = catalog.MessageCatalog(self.get_subscribe_queue())
+        if self.context.direct_reply() and not self.subscribe_queue:
+            #Replies come back on the publisher's channel, no queue to declare
+            self.start_subscriber(queue=None)
+            self.start_publisher(queue=rabbitmq.RabbitQueue(self.publish_queue))
+            self.reply_queue = self.mktemp_queue()
+        else:
+            self.start_subscriber(queue=rabbitmq.RabbitQueue(
+                self.subscribe_queue, persistent=self.context.persistent_consumers()))
+            self.start_publisher(queue=rabbitmq.RabbitQueue(self.publish_queue))
+            self.reply_queue = None
+        #Read for each request, as a reconnect renames a server named queue
+        self.catalog = catalog.MessageCatalog(self.reply_address)
         return self
 
+    def reply_address(self) -> str:
+        """ The queue replies are sent to """
+        return self.reply_queue.name if self.reply_queue else self.get_subscribe_queue()
+
     def __exit__(self, *args):
         self.stop()
         self.catalog = None
@@ -73,12 +106,41 @@ class CastorMessenger(rabbitmq.RabbitDualClient, api.CastorABC):
     def invoke_service(self, message, timeout: int = 30, queue: rabbitmq.RabbitQueue = None) -> str:
         try:
             message = self.serializer.serialize(message)
-            result = super(CastorMessenger, self).invoke_service(message, timeout)
+            result = super(CastorMessenger, self).invoke_service(message, timeout,
+                                                                 self.reply_queue)
         except rabbitmq.RabbitTimedOutException as exc:
             raise TimedOutException(exc) from exc
         except rabbitmq.RabbitConsumerException as exc:
             raise ConsumerException(exc) from exc
 
+        return self._parse_reply(result)
+
+    def invoke_service_async(self, message, timeout: int = 30) -> rabbitmq.RabbitFuture:
+        """
+            Publish a message without waiting for the reply
+            Replies are matched to requests by correlationID
+
+            Throws:
+                An exception if publish is not successful
+                ValueError if the message has no correlationID
+
+            Returns:
+                A future, resolved with the service result
+        """
+        correlation = request_correlation(message)
+        message = self.serializer.serialize(message)
+        return super(CastorMessenger, self).invoke_service_async(
+            message, correlation, timeout, self.reply_queue, decoder=self._parse_reply,
+            errors=SERVICE_ERRORS)
+
+    def reply_correlation(self, message, properties) -> str:
+        correlation = super(CastorMessenger, self).reply_correlation(message, properties)
+        if correlation is None:
+            reply = self.serializer.deserialize(message).get('serviceResponse', {})
+            correlation = reply.get('requestor', {}).get('correlationID')
+        return correlation
+
+    def _parse_reply(self, result):
         if not result:
             raise Exception(f"Malformed object: None")
         result = self.serializer.deserialize(result)
@@ -91,3 +153,57 @@ class CastorMessenger(rabbitmq.RabbitDualClient, api.CastorABC):
             raise Exception(msg)
 
         return result['serviceResponse']['service']['result']
+
+
+class AsyncCastorMessenger(aiorabbitmq.AsyncRabbitDualClient, api.CastorABC):
+    """
+        Communicates with a Castor service from an asyncio event loop
+        Requests are matched to replies by correlationID, so many
+        coroutines may share one messenger
+    """
+    _parse_reply = CastorMessenger._parse_reply
+
+    def __init__(self, context, publish_queue: str = None, subscribe_queue: str = None):
+        """
+            Class initializer
+        """
+        super(AsyncCastorMessenger, self).__init__(context)
+
+        if not publish_queue:
+            publish_queue = context.feeds()
+
+        self.publish_queue = publish_queue
+        self.subscribe_queue = subscribe_queue
+        self.serializer = serializer.JsonSerializer()
+
+    async def __aenter__(self):
+        await self.start_subscriber(queue=rabbitmq.RabbitQueue(self.subscribe_queue))
+        await self.start_publisher(queue=rabbitmq.RabbitQueue(self.publish_queue))
+        self.catalog = catalog.MessageCatalog(self.get_subscribe_queue)
+        return self
+
+    async def __aexit__(self, *args):
+        await self.stop()
+        self.catalog = None
+
+    def reply_correlation(self, message, properties) -> str:
+        correlation = super(AsyncCastorMessenger, self).reply_correlation(message, properties)
+        if correlation is None:
+            reply = self.serializer.deserialize(message).get('serviceResponse', {})
+            correlation = reply.get('requestor', {}).get('correlationID')
+        return correlation
+
+    async def invoke_service(self, message, timeout: int = 30,
+                             queue: rabbitmq.RabbitQueue = None, correlation: str = None) -> str:
+        if correlation is None:
+            correlation = request_correlation(message)
+        try:
+            message = self.serializer.serialize(message)
+            result = await super(AsyncCastorMessenger, self).invoke_service(
+                message, timeout, correlation=correlation)
+        except rabbitmq.RabbitTimedOutException as exc:
+            raise TimedOutException(exc) from exc
+        except rabbitmq.RabbitConsumerException as exc:
+            raise ConsumerException(exc) from exc
+
+        return self._parse_reply(result)
@@ -26,8 +26,9 @@ import uuid
 
 
 class MessageCatalog():
-    def __init__(self, reply_to: str = None):
+    def __init__(self, reply_to=None):
         self.correlation = 0
+        #A queue name, or a callable returning the current one
         self.reply_to = reply_to
         self.client_id = str(uuid.uuid4())
 
@@ -67,8 +68,9 @@ class MessageCatalog():
         self.correlation += 1
         req = {'correlationID': self.correlation}
 
-        if self.reply_to:
-            req.update({'replyTo': self.reply_to,
+        reply_to = self.reply_to() if callable(self.reply_to) else self.reply_to
+        if reply_to:
+            req.update({'replyTo': reply_to,
                         'clientID': self.client_id, 'transient': True})
         return req
 
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+#author markpurcell@ie.ibm.com
+
+"""Message body compression.
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import zlib
+import threading
+from abc import ABC, abstractmethod
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CodecABC(ABC):
+    '''Body compression, announced by name in the content_encoding property'''
+
+    name = None
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        '''Compress a message body'''
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        '''Restore a compressed message body'''
+
+
+class ZlibCodec(CodecABC):
+    '''zlib, from the standard library'''
+
+    name = 'deflate'
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        '''Compress a message body'''
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        '''Restore a compressed message body'''
+        return zlib.decompress(data)
+
+
+class Lz4Codec(CodecABC):
+    '''LZ4 frames, faster but larger than zlib, requires the lz4 package'''
+
+    name = 'lz4'
+
+    def compress(self, data: bytes) -> bytes:
+        '''Compress a message body'''
+        return lz4.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        '''Restore a compressed message body'''
+        return lz4.decompress(data)
+
+
+class ZstdCodec(CodecABC):
+    '''Zstandard, requires the zstandard package'''
+
+    name = 'zstd'
+
+    def __init__(self, level: int = 3):
+        self.level = level
+        #zstandard (de)compressors are not thread safe, each thread gets its own
+        self.local = threading.local()
+
+    def compress(self, data: bytes) -> bytes:
+        '''Compress a message body'''
+        compressor = getattr(self.local, 'compressor', None)
+        if compressor is None:
+            compressor = self.local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        '''Restore a compressed message body'''
+        decompressor = getattr(self.local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self.local.decompressor = zstandard.ZstdDecompressor()
+        return decompressor.decompress(data)
+
+
+#Codecs by content_encoding name
+CODECS = {}
+
+
+def register(codec: CodecABC):
+    '''Make a codec available for compressing and, by name, decompressing'''
+    CODECS[codec.name] = codec
+
+
+def lookup(name: str) -> CodecABC:
+    '''Return the codec for a content_encoding, default to None'''
+    return CODECS.get(name) if name else None
+
+
+register(ZlibCodec())
+if lz4:
+    register(Lz4Codec())
+if zstandard:
+    register(ZstdCodec())
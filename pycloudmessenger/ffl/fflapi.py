@@ -26,10 +26,15 @@ in DRL funded by the European Union under the Horizon 2020 Program.
 # pylint: disable=R0903, R0913
 
 from typing import NamedTuple
+import os
+import mmap
+import contextlib
+import asyncio
 import logging
 import requests
 import pycloudmessenger.utils as utils
 import pycloudmessenger.rabbitmq as rabbitmq
+import pycloudmessenger.aiorabbitmq as aiorabbitmq
 import pycloudmessenger.serializer as serializer
 import pycloudmessenger.ffl.message_catalog as catalog
 import pycloudmessenger.ffl.abstractions as fflabc
@@ -59,7 +64,8 @@ class ModelWrapper(NamedTuple):
             if isinstance(model['model'], dict):
                 model = model['model']
             elif encoder:
-                blob = encoder.deserialize(model['model'])
+                #Taken out, so the encoded form can be freed while decoding
+                blob = encoder.deserialize(model.pop('model'))
         return ModelWrapper(model, blob)
 
 
@@ -71,14 +77,31 @@ class Context(rabbitmq.RabbitContext, fflabc.AbstractContext):
         :type download_models: `bool`
         :param dispatch_threshold: max model size to embed, or upload
         :type dispatch_threshold: `int`
+        :param io_thread: whether a dedicated thread services the broker connection
+        :type io_thread: `bool`
+        :param control_priority: priority of task control requests (stop, quit)
+                                 over model updates, on priority queues
+        :type control_priority: `int`
+        :param body_view: whether received messages are handed to the
+                          serializers as memoryviews, saving a copy
+        :type body_view: `bool`
+        :param persistent_consumers: whether consumers are kept between receives,
+                                     holding prefetched messages until stop
+        :type persistent_consumers: `bool`
     """
     def __init__(self, args: dict, user: str = None, password: str = None,
                  encoder: serializer.SerializerABC = serializer.JsonPickleSerializer,
                  user_dispatch: bool = True, download_models: bool = True,
-                 dispatch_threshold: int = 1024*1024*5):
+                 dispatch_threshold: int = 1024*1024*5, io_thread: bool = False,
+                 control_priority: int = 5, body_view: bool = False,
+                 persistent_consumers: bool = False):
         super().__init__(args, user, password, user_dispatch)
         self.args['download_models'] = download_models
         self.args['dispatch_threshold'] = dispatch_threshold
+        self.args['io_thread'] = io_thread
+        self.args['control_priority'] = control_priority
+        self.args['broker_body_view'] = body_view
+        self.args['broker_persistent_consumers'] = persistent_consumers
         self.model_encoder = encoder()
         self.encoder = serializer.JsonPickleSerializer()
 
@@ -98,6 +121,14 @@ class Context(rabbitmq.RabbitContext, fflabc.AbstractContext):
         """ Return setting default to None"""
         return self.args.get('dispatch_threshold', None)
 
+    def io_thread(self):
+        """ Return setting, default to False"""
+        return self.args.get('io_thread', False)
+
+    def control_priority(self):
+        """ Return setting, default to None"""
+        return self.args.get('control_priority', None)
+
 
 class TimedOutException(rabbitmq.RabbitTimedOutException):
     """Over-ride exception"""
@@ -107,7 +138,186 @@ class ConsumerException(rabbitmq.RabbitConsumerException):
     """Over-ride exception"""
 
 
-class Messenger(rabbitmq.RabbitDualClient):
+#Transport failures and the exceptions they are raised as
+SERVICE_ERRORS = {rabbitmq.RabbitTimedOutException: TimedOutException,
+                  rabbitmq.RabbitConsumerException: ConsumerException}
+
+
+class BaseMessenger():
+    """
+    Building requests to, and checking replies from, an FFL service, shared
+    by the blocking and asyncio messengers
+    """
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _service_errors():
+        """
+        Re-raise transport timeouts and consumer failures as FFL exceptions.
+        Throws: TimedOutException, ConsumerException
+        """
+        try:
+            yield
+        except rabbitmq.RabbitTimedOutException as exc:
+            raise TimedOutException(exc) from exc
+        except rabbitmq.RabbitConsumerException as exc:
+            raise ConsumerException(exc) from exc
+
+    def _service_request(self, message: dict) -> tuple:
+        """
+        Address the reply to a request to the command queue and serialize it.
+        :param message: message built by the message catalog
+        :type message: `dict`
+        :return: serialized message and its correlation id
+        :rtype: `tuple`
+        """
+        #Need a reply, so add this to the request message
+        message = self.catalog.msg_assign_reply(message, self.command_queue.name)
+        correlation = message['serviceRequest']['requestor']['correlationID']
+        return self.context.serializer().serialize(message), correlation
+
+    def _parse_reply(self, result) -> dict:
+        """
+        Check and unpack a service reply.
+        Throws: An exception on failure
+        :param result: serialized reply
+        :type result: `bytes`
+        :return: reply data
+        :rtype: `dict`
+        """
+        if not result:
+            raise fflabc.MalformedResponseException(f"Malformed object: None")
+        result = self.context.serializer().deserialize(result)
+
+        if 'error' in result:
+            raise fflabc.ServerException(f"Server Error ({result['activation']}): {result['error']}")
+
+        if 'calls' not in result:
+            raise fflabc.MalformedResponseException(f"Malformed object: {result}")
+
+        results = result['calls'][0]['count']  # calls[0] will always succeed
+        return result['calls'][0]['data'] if results else []
+
+    def reply_correlation(self, message, properties) -> str:
+        """
+        Determine the correlation id of a reply, falling back to the requestor
+        information echoed in the message body.
+        :return: correlation id
+        :rtype: `str`
+        """
+        correlation = super(BaseMessenger, self).reply_correlation(message, properties)
+        if correlation is None:
+            reply = self.context.serializer().deserialize(message)
+            correlation = reply.get('requestor', {}).get('correlationID')
+        return correlation
+
+    def _upload_request(self, task_name: str, wrapper: ModelWrapper) -> dict:
+        """
+        Determine the request for a model's upload location.
+        :param task_name: name of the task, for a task object
+        :type task_name: `str`
+        :param wrapper: wrapped model
+        :type wrapper: :class:`.ModelWrapper`
+        :return: request message, or None if the model is to be embedded
+        :rtype: `dict`
+        """
+        if task_name:
+            return self.catalog.msg_bin_upload_object(task_name)
+        if len(wrapper.blob) > self.context.dispatch_threshold():
+            return self.catalog.msg_bin_uploader()
+        #Small model - embed it
+        return None
+
+    @staticmethod
+    def _upload_key(upload_info: dict) -> str:
+        """
+        Extract the object key from the upload location.
+        Throws: MalformedResponseException if there is none
+        :param upload_info: upload location
+        :type upload_info: `dict`
+        :return: object key
+        :rtype: `str`
+        """
+        if 'key' not in upload_info['fields']:
+            raise fflabc.MalformedResponseException('Update Error: Malformed URL')
+        return upload_info['fields']['key']
+
+    def _download_request(self, task_name: str, key: str) -> dict:
+        """
+        Determine the request for an uploaded model's download location.
+        :param task_name: name of the task, for a task object
+        :type task_name: `str`
+        :param key: object key
+        :type key: `str`
+        :return: request message
+        :rtype: `dict`
+        """
+        if task_name:
+            return self.catalog.msg_bin_download_object(key)
+        return self.catalog.msg_bin_downloader(key)
+
+    def _parse_notification(self, msg: dict, flavours: list) -> fflabc.Response:
+        """
+        Check a notification against the expected flavours and unpack its model.
+        Throws: An exception on failure
+        :param msg: received message
+        :type msg: `dict`
+        :param flavours: expected notification types
+        :type flavours: `list`
+        :return: received message
+        :rtype: `class Response`
+        """
+        if 'notification' not in msg:
+            raise fflabc.BadNotificationException(f"Malformed object: {msg}")
+
+        if 'type' not in msg['notification']:
+            raise fflabc.BadNotificationException(f"Malformed object: {msg['notification']}")
+
+        try:
+            if fflabc.Notification(msg['notification']['type']) not in flavours:
+                raise ValueError
+        except:
+            raise fflabc.BadNotificationException(f"Unexpected notification " \
+                f"{msg['notification']['type']}, expecting {flavours}")
+
+        if 'params' not in msg:
+            raise fflabc.BadNotificationException(f"Malformed payload: {msg}")
+
+        model = None
+
+        if msg['params']:
+            model = ModelWrapper.unwrap(msg['params'], self.context.model_serializer())
+
+            if model.blob:
+                #Embedded model
+                model = model.blob
+            else:
+                #Download from bin store
+                url = model.wrapping.get('url', None)
+                if not url:
+                    raise fflabc.MalformedResponseException(f"Malformed wrapping: {model.wrapping}")
+
+                #Download from bin store
+                if self.context.download_models():
+                    self.model_files.append(utils.FileDownloader(url))
+
+                    #Decoded straight from the mapped file, rather than a copy read into memory
+                    with open(self.model_files[-1].name(), 'rb') as model_file:
+                        if os.fstat(model_file.fileno()).st_size:
+                            with mmap.mmap(model_file.fileno(), 0,
+                                           access=mmap.ACCESS_READ) as buff:
+                                model = self.context.model_serializer().deserialize(buff)
+                        else:
+                            #An empty file cannot be mapped
+                            model = self.context.model_serializer().deserialize(model_file.read())
+                else:
+                    #Let user decide what to do
+                    model = model.wrapping
+
+        return fflabc.Response(msg['notification'], model)
+
+
+class Messenger(BaseMessenger, rabbitmq.RabbitDualClient):
     """
     Class for communicating with an FFL service
     """
@@ -133,14 +343,20 @@ class Messenger(rabbitmq.RabbitDualClient):
             # Publish not over-ridden so use context version
             publish_queue = context.feeds()
 
-        self.start_subscriber(queue=rabbitmq.RabbitQueue(subscribe_queue))
+        # Consumers may live for the session, avoiding a consume/cancel per
+        # receive, but then hold their prefetched messages until stop
+        persistent = context.persistent_consumers()
+        self.start_subscriber(queue=rabbitmq.RabbitQueue(subscribe_queue, persistent=persistent))
         self.start_publisher(queue=rabbitmq.RabbitQueue(publish_queue))
 
         if subscribe_queue:
-            self.command_queue = super().mktemp_queue()
+            self.command_queue = super().mktemp_queue(persistent=persistent)
         else:
             self.command_queue = self.subscriber.sub_queue
 
+        if context.io_thread():
+            self.start_io()
+
         # List of messages/models downloaded
         self.model_files = []
 
@@ -185,15 +401,11 @@ class Messenger(rabbitmq.RabbitDualClient):
         if not timeout:
             timeout = self.timeout
 
-        try:
+        with self._service_errors():
             super(Messenger, self).receive_message(self.internal_handler, timeout, 1)
-        except rabbitmq.RabbitTimedOutException as exc:
-            raise TimedOutException(exc) from exc
-        except rabbitmq.RabbitConsumerException as exc:
-            raise ConsumerException(exc) from exc
         return self.context.serializer().deserialize(self.last_recv_msg)
 
-    def _invoke_service(self, message: dict, timeout: int = 0) -> dict:
+    def _invoke_service(self, message: dict, timeout: int = 0, priority: int = None) -> dict:
         """
         Send a message and wait for a reply or until timeout.
         Throws: An exception on failure
@@ -201,36 +413,41 @@ class Messenger(rabbitmq.RabbitDualClient):
         :type message: `dict`
         :param timeout: timeout in seconds
         :type timeout: `int`
+        :param priority: message priority, for priority queues
+        :type priority: `int`
         :return: received message
         :rtype: `dict`
         """
         if not timeout:
             timeout = self.timeout
 
-        try:
-            #Need a reply, so add this to the request message
-            message = self.catalog.msg_assign_reply(message, self.command_queue.name)
-
-            message = self.context.serializer().serialize(message)
+        with self._service_errors():
+            message, _ = self._service_request(message)
             result = super(Messenger, self).invoke_service(message, timeout,
-                                                           queue=self.command_queue)
-        except rabbitmq.RabbitTimedOutException as exc:
-            raise TimedOutException(exc) from exc
-        except rabbitmq.RabbitConsumerException as exc:
-            raise ConsumerException(exc) from exc
-
-        if not result:
-            raise fflabc.MalformedResponseException(f"Malformed object: None")
-        result = self.context.serializer().deserialize(result)
+                                                           queue=self.command_queue,
+                                                           priority=priority)
+        return self._parse_reply(result)
 
-        if 'error' in result:
-            raise fflabc.ServerException(f"Server Error ({result['activation']}): {result['error']}")
-
-        if 'calls' not in result:
-            raise fflabc.MalformedResponseException(f"Malformed object: {result}")
+    def invoke_service_async(self, message: dict, timeout: int = 0) -> rabbitmq.RabbitFuture:
+        """
+        Send a message and return immediately, without waiting for the reply.
+        Many requests may be outstanding at once, replies are matched by correlationID.
+        Throws: An exception on failure
+        :param message: message to be sent, as built by the message catalog
+        :type message: `dict`
+        :param timeout: timeout in seconds, applied when the result is requested
+        :type timeout: `int`
+        :return: future resolved with the reply data
+        :rtype: :class:`.rabbitmq.RabbitFuture`
+        """
+        if not timeout:
+            timeout = self.timeout
 
-        results = result['calls'][0]['count']  # calls[0] will always succeed
-        return result['calls'][0]['data'] if results else []
+        message, correlation = self._service_request(message)
+        return super(Messenger, self).invoke_service_async(message, correlation, timeout,
+                                                           queue=self.command_queue,
+                                                           decoder=self._parse_reply,
+                                                           errors=SERVICE_ERRORS)
 
     def _dispatch_model(self, task_name: str = None, model: dict = None) -> dict:
         """
@@ -247,21 +464,12 @@ class Messenger(rabbitmq.RabbitDualClient):
             return wrapper.wrapping
 
         # First, obtain the upload location/keys
-        if task_name:
-            message = self.catalog.msg_bin_upload_object(task_name)
-        else:
-            if len(wrapper.blob) > self.context.dispatch_threshold():
-                message = self.catalog.msg_bin_uploader()
-            else:
-                #Small model - embed it
-                return wrapper.wrapping
+        message = self._upload_request(task_name, wrapper)
+        if not message:
+            return wrapper.wrapping
 
         upload_info = self._invoke_service(message)
-
-        if 'key' not in upload_info['fields']:
-            raise fflabc.MalformedResponseException('Update Error: Malformed URL')
-
-        key = upload_info['fields']['key']
+        key = self._upload_key(upload_info)
 
         try:
             with rabbitmq.RabbitHeartbeat(self.subscriber):
@@ -277,12 +485,7 @@ class Messenger(rabbitmq.RabbitDualClient):
             raise fflabc.DispatchException(f'General Update Error')
 
         # Now obtain the download location/keys
-        if task_name:
-            message = self.catalog.msg_bin_download_object(key)
-        else:
-            message = self.catalog.msg_bin_downloader(key)
-
-        download_info = self._invoke_service(message)
+        download_info = self._invoke_service(self._download_request(task_name, key))
         wrapper = ModelWrapper.wrap({'url': download_info, 'key': key})
         return wrapper.wrapping
 
@@ -442,7 +645,7 @@ class Messenger(rabbitmq.RabbitDualClient):
         :type task_name: `str`
         """
         message = self.catalog.msg_task_quit(task_name)
-        return self._invoke_service(message)
+        return self._invoke_service(message, priority=self.context.control_priority())
 
     def task_start(self, task_name: str, model: dict = None, participant: str = None) -> None:
         """
@@ -470,7 +673,7 @@ class Messenger(rabbitmq.RabbitDualClient):
         """
         model_message = self._dispatch_model(task_name=task_name, model=model)
         message = self.catalog.msg_task_stop(task_name, model_message)
-        return self._invoke_service(message)
+        return self._invoke_service(message, priority=self.context.control_priority())
 
 
     def task_notification(self, timeout: int = 0, flavours: list = None) -> dict:
@@ -487,49 +690,230 @@ class Messenger(rabbitmq.RabbitDualClient):
         :rtype: `dict`
         """
         msg = self.receive(timeout)
+        return self._parse_notification(msg, flavours)
 
-        if 'notification' not in msg:
-            raise fflabc.BadNotificationException(f"Malformed object: {msg}")
 
-        if 'type' not in msg['notification']:
-            raise fflabc.BadNotificationException(f"Malformed object: {msg['notification']}")
+class AsyncMessenger(BaseMessenger, aiorabbitmq.AsyncRabbitDualClient):
+    """
+    Class for communicating with an FFL service from an asyncio event loop.
+    Requests are matched to replies by correlationID, so many coroutines
+    may share one messenger. The public methods are those of Messenger,
+    as coroutines.
+    """
+
+    def __init__(self, context: Context, publish_queue: str = None,
+                 subscribe_queue: str = None):
+        """
+        Class initializer, call start (or use as an async context manager) to connect
+        :param context: connection details
+        :type context: :class:`.Context`
+        :param publish_queue: name of the publish queue
+        :type publish_queue: `str`
+        :param subscribe_queue: name of the subscribe queue
+        :type subscribe_queue: `str`
+        """
+        super(AsyncMessenger, self).__init__(context)
+        self.timeout = context.timeout()
+        self.catalog = catalog.MessageCatalog()
+        self.publish_queue = publish_queue if publish_queue else context.feeds()
+        self.subscribe_queue = subscribe_queue
+        self.command_queue = None
+        self.model_files = []
+
+    async def start(self):
+        """
+        Connect to the messaging system.
+        Throws: An exception on failure
+        :return: self
+        :rtype: :class:`.AsyncMessenger`
+        """
+        await self.start_subscriber(queue=rabbitmq.RabbitQueue(self.subscribe_queue))
+        await self.start_publisher(queue=rabbitmq.RabbitQueue(self.publish_queue))
+
+        if self.subscribe_queue:
+            self.command_queue = await self.mktemp_queue()
+        else:
+            self.command_queue = self.subscriber.sub_queue
+        return self
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def _send(self, message: dict, queue: str = None) -> None:
+        """
+        Send a message and return once the broker has accepted it.
+        Throws: An exception on failure
+        :param message: message to be sent
+        :type message: `dict`
+        :param queue: name of the publish queue
+        :type queue: `str`
+        """
+        message = self.context.serializer().serialize(message)
+        pub_queue = rabbitmq.RabbitQueue(queue) if queue else None
+        await self.send_message(message, pub_queue)
+
+    async def receive(self, timeout: int = 0) -> dict:
+        """
+        Wait for a message to arrive or until timeout.
+        Throws: An exception on failure
+        :param timeout: timeout in seconds
+        :type timeout: `int`
+        :return: received message
+        :rtype: `dict`
+        """
+        if not timeout:
+            timeout = self.timeout
+
+        with self._service_errors():
+            await self.receive_message(self.internal_handler, timeout, 1)
+        return self.context.serializer().deserialize(self.last_recv_msg)
+
+    async def _invoke_service(self, message: dict, timeout: int = 0, priority: int = None) -> dict:
+        """
+        Send a message and wait for a reply or until timeout.
+        Throws: An exception on failure
+        :param message: message to be sent
+        :type message: `dict`
+        :param timeout: timeout in seconds
+        :type timeout: `int`
+        :param priority: message priority, for priority queues
+        :type priority: `int`
+        :return: received message
+        :rtype: `dict`
+        """
+        if not timeout:
+            timeout = self.timeout
+
+        with self._service_errors():
+            message, correlation = self._service_request(message)
+            result = await self.invoke_service(message, timeout, queue=self.command_queue,
+                                               correlation=correlation, priority=priority)
+        return self._parse_reply(result)
+
+    async def _dispatch_model(self, task_name: str = None, model: dict = None) -> dict:
+        """
+        Dispatch a model and determine its download location.
+        The upload itself runs on the default executor.
+        Throws: An exception on failure
+        :param model: model to be sent
+        :type model: `dict`
+        :return: download location information
+        :rtype: `dict`
+        """
+        wrapper = ModelWrapper.wrap(model, self.context.model_serializer())
+        if not model:
+            return wrapper.wrapping
+
+        message = self._upload_request(task_name, wrapper)
+        if not message:
+            return wrapper.wrapping
+
+        upload_info = await self._invoke_service(message)
+        key = self._upload_key(upload_info)
+
+        def upload():
+            response = requests.post(upload_info['url'],
+                                     files={'file': wrapper.blob},
+                                     data=upload_info['fields'],
+                                     headers=None)
+            response.raise_for_status()
 
         try:
-            if fflabc.Notification(msg['notification']['type']) not in flavours:
-                raise ValueError
+            await asyncio.get_running_loop().run_in_executor(None, upload)
+        except requests.exceptions.RequestException as err:
+            raise fflabc.DispatchException(err) from err
         except:
-            raise fflabc.BadNotificationException(f"Unexpected notification " \
-                f"{msg['notification']['type']}, expecting {flavours}")
+            raise fflabc.DispatchException(f'General Update Error')
 
-        if 'params' not in msg:
-            raise fflabc.BadNotificationException(f"Malformed payload: {msg}")
+        download_info = await self._invoke_service(self._download_request(task_name, key))
+        wrapper = ModelWrapper.wrap({'url': download_info, 'key': key})
+        return wrapper.wrapping
 
-        model = None
+    # Public methods, see Messenger for details
 
-        if msg['params']:
-            model = ModelWrapper.unwrap(msg['params'], self.context.model_serializer())
+    async def user_create(self, user_name: str, password: str, organisation: str) -> dict:
+        """ Register a new user on the platform. """
+        message = self.catalog.msg_user_create(user_name, password, organisation)
+        return await self._invoke_service(message)
 
-            if model.blob:
-                #Embedded model
-                model = model.blob
-            else:
-                #Download from bin store
-                url = model.wrapping.get('url', None)
-                if not url:
-                    raise fflabc.MalformedResponseException(f"Malformed wrapping: {model.wrapping}")
+    async def user_tasks(self) -> list:
+        """ Returns all the tasks created by the user. """
+        return await self._invoke_service(self.catalog.msg_user_tasks())
 
-                #Download from bin store
-                if self.context.download_models():
-                    self.model_files.append(utils.FileDownloader(url))
+    async def user_assignments(self) -> list:
+        """ Returns all the tasks the user is participating in. """
+        return await self._invoke_service(self.catalog.msg_user_assignments())
 
-                    with open(self.model_files[-1].name(), 'rb') as model_file:
-                        buff = model_file.read()
-                        model = self.context.model_serializer().deserialize(buff)
-                else:
-                    #Let user decide what to do
-                    model = model.wrapping
+    async def task_assignment_info(self, task_name: str) -> dict:
+        """ Returns the details of the participant's task assignment. """
+        message = await self._invoke_service(self.catalog.msg_task_assignment_info(task_name))
+        return message[0]
 
-        return fflabc.Response(msg['notification'], model)
+    async def task_assignment_join(self, task_name: str) -> dict:
+        """ As a potential task participant, try to join the task. """
+        message = await self._invoke_service(self.catalog.msg_task_join(task_name))
+        return message[0]
+
+    async def task_assignment_update(self, task_name: str, model: dict = None) -> None:
+        """ Sends an update with the respect to the given task assignment. """
+        self.model_files.clear()
+        model_message = await self._dispatch_model(model=model)
+        await self._send(self.catalog.msg_task_assignment_update(task_name, model=model_message))
+
+    async def task_assignments(self, task_name: str) -> list:
+        """ Returns a list with all the assignments for the owned task. """
+        return await self._invoke_service(self.catalog.msg_task_assignments(task_name))
+
+    async def task_listing(self) -> dict:
+        """ Returns a list with all the available tasks. """
+        return await self._invoke_service(self.catalog.msg_task_listing())
+
+    async def task_create(self, task_name: str, topology: str, definition: dict) -> dict:
+        """ Creates a task with the given definition. """
+        message = self.catalog.msg_task_create(task_name, topology, definition)
+        message = await self._invoke_service(message)
+        return message[0]
+
+    async def task_update(self, task_name: str, status: str, topology: str = None,
+                          definition: dict = None) -> dict:
+        """ Updates a task with the given details. """
+        message = self.catalog.msg_task_update(task_name, topology, definition, status)
+        return await self._invoke_service(message)
+
+    async def task_info(self, task_name: str) -> dict:
+        """ Returns the details of a given task. """
+        message = await self._invoke_service(self.catalog.msg_task_info(task_name))
+        return message[0]
+
+    async def task_quit(self, task_name: str) -> None:
+        """ As a task participant, leave the given task. """
+        return await self._invoke_service(self.catalog.msg_task_quit(task_name),
+                                          priority=self.context.control_priority())
+
+    async def task_start(self, task_name: str, model: dict = None, participant: str = None) -> None:
+        """ As a task creator, start the given task. """
+        self.model_files.clear()
+        model_message = await self._dispatch_model(model=model)
+        await self._send(self.catalog.msg_task_start(task_name, model_message, participant))
+
+    async def task_stop(self, task_name: str, model: dict = None) -> None:
+        """ As a task creator, stop the given task. """
+        model_message = await self._dispatch_model(task_name=task_name, model=model)
+        return await self._invoke_service(self.catalog.msg_task_stop(task_name, model_message),
+                                          priority=self.context.control_priority())
+
+    async def task_notification(self, timeout: int = 0, flavours: list = None) -> dict:
+        """
+        Wait for a notification and check it against the expected flavours.
+        Model downloads run on the default executor.
+        Throws: An exception on failure
+        """
+        msg = await self.receive(timeout)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._parse_notification, msg, flavours)
 
 
 class BasicParticipant():
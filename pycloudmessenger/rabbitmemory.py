@@ -0,0 +1,890 @@
+#!/usr/bin/env python3
+#author markpurcell@ie.ibm.com
+
+"""In-process RabbitMQ stand-in.
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+
+Implements the subset of the broker (and of pika's BlockingConnection and
+BlockingChannel) used by RabbitClient, so that clients, and the FFL and Castor
+messengers built on them, can run without a network:
+
+    broker = rabbitmemory.MemoryBroker()
+    messenger.transport = rabbitmemory.MemoryClient.on(broker)
+
+or, for the asyncio messengers, AsyncMemoryClient.on(broker).
+
+Supported: the default exchange (any other exchange routes by queue name too),
+exclusive and server named queues, prefetch, x-delay delayed delivery (through
+any named exchange, the default exchange ignores it as without the plugin),
+publisher confirms (synchronous and windowed), mandatory returns, the user_id
+property check, direct reply-to and consumer cancellation when a queue is deleted.
+"""
+
+import copy
+import time
+import asyncio
+import heapq
+import logging
+import threading
+import weakref
+import itertools
+from functools import partial
+from collections import deque
+import pika
+from pika.spec import Basic, Queue, Connection
+from pika.frame import Method
+import pycloudmessenger.rabbitmq as rabbitmq
+import pycloudmessenger.aiorabbitmq as aiorabbitmq
+
+# pylint: disable=R0903, R0913
+
+LOGGER = logging.getLogger(__package__)
+
+
+class MemoryQueue():
+    """
+        A queue held by the broker
+    """
+    def __init__(self, name: str, exclusive=None, auto_delete: bool = False,
+                 durable: bool = False, arguments: dict = None):
+        self.name = name
+        #The connection owning an exclusive queue
+        self.exclusive = exclusive
+        self.auto_delete = auto_delete
+        self.durable = durable
+        #x-max-priority, x-message-ttl, x-max-length and x-overflow are honoured
+        self.arguments = arguments if arguments else {}
+        #(properties, body, redelivered, position, expires), in position order
+        #where position is (-priority, arrival)
+        self.messages = deque()
+        self.consumers = deque()
+        self.positions = itertools.count()
+
+    def append(self, properties, body) -> bool:
+        """ Add a message behind any of the same or higher priority, False if rejected """
+        limit = self.arguments.get('x-max-length')
+        if limit is not None and len(self.messages) >= limit:
+            if self.arguments.get('x-overflow', 'drop-head') != 'drop-head':
+                return False
+            if not self.messages:
+                return True
+            self.messages.popleft()
+
+        position = (-self.priority(properties), next(self.positions))
+        self.insert((properties, body, False, position, self.expiry(properties)))
+        return True
+
+    def priority(self, properties) -> int:
+        """ A message's priority, capped by x-max-priority, 0 on other queues """
+        maximum = self.arguments.get('x-max-priority')
+        if not maximum or not properties or not properties.priority:
+            return 0
+        return min(properties.priority, maximum)
+
+    def expiry(self, properties) -> float:
+        """ When a message expires, the sooner of the queue and message TTLs """
+        ttls = [self.arguments.get('x-message-ttl')]
+        if properties and properties.expiration is not None:
+            ttls.append(int(properties.expiration))
+        ttls = [ttl for ttl in ttls if ttl is not None]
+        return time.monotonic() + min(ttls) / 1000 if ttls else None
+
+    def insert(self, message: tuple):
+        """ Place a message by position, searching from the tail where most go """
+        index = len(self.messages)
+        while index and self.messages[index - 1][3] > message[3]:
+            index -= 1
+        self.messages.insert(index, message)
+
+    def restore(self, message: tuple):
+        """ Return a message to its original position, as RabbitMQ does when requeuing """
+        self.insert(message[:2] + (True,) + message[3:])
+
+    def pop(self) -> tuple:
+        """ Take the message at the head, discarding expired ones, None if there is none """
+        now = time.monotonic()
+        while self.messages:
+            message = self.messages.popleft()
+            if message[4] is None or message[4] > now:
+                return message
+        return None
+
+
+class MemoryConsumer():
+    """
+        A consumer registered on a queue
+    """
+    def __init__(self, channel, queue: MemoryQueue, tag: str, callback, no_ack: bool):
+        self.channel = channel
+        self.queue = queue
+        self.tag = tag
+        self.callback = callback
+        self.no_ack = no_ack
+        #Captured at consume time, as basic_qos only affects later consumers
+        self.prefetch = channel.prefetch
+        self.unacked = 0
+        #Delivery tags sent, but not yet handed to the callback
+        self.pending = set()
+
+    def ready(self) -> bool:
+        """ Whether the consumer can take another message """
+        return self.no_ack or not self.prefetch or self.unacked < self.prefetch
+
+
+class MemoryBroker():
+    """
+        Broker state shared by all connections to it, which may be used from
+        any number of threads
+
+        :param users: user names and passwords allowed to connect, default any
+        :param auto_create: create unknown queues on publish or consume, as
+                            service queues are normally provisioned up front
+    """
+    def __init__(self, users: dict = None, auto_create: bool = True):
+        self.lock = threading.RLock()
+        self.users = users
+        self.auto_create = auto_create
+        self.queues = {}
+        #Delayed messages (due, sequence, routing key, properties, body)
+        self.delayed = []
+        self.sequence = itertools.count(1)
+        #Open connections, and the resource alarm blocking their publishers
+        self.open = weakref.WeakSet()
+        self.blocked = None
+        #Whether clients can reach the broker
+        self.reachable = True
+
+    def connect(self, user: str, password: str = None):
+        """
+            Open a connection to the broker
+
+            Throws:
+                AMQPConnectionError if the broker is unreachable
+                ProbableAuthenticationError for unknown users
+
+            Returns:
+                The connection
+        """
+        if not self.reachable:
+            raise pika.exceptions.AMQPConnectionError('Connection refused')
+        if self.users is not None and self.users.get(user) != password:
+            raise pika.exceptions.ProbableAuthenticationError(
+                f"ACCESS_REFUSED - Login was refused for user '{user}'")
+        connection = MemoryConnection(self, user)
+        with self.lock:
+            self.open.add(connection)
+        return connection
+
+    def partition(self):
+        """ Cut clients off, dropping their connections, until heal() is called """
+        with self.lock:
+            self.reachable = False
+            connections = list(self.open)
+        for connection in connections:
+            connection.close(320, 'CONNECTION_FORCED - broker unreachable')
+
+    def heal(self):
+        """ Let clients reach the broker again """
+        with self.lock:
+            self.reachable = True
+
+    def block(self, reason: str = 'low on memory'):
+        """ Raise a resource alarm, telling connections to stop publishing """
+        with self.lock:
+            self.blocked = reason
+            for connection in list(self.open):
+                connection.notify_blocked(reason)
+
+    def unblock(self):
+        """ Clear the resource alarm, telling connections to resume publishing """
+        with self.lock:
+            self.blocked = None
+            for connection in list(self.open):
+                connection.notify_blocked(None)
+
+    def declare(self, name: str = '', connection=None, exclusive: bool = False,
+                auto_delete: bool = False, durable: bool = False,
+                arguments: dict = None) -> MemoryQueue:
+        """
+            Declare a queue, naming it if no name is given
+
+            Throws:
+                ChannelClosed if the queue is exclusive to another connection
+                or exists with other arguments
+
+            Returns:
+                The queue
+        """
+        with self.lock:
+            if not name:
+                name = f'amq.gen-{next(self.sequence)}'
+            queue = self.queues.get(name)
+            if not queue:
+                queue = MemoryQueue(name, connection if exclusive else None,
+                                    auto_delete, durable, arguments)
+                self.queues[name] = queue
+            self.check_owner(queue, connection)
+            if queue.arguments != (arguments if arguments else {}):
+                raise pika.exceptions.ChannelClosed(
+                    406, f"PRECONDITION_FAILED - inequivalent arg for queue '{name}'")
+            return queue
+
+    def queue(self, name: str, connection=None) -> MemoryQueue:
+        """
+            Look up a queue, creating it if auto_create is set
+
+            Throws:
+                ChannelClosed if the queue does not exist or is exclusive to
+                another connection
+
+            Returns:
+                The queue
+        """
+        with self.lock:
+            queue = self.queues.get(name)
+            if not queue and self.auto_create:
+                queue = self.declare(name)
+            if not queue:
+                raise pika.exceptions.ChannelClosed(
+                    404, f"NOT_FOUND - no queue '{name}' in vhost")
+            self.check_owner(queue, connection)
+            return queue
+
+    @staticmethod
+    def check_owner(queue: MemoryQueue, connection):
+        """ Only the declaring connection may use an exclusive queue """
+        if queue.exclusive and connection and queue.exclusive is not connection:
+            raise pika.exceptions.ChannelClosed(
+                405, f"RESOURCE_LOCKED - cannot obtain exclusive access to queue '{queue.name}'")
+
+    def delete(self, name: str):
+        """ Delete a queue, cancelling its consumers """
+        with self.lock:
+            queue = self.queues.pop(name, None)
+            if not queue:
+                return
+            for consumer in list(queue.consumers):
+                consumer.channel.cancelled(consumer)
+
+    def route(self, routing_key: str, properties: pika.BasicProperties, body,
+              exchange: str = '') -> bool:
+        """
+            Deliver a message to the queue named by the routing key, honouring
+            any x-delay header (in milliseconds) unless sent to the default exchange
+
+            Returns:
+                Whether the message was routable, None if the queue rejected it
+        """
+        with self.lock:
+            queue = self.queues.get(routing_key)
+            if not queue and self.auto_create:
+                queue = self.declare(routing_key)
+            if not queue:
+                return False
+
+            delay = (properties.headers or {}).get('x-delay') if properties else None
+            if delay and exchange:
+                due = time.monotonic() + delay / 1000
+                heapq.heappush(self.delayed, (due, next(self.sequence), routing_key,
+                                              properties, body))
+                for connection in self.connections():
+                    connection.wake()
+                return True
+
+            if not queue.append(properties, body):
+                return None
+            self.dispatch(queue)
+            return True
+
+    def release_due(self) -> float:
+        """
+            Route delayed messages that are now due
+
+            Returns:
+                Seconds until the next one is due, or None
+        """
+        with self.lock:
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                _, _, routing_key, properties, body = heapq.heappop(self.delayed)
+                queue = self.queues.get(routing_key)
+                if queue:
+                    queue.append(properties, body)
+                    self.dispatch(queue)
+            return self.delayed[0][0] - now if self.delayed else None
+
+    def dispatch(self, queue: MemoryQueue):
+        """ Push messages to consumers with spare prefetch, round robin """
+        with self.lock:
+            while queue.messages:
+                for _ in range(len(queue.consumers)):
+                    consumer = queue.consumers[0]
+                    queue.consumers.rotate(-1)
+                    if consumer.ready():
+                        break
+                else:
+                    return
+                message = queue.pop()
+                if not message:
+                    return
+                consumer.channel.deliver(consumer, message)
+
+    def requeue(self, queue: MemoryQueue, message: tuple):
+        """ Return a message to its queue """
+        with self.lock:
+            if self.queues.get(queue.name) is queue:
+                queue.restore(message)
+                self.dispatch(queue)
+
+    def connections(self) -> set:
+        """ Connections with consumers, which may be waiting for delayed messages """
+        with self.lock:
+            return {consumer.channel.connection for queue in self.queues.values()
+                    for consumer in queue.consumers}
+
+    def closed(self, connection):
+        """ Drop the exclusive queues of a closed connection """
+        with self.lock:
+            for queue in list(self.queues.values()):
+                if queue.exclusive is connection:
+                    self.delete(queue.name)
+
+
+class MemoryConnection():
+    """
+        Stands in for pika.BlockingConnection: callbacks for deliveries, confirms
+        and cancellations run inside process_data_events on the caller's thread
+    """
+    def __init__(self, broker: MemoryBroker, user: str):
+        self.broker = broker
+        self.user = user
+        self.is_open = True
+        self.channels = []
+        self.events = deque()
+        self.ready = threading.Condition(broker.lock)
+        self.blocked_callbacks = []
+        self.unblocked_callbacks = []
+        #Pending add_timeout callbacks: (deadline, sequence, callback)
+        self.timers = []
+        self.sequence = itertools.count()
+
+    @property
+    def is_closed(self) -> bool:
+        """ Opposite of is_open """
+        return not self.is_open
+
+    def channel(self):
+        """
+            Open a channel
+
+            Throws:
+                ConnectionClosed if the connection is closed
+
+            Returns:
+                The channel
+        """
+        if not self.is_open:
+            raise pika.exceptions.ConnectionClosed(320, 'Connection is closed')
+        channel = MemoryChannel(self, len(self.channels) + 1)
+        self.channels.append(channel)
+        return channel
+
+    def post(self, event):
+        """ Queue a callback to run on the connection's thread """
+        with self.ready:
+            self.events.append(event)
+            self.ready.notify_all()
+
+    def wake(self):
+        """ Wake a thread waiting for events, e.g. for a delayed message """
+        with self.ready:
+            self.ready.notify_all()
+
+    def add_callback_threadsafe(self, callback):
+        """ Run a callback from another thread on the connection's thread """
+        self.post(callback)
+
+    def add_on_connection_blocked_callback(self, callback):
+        """ Call back with a Connection.Blocked frame on a broker resource alarm """
+        with self.ready:
+            self.blocked_callbacks.append(callback)
+            if self.broker.blocked:
+                frame = Method(0, Connection.Blocked(self.broker.blocked))
+                self.post(partial(callback, frame))
+
+    def add_on_connection_unblocked_callback(self, callback):
+        """ Call back with a Connection.Unblocked frame when the alarm clears """
+        with self.ready:
+            self.unblocked_callbacks.append(callback)
+
+    def add_timeout(self, deadline: float, callback):
+        """ Call back on the connection's thread after 'deadline' seconds """
+        with self.ready:
+            timer = (time.monotonic() + deadline, next(self.sequence), callback)
+            heapq.heappush(self.timers, timer)
+            self.ready.notify_all()
+            return timer
+
+    def remove_timeout(self, timer):
+        """ Cancel a callback added with add_timeout """
+        with self.ready:
+            if timer in self.timers:
+                self.timers.remove(timer)
+                heapq.heapify(self.timers)
+
+    def notify_blocked(self, reason: str):
+        """ Tell the connection's callbacks it is blocked, or unblocked if no reason """
+        if reason:
+            frame, callbacks = Method(0, Connection.Blocked(reason)), self.blocked_callbacks
+        else:
+            frame, callbacks = Method(0, Connection.Unblocked()), self.unblocked_callbacks
+        for callback in callbacks:
+            self.post(partial(callback, frame))
+
+    def process_data_events(self, time_limit=0):
+        """
+            Run pending callbacks, waiting up to time_limit seconds for some
+            to arrive (forever if None)
+
+            Throws:
+                ConnectionClosed if the connection is closed
+
+            Returns:
+                None
+        """
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+
+        while True:
+            with self.ready:
+                if not self.is_open:
+                    raise pika.exceptions.ConnectionClosed(320, 'Connection is closed')
+                due = self.broker.release_due()
+                now = time.monotonic()
+                while self.timers and self.timers[0][0] <= now:
+                    self.events.append(heapq.heappop(self.timers)[2])
+                if self.timers:
+                    wait = self.timers[0][0] - now
+                    due = wait if due is None else min(due, wait)
+                if self.events:
+                    events = list(self.events)
+                    self.events.clear()
+                    break
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+                if due is not None:
+                    remaining = due if remaining is None else min(due, remaining)
+                self.ready.wait(remaining)
+
+        for event in events:
+            event()
+
+    def sleep(self, duration: float):
+        """ Process events for the given duration """
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            self.process_data_events(deadline - time.monotonic())
+
+    def close(self, reply_code: int = 200, reply_text: str = 'Normal shutdown'):
+        """ Close the connection, its channels and its exclusive queues """
+        if not self.is_open:
+            return
+        for channel in self.channels:
+            channel.close(reply_code, reply_text)
+        with self.ready:
+            self.is_open = False
+            self.broker.open.discard(self)
+            self.broker.closed(self)
+            self.ready.notify_all()
+
+
+class MemoryChannel():
+    """
+        Stands in for pika.adapters.blocking_connection.BlockingChannel
+    """
+    def __init__(self, connection: MemoryConnection, number: int):
+        self.connection = connection
+        self.broker = connection.broker
+        self.channel_number = number
+        self.is_open = True
+        self.prefetch = 0
+        self.consumers = {}
+        self.tags = itertools.count(1)
+        #Delivered, unacknowledged messages by delivery tag
+        self.unacked = {}
+        self.delivery_tag = 0
+        #Publisher confirm sequence, separate from delivery tags as in RabbitMQ
+        self.publish_seq = 0
+        #Publisher confirms: None, 'sync' or the windowed ack callback
+        self.confirms = None
+        self.return_callbacks = []
+        self.cancel_callbacks = []
+        #The channel's direct reply-to queue, once consumed
+        self.reply_queue = None
+        #The asynchronous channel interface used for windowed confirms
+        self._impl = self
+
+    @property
+    def is_closed(self) -> bool:
+        """ Opposite of is_open """
+        return not self.is_open
+
+    def check_open(self):
+        """ Raise if the channel (or its connection) has been closed """
+        if not self.connection.is_open:
+            raise pika.exceptions.ConnectionClosed(320, 'Connection is closed')
+        if not self.is_open:
+            raise pika.exceptions.ChannelClosed(406, 'Channel is closed')
+
+    def fail(self, error: pika.exceptions.ChannelClosed):
+        """ A channel level error closes the channel, as on a real broker """
+        self.close(*error.args)
+        raise error
+
+    def queue_declare(self, queue: str = '', passive: bool = False, durable: bool = False,
+                      exclusive: bool = False, auto_delete: bool = False, arguments=None):
+        """ Declare a queue, returning its (possibly server assigned) name """
+        self.check_open()
+        try:
+            if passive:
+                declared = self.broker.queue(queue, self.connection)
+            else:
+                declared = self.broker.declare(queue, self.connection, exclusive,
+                                               auto_delete, durable, arguments)
+        except pika.exceptions.ChannelClosed as exc:
+            self.fail(exc)
+        return Method(self.channel_number, Queue.DeclareOk(
+            declared.name, len(declared.messages), len(declared.consumers)))
+
+    def queue_purge(self, queue: str = ''):
+        """ Drop all ready messages from a queue """
+        self.check_open()
+        with self.broker.lock:
+            declared = self.broker.queues.get(queue)
+            count = len(declared.messages) if declared else 0
+            if declared:
+                declared.messages.clear()
+        return Method(self.channel_number, Queue.PurgeOk(count))
+
+    def queue_delete(self, queue: str = '', if_unused: bool = False, if_empty: bool = False):
+        """ Delete a queue, cancelling its consumers """
+        self.check_open()
+        self.broker.delete(queue)
+        return Method(self.channel_number, Queue.DeleteOk())
+
+    def basic_qos(self, prefetch_size: int = 0, prefetch_count: int = 0,
+                  all_channels: bool = False):
+        """ Limit unacknowledged deliveries for consumers created afterwards """
+        self.check_open()
+        self.prefetch = prefetch_count
+
+    def confirm_delivery(self, callback=None, nowait: bool = False):
+        """
+            Turn on publisher confirms, synchronous unless a callback is given
+            (as with the asynchronous channel)
+        """
+        self.check_open()
+        self.confirms = callback if callback else 'sync'
+        self.publish_seq = 0
+
+    def add_on_return_callback(self, callback):
+        """ Register for Basic.Return of unroutable mandatory messages """
+        self.return_callbacks.append(callback)
+
+    def add_on_cancel_callback(self, callback):
+        """ Register for consumers cancelled by the broker """
+        self.cancel_callbacks.append(callback)
+
+    def basic_publish(self, exchange: str, routing_key: str, body, properties=None,
+                      mandatory: bool = False, immediate: bool = False) -> bool:
+        """
+            Publish a message, checking the user_id property against the
+            connection's user as RabbitMQ does
+
+            Throws:
+                ChannelClosed if user_id does not match
+
+            Returns:
+                False if a mandatory message could not be routed, or in confirm
+                mode was rejected
+        """
+        routed = self.route(exchange, routing_key, body, properties, mandatory)
+        if routed is None and self.confirms:
+            return False
+        return routed is not False or not mandatory
+
+    def route(self, exchange: str, routing_key: str, body, properties, mandatory: bool) -> bool:
+        """ Publish a message, returning whether it was routed, None if rejected """
+        self.check_open()
+        if properties and properties.reply_to == rabbitmq.DIRECT_REPLY_TO:
+            if not self.reply_queue:
+                self.fail(pika.exceptions.ChannelClosed(
+                    406, 'PRECONDITION_FAILED - fast reply consumer does not exist'))
+            #The broker names the channel's reply queue in the reply_to property
+            properties = copy.copy(properties)
+            properties.reply_to = self.reply_queue
+
+        if properties and properties.user_id and properties.user_id != self.connection.user:
+            self.fail(pika.exceptions.ChannelClosed(
+                406, f"PRECONDITION_FAILED - user_id property set to '{properties.user_id}'"
+                f" but authenticated user was '{self.connection.user}'"))
+
+        if isinstance(body, str):
+            #As on the wire, consumers receive bytes
+            body = body.encode('utf-8')
+        routed = self.broker.route(routing_key, properties, body, exchange)
+
+        if callable(self.confirms):
+            self.publish_seq += 1
+            if routed is False and mandatory:
+                frame = Basic.Return(312, 'NO_ROUTE', exchange, routing_key)
+                for callback in self.return_callbacks:
+                    self.connection.post(
+                        lambda callback=callback: callback(self, frame, properties, body))
+            #Messages rejected by a full queue's x-overflow are nacked
+            confirm = Basic.Nack if routed is None else Basic.Ack
+            ack = Method(self.channel_number, confirm(self.publish_seq, False))
+            self.connection.post(lambda: self.confirms(ack))
+        return routed
+
+    def publish(self, exchange: str, routing_key: str, body, properties=None,
+                mandatory: bool = False, immediate: bool = False):
+        """
+            Publish a message, as BlockingChannel.publish
+
+            Throws:
+                UnroutableError if a mandatory message could not be routed
+                NackError if the message was rejected
+        """
+        routed = self.route(exchange, routing_key, body, properties, mandatory)
+        if routed is None and self.confirms:
+            raise pika.exceptions.NackError([(routing_key, properties, body)])
+        if routed is False and mandatory:
+            raise pika.exceptions.UnroutableError([(routing_key, properties, body)])
+
+    def basic_consume(self, consumer_callback, queue: str = '', no_ack: bool = False,
+                      exclusive: bool = False, consumer_tag: str = None, arguments=None) -> str:
+        """ Start a consumer, returning its tag """
+        self.check_open()
+        try:
+            if queue == rabbitmq.DIRECT_REPLY_TO:
+                if not no_ack:
+                    raise pika.exceptions.ChannelClosed(
+                        406, 'PRECONDITION_FAILED - reply consumer cannot acknowledge')
+                self.reply_queue = f'{queue}.g{next(self.broker.sequence)}'
+                declared = self.broker.declare(self.reply_queue, self.connection, exclusive=True)
+            else:
+                declared = self.broker.queue(queue, self.connection)
+        except pika.exceptions.ChannelClosed as exc:
+            self.fail(exc)
+
+        tag = consumer_tag if consumer_tag else f'ctag{self.channel_number}.{next(self.tags)}'
+        consumer = MemoryConsumer(self, declared, tag, consumer_callback, no_ack)
+        with self.broker.lock:
+            self.consumers[tag] = consumer
+            declared.consumers.append(consumer)
+            self.broker.dispatch(declared)
+        return tag
+
+    def deliver(self, consumer: MemoryConsumer, message: tuple):
+        """ Called by the broker to hand a message to a consumer """
+        properties, body, redelivered = message[:3]
+        self.delivery_tag += 1
+        method = Basic.Deliver(consumer.tag, self.delivery_tag, redelivered, '',
+                               consumer.queue.name)
+        if not consumer.no_ack:
+            consumer.unacked += 1
+            consumer.pending.add(self.delivery_tag)
+            self.unacked[self.delivery_tag] = (consumer, message)
+        self.connection.post(lambda: self.dispatch(consumer, method, properties, body))
+
+    def dispatch(self, consumer: MemoryConsumer, method, properties, body):
+        """ Run the consumer callback, unless cancelled meanwhile """
+        consumer.pending.discard(method.delivery_tag)
+        if consumer.tag in self.consumers:
+            consumer.callback(self, method, properties, body)
+        elif method.delivery_tag in self.unacked:
+            self.settle(method.delivery_tag, requeue=True)
+
+    def basic_cancel(self, consumer_tag: str = ''):
+        """
+            Stop a consumer, its unacknowledged messages stay with the channel
+            except those not yet handed to it, which are requeued as pika does
+        """
+        with self.broker.lock:
+            consumer = self.consumers.pop(consumer_tag, None)
+            if consumer and consumer in consumer.queue.consumers:
+                consumer.queue.consumers.remove(consumer)
+                #Auto-delete queues go once their last consumer has gone
+                if consumer.queue.auto_delete and not consumer.queue.consumers:
+                    self.broker.queues.pop(consumer.queue.name, None)
+            if consumer:
+                for tag in sorted(consumer.pending):
+                    if tag in self.unacked:
+                        self.settle(tag, requeue=True)
+                consumer.pending.clear()
+
+    def cancelled(self, consumer: MemoryConsumer):
+        """ Called by the broker when a consumer's queue is deleted """
+        self.basic_cancel(consumer.tag)
+        frame = Method(self.channel_number, Basic.Cancel(consumer.tag))
+        for callback in self.cancel_callbacks:
+            self.connection.post(lambda callback=callback: callback(frame))
+
+    def cancel(self):
+        """ Cancel all consumers """
+        for tag in list(self.consumers):
+            self.basic_cancel(tag)
+        return 0
+
+    def settle(self, delivery_tag: int, requeue: bool = False):
+        """ Retire a delivery, returning it to its queue if requeued """
+        with self.broker.lock:
+            consumer, message = self.unacked.pop(delivery_tag)
+            consumer.unacked -= 1
+            if requeue:
+                self.broker.requeue(consumer.queue, message)
+            else:
+                self.broker.dispatch(consumer.queue)
+
+    def _tags(self, delivery_tag: int, multiple: bool) -> list:
+        """ The unacknowledged deliveries covered by an ack or nack """
+        if multiple:
+            return [tag for tag in sorted(self.unacked) if tag <= delivery_tag]
+        if delivery_tag not in self.unacked:
+            self.fail(pika.exceptions.ChannelClosed(
+                406, f'PRECONDITION_FAILED - unknown delivery tag {delivery_tag}'))
+        return [delivery_tag]
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False):
+        """ Acknowledge one, or all up to and including, delivery tags """
+        self.check_open()
+        with self.broker.lock:
+            for tag in self._tags(delivery_tag, multiple):
+                self.settle(tag)
+
+    def basic_nack(self, delivery_tag: int = None, multiple: bool = False,
+                   requeue: bool = True):
+        """ Reject one, or all up to and including, delivery tags """
+        self.check_open()
+        with self.broker.lock:
+            for tag in self._tags(delivery_tag, multiple):
+                self.settle(tag, requeue)
+
+    def basic_reject(self, delivery_tag: int = None, requeue: bool = True):
+        """ Reject a single delivery """
+        self.basic_nack(delivery_tag, False, requeue)
+
+    def close(self, reply_code: int = 0, reply_text: str = 'Normal shutdown'):
+        """ Close the channel, returning unacknowledged messages to their queues """
+        with self.broker.lock:
+            if not self.is_open:
+                return
+            self.is_open = False
+            self.cancel()
+            for tag in sorted(self.unacked, reverse=True):
+                self.settle(tag, requeue=True)
+
+
+class MemoryClient(rabbitmq.RabbitClient):
+    """
+        RabbitClient connected to a MemoryBroker rather than a real broker,
+        the process wide BROKER unless bound to another with on()
+    """
+    broker = None
+
+    @classmethod
+    def on(cls, broker: MemoryBroker):
+        """ Return a client class bound to the given broker """
+        return type(cls.__name__, (cls,), {'broker': broker})
+
+    def open_connection(self, parameters: pika.ConnectionParameters):
+        """ Connect to the in-process broker """
+        broker = self.broker if self.broker else BROKER
+        return broker.connect(parameters.credentials.username,
+                              parameters.credentials.password)
+
+
+class MemoryAsyncChannel():
+    """
+        Stands in for pika's asynchronous Channel, whose RPC methods take the
+        callback for the reply frame as their first argument
+    """
+    def __init__(self, channel: MemoryChannel):
+        self.channel = channel
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+    def queue_declare(self, callback, *args, **kwargs):
+        """ Declare a queue, calling back with the Queue.DeclareOk frame """
+        callback(self.channel.queue_declare(*args, **kwargs))
+
+    def queue_purge(self, callback, *args, **kwargs):
+        """ Purge a queue, calling back with the Queue.PurgeOk frame """
+        callback(self.channel.queue_purge(*args, **kwargs))
+
+    def basic_qos(self, callback, *args, **kwargs):
+        """ Set the prefetch, calling back with the Basic.QosOk frame """
+        self.channel.basic_qos(*args, **kwargs)
+        callback(Method(self.channel.channel_number, Basic.QosOk()))
+
+
+class AsyncMemoryClient(aiorabbitmq.AsyncRabbitClient):
+    """
+        AsyncRabbitClient connected to a MemoryBroker rather than a real broker,
+        the process wide BROKER unless bound to another with on()
+        Deliveries and confirms are polled onto the event loop
+    """
+    broker = None
+    #Seconds between polls of the connection for callbacks
+    poll_interval = 0.001
+
+    def __init__(self, context: rabbitmq.RabbitContext):
+        super(AsyncMemoryClient, self).__init__(context)
+        self.events = None
+
+    @classmethod
+    def on(cls, broker: MemoryBroker):
+        """ Return a client class bound to the given broker """
+        return type(cls.__name__, (cls,), {'broker': broker})
+
+    async def establish_connection(self, parameters: pika.ConnectionParameters):
+        """ Connect to the in-process broker """
+        broker = self.broker if self.broker else BROKER
+        self.loop = asyncio.get_running_loop()
+        self.closed = self.loop.create_future()
+        self.connection = broker.connect(parameters.credentials.username,
+                                         parameters.credentials.password)
+        self.channel = MemoryAsyncChannel(self.connection.channel())
+        self.events = asyncio.ensure_future(self._process_events())
+
+    async def _process_events(self):
+        """ Run the connection's callbacks on the event loop until it closes """
+        while True:
+            try:
+                self.connection.process_data_events(0)
+            except pika.exceptions.ConnectionClosed as exc:
+                self.on_close(*exc.args)
+                return
+            await asyncio.sleep(self.poll_interval)
+
+
+#Process wide broker for clients not bound to one
+BROKER = MemoryBroker()
@@ -21,18 +21,39 @@
 """
 
 import ssl
+import time
+import socket
+import itertools
+import heapq
+import random
+import atexit
 import logging
 import json
+import uuid
+import struct
 import threading
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import NamedTuple
 from abc import ABC, abstractmethod
 import pika
 import pycloudmessenger.utils as utils
+import pycloudmessenger.compression as compression
+import pycloudmessenger.spool as spool
 
 # pylint: disable=R0903, R0913
 
 __rabbit_helper_version_info__ = ('0', '1', '2')
 LOGGER = logging.getLogger(__package__)
 
+#Some features hook into pika 0.13 internals (the version pinned in
+#requirements.txt), falling back to plain behaviour on other versions
+PIKA_0_13 = pika.__version__.startswith('0.13.')
+
+#RabbitMQ pseudo-queue for replies without a reply queue per client
+DIRECT_REPLY_TO = 'amq.rabbitmq.reply-to'
+
 
 
 class RabbitContext():
@@ -64,12 +85,18 @@ class RabbitContext():
             self.args['broker_cert_b64'] = self.args['cert_b64']
 
         if 'broker_cert_b64' in self.args:
-            self.cert_file = utils.Certificate(self.args['broker_cert_b64'])
+            #Shared by every context with the same certificate
+            self.cert_file = TLS_CACHE.certificate(self.args['broker_cert_b64'])
             self.args['broker_pem_path'] = self.cert_file.filename
             self.args['broker_tls'] = True
         else:
             self.args['broker_tls'] = False
 
+        #A broker cluster may be listed instead, the first node standing in for a single host
+        if self.args.get('broker_hosts') and not self.args.get('broker_host'):
+            self.args['broker_host'], port = self.endpoint(self.args['broker_hosts'][0], None)
+            self.args.setdefault('broker_port', port)
+
         #Now check that all required fields are present
         cfg = ['broker_host', 'broker_port', 'broker_vhost',
                'broker_user', 'broker_password']
@@ -80,6 +107,25 @@ class RabbitContext():
     def __str__(self):
         return json.dumps(self.args)
 
+    @staticmethod
+    def endpoint(host, port: int) -> tuple:
+        """
+            Parse a broker node, given as 'host', 'host:port' or (host, port)
+
+            Throws:
+                Nothing
+
+            Returns:
+                Tuple of (host, port), port defaulting to the one given
+        """
+        if not isinstance(host, str):
+            return tuple(host)
+        host = host.strip()
+        name, _, number = host.rpartition(':')
+        if name and number.isdigit() and ':' not in name:
+            return name, int(number)
+        return host, port
+
     def arg_value(self, args: dict, possibilities: list):
         """
             Determine if an argument is contained in a list
@@ -142,6 +188,18 @@ class RabbitContext():
     def port(self):
         """ Return port, default to None"""
         return self.args.get('broker_port', None)
+    def hosts(self):
+        """ Return the broker nodes as (host, port), from broker_hosts, default to host and port"""
+        hosts = self.args.get('broker_hosts') or self.host()
+        if isinstance(hosts, str):
+            hosts = hosts.split(',')
+        return [self.endpoint(host, self.port()) for host in hosts]
+    def host_selection(self):
+        """ Return how a broker node is picked: round_robin, random or latency"""
+        return self.args.get('broker_host_selection', 'round_robin')
+    def probe_interval(self):
+        """ Return seconds a latency probe result is reused for, default to 60"""
+        return self.args.get('broker_probe_interval', 60)
     def vhost(self):
         """ Return vhost, default to None"""
         return self.args.get('broker_vhost', None)
@@ -163,6 +221,76 @@ class RabbitContext():
     def delayed_exchange(self):
         """ Return delayed message exchange, default to None"""
         return self.args.get('broker_delayed_exchange', None)
+    def reconnect_attempts(self):
+        """ Return attempts to restore a lost connection, default to 0 (disabled)"""
+        return self.args.get('broker_reconnect_attempts', 0)
+    def declare_cache(self):
+        """ Return whether repeat queue declarations are skipped, default to True"""
+        return self.args.get('broker_declare_cache', True)
+    def declare_verify(self):
+        """ Return whether cached queues are checked with a passive declare, default to False"""
+        return self.args.get('broker_declare_verify', False)
+    def flow_control(self):
+        """ Return what publishes do while blocked or rate limited: block, fail or spool"""
+        return self.args.get('broker_flow_control', 'block')
+    def publish_rate(self):
+        """ Return the publish rate limit (messages per second), default to 0 (none)"""
+        return self.args.get('broker_publish_rate', 0)
+    def publish_burst(self):
+        """ Return publishes allowed in a burst above the rate, default to the rate"""
+        return self.args.get('broker_publish_burst', max(1, self.publish_rate()))
+    def spool_limit(self):
+        """ Return the most publishes spooled while blocked, default to 10000"""
+        return self.args.get('broker_spool_limit', 10000)
+    def spool_dir(self):
+        """ Return the directory spooling publishes to disk, default to None (memory)"""
+        return self.args.get('broker_spool_dir', None)
+    def spool_max_bytes(self):
+        """ Return the most bytes spooled to disk, default to 1GB"""
+        return self.args.get('broker_spool_max_bytes', 1024 * 1024 * 1024)
+    def spool_segment_bytes(self):
+        """ Return the size of each spool file, default to 16MB"""
+        return self.args.get('broker_spool_segment_bytes', 16 * 1024 * 1024)
+    def spool_fsync(self):
+        """ Return when the spool is synced to disk: always, interval or never"""
+        return self.args.get('broker_spool_fsync', 'interval')
+    def spool_fsync_interval(self):
+        """ Return seconds between spool syncs, default to 1"""
+        return self.args.get('broker_spool_fsync_interval', 1.0)
+    def blocked_timeout(self):
+        """ Return seconds blocked before the connection is dropped, default to None"""
+        return self.args.get('broker_blocked_timeout', None)
+    def compression(self):
+        """ Return the content_encoding to compress bodies with, default to None"""
+        return self.args.get('broker_compression', None)
+    def compression_threshold(self):
+        """ Return the smallest body size (bytes) compressed, default to 1024"""
+        return self.args.get('broker_compression_threshold', 1024)
+    def chunk_size(self):
+        """ Return the largest body (bytes) published whole, default to 0 (no chunking)"""
+        return self.args.get('broker_chunk_size', 0)
+    def chunk_buffer(self):
+        """ Return the most bytes held reassembling chunked bodies, default to 256MB"""
+        return self.args.get('broker_chunk_buffer', 256 * 1024 * 1024)
+    def chunk_expiry(self):
+        """ Return how long (seconds) an incomplete chunked body waits for its next chunk, default to 300, 0 for ever"""
+        return self.args.get('broker_chunk_expiry', 300)
+    def body_view(self):
+        """ Return whether received bodies are memoryviews rather than bytes, default to False"""
+        return self.args.get('broker_body_view', False)
+    def direct_reply(self):
+        """ Return whether replies use direct reply-to, default to False"""
+        return self.args.get('broker_direct_reply', False)
+    def persistent_consumers(self):
+        """ Return whether messengers keep their consumers between receives, default to False"""
+        return self.args.get('broker_persistent_consumers', False)
+    def pool_connections(self):
+        """ Return whether dual clients share pooled connections, default to False"""
+        return self.args.get('broker_pool_connections', False)
+    def reconnect_backoff(self):
+        """ Return (initial, maximum) reconnect delay in seconds"""
+        return (self.args.get('broker_reconnect_delay', 0.5),
+                self.args.get('broker_reconnect_max_delay', 30.0))
 
 
 class RabbitQueue():
@@ -170,11 +298,40 @@ class RabbitQueue():
         Holds configuration details for a RabbitMQ Queue
     """
     def __init__(self, queue: str = None, auto_delete: bool = False,
-                 durable: bool = False, purge: bool = False, prefetch: int = 1):
+                 durable: bool = False, purge: bool = False, prefetch: int = 1,
+                 confirm_window: int = 1, persistent: bool = False,
+                 ack_late: bool = False, ack_batch: int = 1, ack_interval: int = 0,
+                 max_priority: int = None, message_ttl: int = None, queue_type: str = None,
+                 max_length: int = None, overflow: str = None):
         self.durable = durable
         self.auto_delete = auto_delete
         self.purge = purge
+        #Acknowledge after the handler succeeds, rather than on receipt
+        self.ack_late = ack_late
+        #Coalesce acks every 'ack_batch' messages or 'ack_interval' milliseconds,
+        #timed on the connection, so without an I/O thread the interval only
+        #elapses while the client processes broker events (e.g. receives)
+        self.ack_batch = ack_batch
+        self.ack_interval = ack_interval
+        #The broker must be allowed to deliver at least a full batch (0 is unlimited)
+        if prefetch and prefetch < ack_batch:
+            raise ValueError(f'prefetch ({prefetch}) is smaller than ack_batch ({ack_batch}), '
+                             f'a batch would never fill.')
         self.prefetch = prefetch
+        #Unconfirmed publishes allowed in flight, 1 waits for each broker ack
+        self.confirm_window = confirm_window
+        #Keep consuming between receive calls, buffering up to 'prefetch' messages
+        self.persistent = persistent
+        #Queue arguments, only applied where the queue is declared
+        #Priorities 1..max_priority, higher delivered first
+        self.max_priority = max_priority
+        #Messages expire after 'message_ttl' milliseconds in the queue
+        self.message_ttl = message_ttl
+        #classic, quorum or stream
+        self.queue_type = queue_type
+        #Beyond 'max_length' messages, overflow is drop-head, reject-publish or reject-publish-dlx
+        self.max_length = max_length
+        self.overflow = overflow
 
         #If no queue specified, create a temporary, exclusive queue
         #This will force a server generated queue name like 'amq.gen....'
@@ -186,17 +343,526 @@ class RabbitQueue():
             self.exclusive = True
         self.name = self.name.strip()
 
+        #Direct reply-to is never declared and must be consumed without acks
+        self.direct = self.name == DIRECT_REPLY_TO
+
+        if queue_type in ('quorum', 'stream') and (self.exclusive or auto_delete or not durable):
+            raise Exception(f'{queue_type} queues must be named, durable and not auto_delete.')
+
+    def arguments(self) -> dict:
+        """ The x- arguments the queue is declared with, or None """
+        arguments = {'x-max-priority': self.max_priority,
+                     'x-message-ttl': self.message_ttl,
+                     'x-queue-type': self.queue_type,
+                     'x-max-length': self.max_length,
+                     'x-overflow': self.overflow}
+        arguments = {key: value for key, value in arguments.items() if value is not None}
+        return arguments if arguments else None
+
+    def declaration(self) -> tuple:
+        """ The settings a queue is declared with, redeclaring with others fails """
+        arguments = tuple(sorted((self.arguments() or {}).items()))
+        return (self.name, self.durable, self.exclusive, self.auto_delete, arguments)
+
+
+class RabbitConnectionPool():
+    """
+        Process wide pool of broker connections, keyed by RabbitContext
+        Clients of the same class in the same thread with the same connection
+        details share one connection, each opening its own channel since
+        channel state (confirm mode, QoS, consumers) cannot be reset
+        Released connections stay open for the next client until close()
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        #key -> [connection, number of clients using it]
+        self.connections = {}
+
+    @staticmethod
+    def key(client) -> tuple:
+        """ Connections are not thread safe, so each thread has its own """
+        context = client.context
+        return (type(client), tuple(context.hosts()), context.vhost(),
+                context.user(), context.pwd(), threading.get_ident())
+
+    def acquire(self, client, parameters: pika.ConnectionParameters):
+        """
+            Obtain a connection for a client, opening one with the client's
+            open_connection if there is no usable pooled connection
+
+            Throws:
+                An exception if connection attempt is not successful
+
+            Returns:
+                The connection
+        """
+        key = self.key(client)
+
+        with self.lock:
+            entry = self.connections.get(key)
+
+        if entry and RabbitIOLoop.owner_of(entry[0]):
+            #Only the owning I/O thread may use it, so do not share
+            return client.open_connection(parameters)
+
+        if entry:
+            try:
+                #Flush any pending events, detecting a connection closed while idle
+                entry[0].process_data_events()
+            except pika.exceptions.AMQPError:
+                entry = None
+
+        if not entry or not entry[0].is_open:
+            entry = [client.open_connection(parameters), 0]
+
+        with self.lock:
+            entry[1] += 1
+            self.connections[key] = entry
+        return entry[0]
+
+    def release(self, connection):
+        """
+            Return a connection to the pool, it stays open for the next client
+
+            Throws:
+                Nothing
+
+            Returns:
+                None
+        """
+        with self.lock:
+            for key, entry in list(self.connections.items()):
+                if entry[0] is connection:
+                    entry[1] = max(entry[1] - 1, 0)
+                    if not connection.is_open:
+                        del self.connections[key]
+                    return
+        #Not pooled (anymore), so nobody else is using it
+        self.close_connection(connection)
+
+    @staticmethod
+    def close_connection(connection):
+        """ Close a connection, ignoring failures """
+        try:
+            if connection.is_open:
+                connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+            Close all idle pooled connections
+
+            Throws:
+                Nothing
+
+            Returns:
+                None
+        """
+        with self.lock:
+            idle = [key for key, entry in self.connections.items() if not entry[1]]
+            idle = [self.connections.pop(key)[0] for key in idle]
+
+        for connection in idle:
+            self.close_connection(connection)
+
+
+CONNECTION_POOL = RabbitConnectionPool()
+atexit.register(CONNECTION_POOL.close)
+
+
+class RabbitDeclarations():
+    """
+        Queues already declared on each open connection, so that clients
+        sharing a (pooled) connection skip repeat declarations
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.declared = weakref.WeakKeyDictionary()
+
+    def contains(self, connection, queue: RabbitQueue) -> bool:
+        """ Whether the queue was declared on the connection with the same settings """
+        with self.lock:
+            return queue.declaration() in self.declared.get(connection, ())
+
+    def add(self, connection, queue: RabbitQueue):
+        """ Remember a declaration """
+        with self.lock:
+            self.declared.setdefault(connection, set()).add(queue.declaration())
+
+    def discard(self, connection, queue: RabbitQueue):
+        """ Forget a declaration, e.g. the queue has gone """
+        with self.lock:
+            self.declared.get(connection, set()).discard(queue.declaration())
+
+
+DECLARATIONS = RabbitDeclarations()
+
+
+class RabbitHostSelector():
+    """
+        Orders the nodes of a broker cluster for connecting, so that clients
+        spread over the cluster and fail over to the next node in turn
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        #Round robin position per cluster
+        self.turns = {}
+        #(host, port) -> (probed at, seconds to connect, or None if unreachable)
+        self.latencies = {}
+
+    def order(self, context: RabbitContext) -> list:
+        """
+            Order the context's broker nodes by its selection strategy
+
+            Throws:
+                An exception for an unknown strategy
+
+            Returns:
+                List of (host, port), the preferred node first
+        """
+        hosts = context.hosts()
+        strategy = context.host_selection()
+        if len(hosts) < 2:
+            return hosts
+
+        if strategy == 'round_robin':
+            with self.lock:
+                turn = next(self.turns.setdefault(tuple(hosts), itertools.count()))
+            start = turn % len(hosts)
+            return hosts[start:] + hosts[:start]
+        if strategy == 'random':
+            return random.sample(hosts, len(hosts))
+        if strategy == 'latency':
+            latencies = [self.latency(host, context.probe_interval()) for host in hosts]
+            ranked = sorted(zip(latencies, range(len(hosts))),
+                            key=lambda item: (item[0] is None, item[0] or 0, item[1]))
+            return [hosts[index] for _, index in ranked]
+        raise Exception(f'Unknown broker host selection {strategy}.')
+
+    def latency(self, host: tuple, interval: float, timeout: float = 2) -> float:
+        """ Seconds taken to open a TCP connection to a node, None if unreachable """
+        now = time.monotonic()
+        with self.lock:
+            probed = self.latencies.get(host)
+        if probed and now - probed[0] < interval:
+            return probed[1]
+
+        start = time.monotonic()
+        try:
+            socket.create_connection(host, timeout).close()
+            latency = time.monotonic() - start
+        except OSError:
+            latency = None
+
+        with self.lock:
+            self.latencies[host] = (now, latency)
+        return latency
+
+
+HOST_SELECTOR = RabbitHostSelector()
+
+
+class RabbitTLSCache():
+    """
+        Process wide TLS material: one PEM file per certificate, one SSLContext
+        per set of TLS options (so per certificate), and the last session with
+        each broker node, resumed by the next connection to skip a full handshake
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        #base64 certificate -> utils.Certificate, its PEM file
+        self.certificates = {}
+        #TLS options -> ssl.SSLContext
+        self.contexts = {}
+        #(TLS options, host, port) -> ssl.SSLSession
+        self.sessions = {}
+
+    def certificate(self, b64string: str) -> utils.Certificate:
+        """ The PEM file for a base64 certificate, written once per process """
+        with self.lock:
+            if b64string not in self.certificates:
+                self.certificates[b64string] = utils.Certificate(b64string)
+            return self.certificates[b64string]
+
+    @staticmethod
+    def key(ssl_options: dict) -> tuple:
+        """ TLS options as a cache key, the CA file standing for its certificate """
+        return tuple(sorted(ssl_options.items()))
+
+    def context(self, ssl_options: dict) -> ssl.SSLContext:
+        """
+            The SSLContext for ssl.wrap_socket style options, built once
+
+            Throws:
+                An exception if the certificate cannot be loaded
+
+            Returns:
+                The shared SSLContext
+        """
+        key = self.key(ssl_options)
+        with self.lock:
+            context = self.contexts.get(key)
+            if context is None:
+                context = ssl.SSLContext(ssl_options.get('ssl_version', ssl.PROTOCOL_TLS_CLIENT))
+                #As ssl.wrap_socket, the host name is not checked
+                context.check_hostname = False
+                context.verify_mode = ssl_options.get('cert_reqs', ssl.CERT_NONE)
+                if ssl_options.get('ca_certs'):
+                    context.load_verify_locations(cafile=ssl_options['ca_certs'])
+                if ssl_options.get('certfile'):
+                    context.load_cert_chain(ssl_options['certfile'], ssl_options.get('keyfile'))
+                if ssl_options.get('ciphers'):
+                    context.set_ciphers(ssl_options['ciphers'])
+                self.contexts[key] = context
+            return context
+
+    def wrap(self, sock, params: pika.ConnectionParameters) -> ssl.SSLSocket:
+        """ Wrap a socket with the shared context, resuming the node's last session """
+        ssl_options = params.ssl_options or {}
+        with self.lock:
+            session = self.sessions.get((self.key(ssl_options), params.host, params.port))
+        return self.context(ssl_options).wrap_socket(sock, do_handshake_on_connect=True,
+                                                     session=session)
+
+    def keep(self, sock: ssl.SSLSocket, params: pika.ConnectionParameters):
+        """ Remember the session of a connected socket for the next connection """
+        LOGGER.debug(f"TLS session with {params.host}:{params.port} "
+                     f"{'resumed' if sock.session_reused else 'established'}")
+        with self.lock:
+            self.sessions[(self.key(params.ssl_options or {}), params.host, params.port)] = \
+                sock.session
+
+    def connect(self, parameters: pika.ConnectionParameters) -> pika.BlockingConnection:
+        """
+            Open a connection, over the shared TLS context if TLS is enabled
+            and pika is the 0.13 release whose internals RabbitTLSConnection
+            hooks, otherwise pika builds a context per connection
+
+            Throws:
+                An exception if connection attempt is not successful
+
+            Returns:
+                The connection
+        """
+        if PIKA_0_13 and parameters.ssl and \
+           not isinstance(parameters.ssl_options, pika.SSLOptions):
+            return pika.BlockingConnection(parameters, _impl_class=RabbitTLSConnection)
+        return pika.BlockingConnection(parameters)
+
+
+TLS_CACHE = RabbitTLSCache()
+
+
+class RabbitTLSConnection(pika.SelectConnection):
+    """
+        pika connection taking its TLS context and session from TLS_CACHE,
+        rather than building a context per connection
+        Overrides the private _wrap_socket and _adapter_connect of pika 0.13's
+        BaseConnection, so it is only used with that release (see PIKA_0_13)
+    """
+    def _wrap_socket(self, sock):
+        return TLS_CACHE.wrap(sock, self.params)
+
+    def _adapter_connect(self):
+        error = super(RabbitTLSConnection, self)._adapter_connect()
+        if not error and isinstance(self.socket, ssl.SSLSocket):
+            TLS_CACHE.keep(self.socket, self.params)
+        return error
+
+
+class RabbitHistogram():
+    """
+        Latency distribution, in milliseconds, over fixed bucket bounds
+    """
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+    def __init__(self, bounds: tuple = BOUNDS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def record(self, millis: float):
+        """ Add a sample """
+        index = 0
+        while index < len(self.bounds) and millis > self.bounds[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += millis
+        self.minimum = millis if self.minimum is None else min(self.minimum, millis)
+        self.maximum = millis if self.maximum is None else max(self.maximum, millis)
+
+    def snapshot(self) -> dict:
+        """ Return the distribution, buckets keyed by upper bound """
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.buckets)}
+        buckets['inf'] = self.buckets[-1]
+        return {'count': self.count, 'sum': self.total,
+                'mean': self.total / self.count if self.count else None,
+                'min': self.minimum, 'max': self.maximum, 'buckets': buckets}
+
+
+class RabbitMetrics():
+    """
+        Transport metrics: messages and bytes per queue, publish confirm and
+        request/reply latency, consumer idle time, timeouts and cancellations
+        Exporters are called with snapshot() on export(), and at most every
+        'interval' seconds as metrics are recorded if an interval is set
+    """
+    def __init__(self, exporters: list = None, interval: float = 0):
+        self.lock = threading.Lock()
+        self.exporters = list(exporters) if exporters else []
+        self.interval = interval
+        self.exported = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        """ Zero all metrics """
+        with self.lock:
+            self.queues = {}
+            self.timeouts = 0
+            self.cancellations = 0
+            self.idle = 0.0
+            self.confirm_latency = RabbitHistogram()
+            self.rpc_latency = RabbitHistogram()
+
+    @staticmethod
+    def size(body) -> int:
+        """ Size of a message body in bytes """
+        if isinstance(body, str):
+            return len(body.encode('utf-8'))
+        return len(body) if body is not None else 0
+
+    def _queue(self, queue: str) -> dict:
+        if queue not in self.queues:
+            self.queues[queue] = {'messages_in': 0, 'messages_out': 0,
+                                  'bytes_in': 0, 'bytes_out': 0}
+        return self.queues[queue]
+
+    def sent(self, queue: str, body):
+        """ Record a published message """
+        with self.lock:
+            counts = self._queue(queue)
+            counts['messages_out'] += 1
+            counts['bytes_out'] += self.size(body)
+        self._maybe_export()
+
+    def received(self, queue: str, body):
+        """ Record a consumed message """
+        with self.lock:
+            counts = self._queue(queue)
+            counts['messages_in'] += 1
+            counts['bytes_in'] += self.size(body)
+        self._maybe_export()
+
+    def confirmed(self, seconds: float):
+        """ Record the time from publish to broker confirmation """
+        with self.lock:
+            self.confirm_latency.record(seconds * 1000)
+
+    def replied(self, seconds: float):
+        """ Record a request/reply round trip """
+        with self.lock:
+            self.rpc_latency.record(seconds * 1000)
+
+    def waited(self, seconds: float, timed_out: bool = False):
+        """ Record time a consumer spent waiting for a delivery """
+        with self.lock:
+            self.idle += seconds
+            if timed_out:
+                self.timeouts += 1
+
+    def cancelled(self):
+        """ Record a consumer cancelled by the broker """
+        with self.lock:
+            self.cancellations += 1
+
+    def snapshot(self) -> dict:
+        """
+            Return the current metrics
+
+            Throws:
+                Nothing
+
+            Returns:
+                A dict of the metrics, safe to serialise as JSON
+        """
+        with self.lock:
+            queues = {name: dict(counts) for name, counts in self.queues.items()}
+            return {
+                'messages_in': sum(counts['messages_in'] for counts in queues.values()),
+                'messages_out': sum(counts['messages_out'] for counts in queues.values()),
+                'bytes_in': sum(counts['bytes_in'] for counts in queues.values()),
+                'bytes_out': sum(counts['bytes_out'] for counts in queues.values()),
+                'queues': queues,
+                'idle_seconds': self.idle,
+                'timeouts': self.timeouts,
+                'cancellations': self.cancellations,
+                'confirm_latency_ms': self.confirm_latency.snapshot(),
+                'rpc_latency_ms': self.rpc_latency.snapshot()}
+
+    def add_exporter(self, exporter):
+        """ Register a callable taking a snapshot dict """
+        self.exporters.append(exporter)
+
+    def export(self):
+        """
+            Pass a snapshot to every exporter
+
+            Throws:
+                Nothing, exporter failures are logged
+
+            Returns:
+                None
+        """
+        self.exported = time.monotonic()
+        if not self.exporters:
+            return
+
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            try:
+                exporter(snapshot)
+            except Exception as exc:
+                LOGGER.warning(f"Metrics exporter failed: {exc}")
+
+    def _maybe_export(self):
+        if self.interval and time.monotonic() - self.exported >= self.interval:
+            self.export()
+
+
+class RabbitMetricsLogger():
+    """
+        Metrics exporter writing each snapshot to the log as JSON
+    """
+    def __init__(self, level: int = logging.INFO):
+        self.level = level
+
+    def __call__(self, snapshot: dict):
+        LOGGER.log(self.level, f"Transport metrics: {json.dumps(snapshot)}")
+
 
 class AbstractRabbitMessenger(ABC):
     """
         Communicates with a RabbitMQ service
     """
-    def __init__(self, context: RabbitContext):
+    def __init__(self, context: RabbitContext, pool: RabbitConnectionPool = None):
         self.context = context
+        self.pool = pool
+        #Whether the channel is in confirm mode, so publishes wait for the broker
+        self.confirming = False
+        #Exclusive queues outlive the channel on a pooled connection
+        self.temp_queues = []
         self.pub_queue = None
         self.sub_queue = None
         self.inbound = 0
         self.outbound = 0
+        self.metrics = RabbitMetrics()
+        #Set on messages published once replies are consumed via direct reply-to
+        self.reply_to = None
         self.connection = None
         self.channel = None
         self.cancel_on_close = False
@@ -226,16 +892,32 @@ class AbstractRabbitMessenger(ABC):
                 None
         """
 
-        if queue.exclusive or queue.durable:
+        declare = queue.exclusive or queue.durable or queue.arguments()
+        cache = self.context.declare_cache() and queue.name
+        if declare and cache and DECLARATIONS.contains(self.connection, queue):
+            if self.context.declare_verify():
+                try:
+                    self.channel.queue_declare(queue=queue.name, passive=True)
+                except pika.exceptions.ChannelClosed:
+                    #Gone, the channel is closed too, a reconnect redeclares it
+                    DECLARATIONS.discard(self.connection, queue)
+                    raise
+        elif declare:
             #Will not raise an exception if access rights insufficient on the queue
             #Exception only raised when channel consume takes place
             result = self.channel.queue_declare(
                 queue=queue.name,
                 exclusive=queue.exclusive,
                 auto_delete=queue.auto_delete,
-                durable=queue.durable)
+                durable=queue.durable,
+                arguments=queue.arguments())
             queue.name = result.method.queue
 
+            if queue.exclusive:
+                self.temp_queues.append(queue.name)
+            elif cache:
+                DECLARATIONS.add(self.connection, queue)
+
         #Useful when testing - clear the queue
         if queue.purge:
             self.channel.queue_purge(queue=queue.name)
@@ -252,30 +934,101 @@ class AbstractRabbitMessenger(ABC):
                 None
         """
 
-        self.connection = pika.BlockingConnection(parameters)
+        if self.pool:
+            self.connection = self.pool.acquire(self, parameters)
+        else:
+            self.connection = self.open_connection(parameters)
         self.channel = self.connection.channel()
 
+    def open_connection(self, parameters: pika.ConnectionParameters):
+        """
+            Open a new, unpooled, connection to the broker
+
+            Throws:
+                An exception if connection attempt is not successful
+
+            Returns:
+                The connection
+        """
+        return TLS_CACHE.connect(parameters)
+
+    def parameters(self, connection_attempts: int, retry_delay: int,
+                   host: tuple = None) -> pika.ConnectionParameters:
+        """
+            Build the connection settings for the RabbitMQ service, for one
+            node of a cluster if given
+
+            Throws:
+                Nothing
+
+            Returns:
+                The pika connection parameters
+        """
+        host, port = host if host else (self.context.host(), self.context.port())
+        return pika.ConnectionParameters(
+            host, port, self.context.vhost(),
+            self.credentials, ssl=self.context.ssl(), ssl_options=self.ssl_options,
+            connection_attempts=connection_attempts,
+            retry_delay=retry_delay,
+            blocked_connection_timeout=self.context.blocked_timeout())
+
+    def candidates(self, connection_attempts: int, retry_delay: int) -> list:
+        """
+            Build the connection settings for each broker node, in the order
+            to try them. With several nodes, each is tried once per round.
+
+            Throws:
+                An exception for an unknown host selection strategy
+
+            Returns:
+                List of pika connection parameters
+        """
+        hosts = HOST_SELECTOR.order(self.context)
+        if len(hosts) == 1:
+            return [self.parameters(connection_attempts, retry_delay, hosts[0])]
+        return [self.parameters(1, retry_delay, host) for host in hosts]
+
     def connect(self, connection_attempts: int, retry_delay: int):
         """
-            Setup connection settings to RabbitMQ service
+            Setup connection settings to RabbitMQ service, failing over to the
+            other nodes of a cluster for 'connection_attempts' rounds
 
             Throws:
+                ValueError if connection_attempts is less than 1
                 An exception if connection attempt is not successful
 
             Returns:
                 None
         """
-        parameters = pika.ConnectionParameters(
-                        self.context.host(), self.context.port(), self.context.vhost(),
-                        self.credentials, ssl=self.context.ssl(), ssl_options=self.ssl_options,
-                        connection_attempts=connection_attempts,
-                        retry_delay=retry_delay)
-        self.establish_connection(parameters)
+        if connection_attempts < 1:
+            raise ValueError(f'connection_attempts must be at least 1, not {connection_attempts}')
+
+        candidates = self.candidates(connection_attempts, retry_delay)
+        if not candidates:
+            raise pika.exceptions.AMQPConnectionError('No broker hosts to connect to.')
+        rounds = connection_attempts if len(candidates) > 1 else 1
+
+        for attempt in range(rounds):
+            if attempt:
+                time.sleep(retry_delay)
+            for parameters in candidates:
+                try:
+                    self.establish_connection(parameters)
+                    return
+                except AUTHENTICATION_ERRORS:
+                    raise
+                except pika.exceptions.AMQPConnectionError as exc:
+                    if len(candidates) == 1:
+                        raise
+                    LOGGER.warning(f"Broker {parameters.host}:{parameters.port} unavailable: {exc}")
+                    error = exc
+        raise error
 
     def basic_publish(self, message, queue: str, exchange: str = None,
-                      mode: int = 1, delay: int = 0):
+                      mode: int = 1, delay: int = 0, correlation: str = None,
+                      priority: int = None, expiration: float = None):
         """
-            Publish a message to a queue
+            Publish a message to a queue, optionally tagged with a correlation id
 
             Throws:
                 Exception - maybe access rights are insufficient on the queue
@@ -286,15 +1039,93 @@ class AbstractRabbitMessenger(ABC):
         if not exchange:
             exchange = ''
 
-        headers = {"x-delay": 1000 * delay} if delay else None
-        user_id = self.context.user() if self.context.user_dispatch() else None
+        body, encoding = self.encode_body(message)
+        properties = self.message_properties(mode, delay, correlation, encoding,
+                                             priority, expiration)
+        self.send_body(exchange, queue, body, properties)
+
+    def send_body(self, exchange: str, queue: str, body, properties: pika.BasicProperties):
+        """
+            Publish an already encoded body with its properties
+
+            Throws:
+                Exception - maybe access rights are insufficient on the queue
 
-        properties = pika.BasicProperties(delivery_mode=mode,
-                                          headers=headers,
-                                          user_id=user_id)
+            Returns:
+                None
+        """
+        start = time.monotonic()
         self.channel.basic_publish(
-            exchange=exchange, routing_key=queue, body=message, properties=properties)
+            exchange=exchange, routing_key=queue, body=body, properties=properties)
         self.outbound += 1
+        self.metrics.sent(queue, body)
+        if self.confirming:
+            #Whatever the queue, basic_publish waited for the broker
+            self.metrics.confirmed(time.monotonic() - start)
+
+    def encode_body(self, message) -> tuple:
+        """
+            Compress a message body if the context enables compression and the
+            body is at least the threshold size
+
+            Throws:
+                An exception if the configured codec is not available
+
+            Returns:
+                Tuple of (body, content_encoding or None)
+        """
+        encoding = self.context.compression()
+        if not encoding or RabbitMetrics.size(message) < self.context.compression_threshold():
+            return message, None
+
+        codec = compression.lookup(encoding)
+        if not codec:
+            raise Exception(f'Compression codec {encoding} is not available.')
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        return codec.compress(message), codec.name
+
+    @staticmethod
+    def decode_body(body, properties: pika.BasicProperties):
+        """
+            Decompress a body according to its content_encoding, bodies with
+            any other (or no) encoding are returned unchanged
+
+            Throws:
+                An exception if the body is corrupt
+
+            Returns:
+                The body
+        """
+        codec = compression.lookup(properties.content_encoding) if properties else None
+        return codec.decompress(body) if codec else body
+
+    def message_properties(self, mode: int = 1, delay: int = 0,
+                           correlation: str = None, encoding: str = None,
+                           priority: int = None, expiration: float = None) -> pika.BasicProperties:
+        """
+            Build the AMQP properties for an outgoing message, 'expiration'
+            is in seconds, like 'delay'
+
+            Throws:
+                Nothing
+
+            Returns:
+                The message properties
+        """
+        headers = {"x-delay": 1000 * delay} if delay else None
+        user_id = self.context.user() if self.context.user_dispatch() else None
+        #AMQP carries the expiration as a string of milliseconds
+        expiration = str(max(0, int(1000 * expiration))) if expiration is not None else None
+
+        return pika.BasicProperties(delivery_mode=mode,
+                                    headers=headers,
+                                    user_id=user_id,
+                                    correlation_id=correlation,
+                                    reply_to=self.reply_to,
+                                    content_encoding=encoding,
+                                    priority=priority,
+                                    expiration=expiration)
 
     def stop(self):
         """
@@ -310,12 +1141,21 @@ class AbstractRabbitMessenger(ABC):
             if self.channel:
                 if self.cancel_on_close:
                     self.channel.cancel()
+                if self.pool:
+                    for queue in self.temp_queues:
+                        self.channel.queue_delete(queue=queue)
                 self.channel.close()
-            if self.connection:
-                self.connection.close()
         except Exception:
             pass
 
+        if self.connection:
+            if self.pool:
+                self.pool.release(self.connection)
+            else:
+                RabbitConnectionPool.close_connection(self.connection)
+            self.connection = None
+        self.temp_queues = []
+
     @abstractmethod
     def start(self, publish: RabbitQueue = None, subscribe: RabbitQueue = None,
               connection_attempts: int = 10, retry_delay: int = 1):
@@ -325,132 +1165,1784 @@ class AbstractRabbitMessenger(ABC):
 
     @abstractmethod
     def publish(self, message, queue: RabbitQueue = None, exchange: str = None,
-                mode: int = 1, delay: int = 0):
+                mode: int = 1, delay: int = 0, correlation: str = None,
+                priority: int = None, expiration: float = None):
         """"""
 
     @abstractmethod
     def receive(self, handler=None, timeout: int = 30, max_messages: int = 0,
-                queue: RabbitQueue = None) -> str:
+                queue: RabbitQueue = None, with_properties: bool = False) -> str:
         """"""
 
 
+#Failures that a reconnecting client recovers from
+CONNECTION_ERRORS = (pika.exceptions.ConnectionClosed, pika.exceptions.ChannelClosed)
+#Failures that trying another broker node would not fix
+AUTHENTICATION_ERRORS = (pika.exceptions.ProbableAuthenticationError,
+                         pika.exceptions.ProbableAccessDeniedError)
+
+
 class RabbitTimedOutException(Exception):
     """ Exception for timeouts """
 
 class RabbitConsumerException(Exception):
     """ Exception for connection closed by broker """
 
+class RabbitFlowControlException(Exception):
+    """ Exception for publishes refused by flow control """
 
-class RabbitClient(AbstractRabbitMessenger):
+
+class RabbitRateLimiter():
     """
-        Communicates with a RabbitMQ service
+        Token bucket: 'rate' tokens per second, holding up to 'burst'
     """
-    def start(self, publish: RabbitQueue = None, subscribe: RabbitQueue = None,
-              connection_attempts: int = 10, retry_delay: int = 1):
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> float:
         """
-            Start the client connection to the broker
+            Take a token if one is available
+
+            Returns:
+                0 if a token was taken, otherwise seconds until one is available
         """
-        if publish:
-            self.pub_queue = publish
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
 
-        if subscribe:
-            self.sub_queue = subscribe
 
-        self.connect(connection_attempts, retry_delay)
+class RabbitDelayScheduler():
+    """
+        Delayed publishes held by the client until due, for brokers without
+        the delayed message exchange plugin. Kept in a heap, so holding and
+        releasing a publish costs O(log n) however many are pending.
+    """
+    def __init__(self):
+        #(due, sequence, publish), the sequence keeps publishes due together in order
+        self.heap = []
+        self.sequence = itertools.count()
 
-    def get_subscribe_queue(self):
-        """ Get the clients subscribe queue, default to None """
-        return self.sub_queue.name if self.sub_queue else None
+    def __len__(self) -> int:
+        return len(self.heap)
 
-    def establish_connection(self, parameters: pika.ConnectionParameters):
-        """
-            Complete the connection request, declaring the publish queue
-        """
-        super(RabbitClient, self).establish_connection(parameters)
+    def push(self, due: float, publish: tuple):
+        """ Hold a publish until 'due' (time.monotonic) """
+        heapq.heappush(self.heap, (due, next(self.sequence), publish))
 
-        if self.pub_queue:
-            self.declare_queue(self.pub_queue)
-            self.channel.confirm_delivery()
+    def next_due(self) -> float:
+        """ When the earliest publish is due, None if there are none """
+        return self.heap[0][0] if self.heap else None
 
-        if self.sub_queue:
-            self.declare_queue(self.sub_queue)
-            #Ensure the consumer only gets 'prefetch' unacknowledged message
-            self.channel.basic_qos(prefetch_count=self.sub_queue.prefetch)
+    def ready(self, now: float) -> tuple:
+        """ The earliest publish if it is due, otherwise None """
+        return self.heap[0][2] if self.heap and self.heap[0][0] <= now else None
 
-    def publish(self, message, queue: RabbitQueue = None, exchange: str = None,
-                mode: int = 1, delay: int = 0):
-        """
-            Publish a message to a queue
+    def pop(self):
+        """ Drop the earliest publish, once sent """
+        heapq.heappop(self.heap)
 
-            Throws:
-                Exception - maybe access rights are insufficient on the queue
+    def drain(self, now: float) -> list:
+        """ Take all publishes, in due order, with the delay (seconds) left on each from 'now' """
+        held = [(max(0, due - now), publish) for due, _, publish in sorted(self.heap)]
+        self.heap.clear()
+        return held
 
-            Returns:
-                None
+
+class RabbitDiskSpool():
+    """
+        Publishes held in a disk spool, so that they survive a restart,
+        used like the deque holding them in memory
+    """
+    def __init__(self, context: RabbitContext):
+        self.spool = spool.DiskSpool(context.spool_dir(), context.spool_segment_bytes(),
+                                     context.spool_max_bytes(), context.spool_fsync(),
+                                     context.spool_fsync_interval())
+
+    def __len__(self) -> int:
+        return len(self.spool)
+
+    def __getitem__(self, index: int) -> tuple:
+        """ The publish at the head, as only it can be looked at """
+        if index != 0:
+            raise IndexError('Only the head of the spool can be read.')
+        record = self.spool.peek()
+        if record is None:
+            raise IndexError('Spool is empty.')
+
+        size, = struct.unpack('>I', record[:4])
+        header = json.loads(record[4:4 + size])
+        message = record[4 + size:]
+        if header['text']:
+            message = message.decode('utf-8')
+        expiration = header['expiration']
+        spooled = time.time() - header['spooled']
+        if expiration is not None:
+            #Time spent spooled counts towards the expiration, and the delay
+            expiration = max(0, expiration - spooled)
+        delay = max(0, header['delay'] - spooled) if header['delay'] else 0
+        queue = RabbitQueue(header['queue']) if header['queue'] else None
+        return (message, queue, header['exchange'], header['mode'], delay,
+                header['correlation'], header['priority'], expiration)
+
+    def append(self, publish: tuple):
         """
-        if not queue:
-            queue = self.pub_queue
+            Spool a publish
 
-        if not exchange:
-            exchange = self.context.delayed_exchange() if delay else None
+            Throws:
+                SpoolFullError if the spool has reached its size limit
+        """
+        message, queue, exchange, mode, delay, correlation, priority, expiration = publish
+        header = json.dumps({'queue': queue.name if queue else None, 'exchange': exchange,
+                             'mode': mode, 'delay': delay, 'correlation': correlation,
+                             'priority': priority, 'expiration': expiration,
+                             'text': isinstance(message, str), 'spooled': time.time()})
+        header = header.encode('utf-8')
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        self.spool.append(struct.pack('>I', len(header)) + header + message)
+
+    def popleft(self):
+        """ Drop the publish at the head, once sent """
+        self.spool.pop()
+
+    def close(self):
+        """ Sync and close the spool files """
+        self.spool.close()
+
+
+class RabbitAcknowledger():
+    """
+        Coalesces message acknowledgements on a channel
+        Delivery tags are channel wide, so a multiple ack is only sent for a
+        contiguous run of completed deliveries
+        Given the connection, a timer flushes completed deliveries once the
+        interval has passed, otherwise it is only checked as more complete
+    """
+    def __init__(self, channel, connection=None):
+        self.channel = channel
+        self.connection = connection
+        #Unacknowledged delivery tags in delivery order, True once completed
+        self.outstanding = OrderedDict()
+        self.completed = 0
+        self.oldest = None
+        self.timer = None
+
+    def delivered(self, tag: int):
+        """ Track a new delivery """
+        self.outstanding[tag] = False
+
+    def done(self, tag: int, batch: int = 1, interval: int = 0):
+        """
+            Mark a delivery as completed, acknowledging once 'batch' deliveries
+            are completed or the oldest has waited 'interval' milliseconds
+        """
+        if tag not in self.outstanding:
+            return
+
+        self.outstanding[tag] = True
+        self.completed += 1
+        now = time.monotonic()
+        if self.oldest is None:
+            self.oldest = now
+
+        #An interval of 0 sets no time limit, only the batch size applies
+        if self.completed >= batch or (interval and (now - self.oldest) * 1000 >= interval):
+            self.flush()
+        elif interval and self.connection and not self.timer:
+            remaining = max(0, interval / 1000 - (now - self.oldest))
+            self.timer = self.connection.add_timeout(remaining, self._interval_elapsed)
+
+    def _interval_elapsed(self):
+        """ Flush the completed deliveries the interval timer was set for """
+        self.timer = None
+        try:
+            self.flush()
+        except CONNECTION_ERRORS as exc:
+            #Unacknowledged deliveries are redelivered once reconnected
+            LOGGER.debug(f"Coalesced acks not sent: {exc}")
+
+    def reject(self, tag: int, requeue: bool = True):
+        """ Return a delivery to the broker, after acknowledging those completed """
+        if self.outstanding.pop(tag, None) is None:
+            return
+        self.flush()
+        self.channel.basic_nack(tag, requeue=requeue)
+
+    def flush(self):
+        """ Send acknowledgements for all completed deliveries """
+        self._cancel_timer()
+        if not self.completed:
+            return
+
+        last = None
+        while self.outstanding:
+            tag, completed = next(iter(self.outstanding.items()))
+            if not completed:
+                break
+            self.outstanding.popitem(last=False)
+            last = tag
+
+        if last is not None:
+            self.channel.basic_ack(last, multiple=True)
+
+        #Completed deliveries beyond a gap are acknowledged individually
+        for tag in [tag for tag, completed in self.outstanding.items() if completed]:
+            del self.outstanding[tag]
+            self.channel.basic_ack(tag)
+
+        self.completed = 0
+        self.oldest = None
+
+    def clear(self):
+        """ Forget all deliveries, e.g. when the channel has closed """
+        self._cancel_timer()
+        self.outstanding.clear()
+        self.completed = 0
+        self.oldest = None
+
+    def _cancel_timer(self):
+        if self.timer:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+
+
+class RabbitAckHandle():
+    """
+        Settles one delivery yielded by RabbitClient.iter_messages
+        Settling is idempotent, and a no-op for deliveries already acknowledged
+        on receipt or received before a reconnection
+    """
+    def __init__(self, client, queue, tag: int):
+        self.client = client
+        self.queue = queue
+        self.tag = tag
+        self.acks = client.acks
+        self.settled = tag is None
+
+    def ack(self):
+        """ Acknowledge the delivery """
+        if self._settle():
+            self.client.invoke(self.acks.done, self.tag, self.queue.ack_batch,
+                               self.queue.ack_interval, wait=False)
+
+    def reject(self, requeue: bool = True):
+        """ Return the delivery to the broker, or drop it if not requeued """
+        if self._settle():
+            self.client.invoke(self.acks.reject, self.tag, requeue)
+
+    def _settle(self) -> bool:
+        """ Mark as settled, returning whether the channel still expects it """
+        if self.settled:
+            return False
+        self.settled = True
+        return self.client.acks is self.acks
+
+
+#Header carrying a windowed publish's delivery tag, to match it if returned
+CONFIRM_HEADER = 'x-confirm-seq'
+#Headers carried by each chunk of a body published in chunks
+CHUNK_HEADERS = ('x-chunk-id', 'x-chunk-seq', 'x-chunk-count', 'x-chunk-bytes')
+
+
+class RabbitChunkAssembler():
+    """
+        Reassembles bodies published in chunks, writing each chunk straight
+        into a buffer of the body's size. At most max_bytes of incomplete
+        bodies are held, the least recently added to are dropped to make room,
+        and bodies without a chunk for 'expiry' seconds are dropped (never if 0).
+        Chunks are acknowledged on arrival, as holding them would stall a
+        prefetch smaller than the chunk count, so a dropped body is lost.
+    """
+    def __init__(self, max_bytes: int, expiry: float = 0):
+        self.max_bytes = max_bytes
+        self.expiry = expiry
+        #Incomplete bodies, least recently added to first:
+        #transfer id -> (buffer, sequence numbers received, time of the last chunk)
+        self.transfers = OrderedDict()
+        self.held = 0
+
+    @staticmethod
+    def chunked(properties: pika.BasicProperties) -> bool:
+        """ Whether a delivery is a chunk of a larger body """
+        return bool(properties and properties.headers and CHUNK_HEADERS[0] in properties.headers)
+
+    def expire(self, now: float):
+        """ Drop the incomplete bodies whose last chunk arrived over 'expiry' seconds before 'now' """
+        while self.expiry and self.transfers:
+            transfer, (buffer, received, last) = next(iter(self.transfers.items()))
+            if now - last < self.expiry:
+                break
+            del self.transfers[transfer]
+            self.held -= len(buffer)
+            LOGGER.warning(f"Dropping chunked body {transfer}, {len(received)} chunks received "
+                           f"but none for {now - last:.0f}s")
+
+    def add(self, properties: pika.BasicProperties, chunk: bytes) -> bytes:
+        """
+            Store a chunk
 
-        super(RabbitClient, self).basic_publish(message, queue.name, exchange, mode, delay)
+            Throws:
+                Nothing
 
-    def receive(self, handler=None, timeout: int = 30, max_messages: int = 0,
-                queue: RabbitQueue = None) -> str:
+            Returns:
+                The whole body (a bytearray) once all its chunks have arrived,
+                otherwise None
         """
-            Start receiving messages, up to max_messages
+        transfer, seq, count, total = (properties.headers[name] for name in CHUNK_HEADERS)
+        if count == 1:
+            return chunk
+
+        now = time.monotonic()
+        self.expire(now)
+        if transfer not in self.transfers:
+            if total > self.max_bytes:
+                LOGGER.error(f"Dropping chunked body {transfer} of {total} bytes, larger than the chunk buffer")
+                return None
+            while self.held + total > self.max_bytes:
+                dropped, (buffer, received, _) = self.transfers.popitem(last=False)
+                self.held -= len(buffer)
+                LOGGER.warning(f"Dropping incomplete chunked body {dropped}, {len(received)} chunks "
+                               f"received, to make room")
+            self.transfers[transfer] = (bytearray(total), set(), now)
+            self.held += total
+
+        buffer, received, _ = self.transfers[transfer]
+        self.transfers[transfer] = (buffer, received, now)
+        self.transfers.move_to_end(transfer)
+        #All chunks but the last are the same size
+        offset = total - len(chunk) if seq == count - 1 else seq * len(chunk)
+        buffer[offset:offset + len(chunk)] = chunk
+        received.add(seq)
+        if len(received) < count:
+            return None
+
+        del self.transfers[transfer]
+        self.held -= total
+        return buffer
+
+
+class RabbitDispatcher():
+    """
+        Runs receive handlers on a pool of threads, or of processes for CPU bound
+        handlers, which must then be picklable (e.g. module level functions).
+        Deliveries with the same key, as returned by key(body, properties),
+        are handled one at a time and in order of arrival.
+    """
+    def __init__(self, workers: int = None, processes: bool = False, key=None,
+                 executor=None):
+        self.owned = executor is None
+        if not executor:
+            pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+            executor = pool(max_workers=workers)
+        self.executor = executor
+        self.key = key
+        self.ready = threading.Condition()
+        #Deliveries waiting on an earlier one with the same key
+        self.chains = {}
+
+    def key_of(self, body, properties):
+        """ Return the ordering key of a delivery, default to None """
+        return self.key(body, properties) if self.key else None
+
+    def dispatch(self, handler, args: tuple, key, completed):
+        """
+            Run handler(*args) on the pool, after any earlier work with the same key
+            completed is called with the handler's exception, or None
 
             Throws:
-                Exception if consume fails
+                Nothing
+
+            Returns:
+                Nothing
+        """
+        if key is not None:
+            with self.ready:
+                if key in self.chains:
+                    self.chains[key].append((handler, args, completed))
+                    return
+                self.chains[key] = deque()
+        self._run(handler, args, key, completed)
+
+    def _run(self, handler, args: tuple, key, completed):
+        """ Submit to the pool """
+        try:
+            future = self.executor.submit(handler, *args)
+        except Exception as exc:
+            future = Future()
+            future.set_exception(exc)
+        future.add_done_callback(lambda future: self._finished(future, key, completed))
+
+    def _finished(self, future: Future, key, completed):
+        """ Report completion, then start the next work with the same key """
+        try:
+            completed(future.exception() if not future.cancelled() else
+                      RabbitConsumerException('Handler cancelled.'))
+        finally:
+            if key is not None:
+                with self.ready:
+                    chain = self.chains[key]
+                    following = chain.popleft() if chain else None
+                    if not following:
+                        del self.chains[key]
+                if following:
+                    self._run(following[0], following[1], key, following[2])
+
+    def wait(self, predicate, timeout: float = None) -> bool:
+        """ Wait until predicate holds or the timeout expires """
+        with self.ready:
+            return self.ready.wait_for(predicate, timeout)
+
+    def notify(self):
+        """ Wake threads waiting on completions """
+        with self.ready:
+            self.ready.notify_all()
+
+    def shutdown(self, wait: bool = True):
+        """ Shut the pool down, unless it was supplied by the caller """
+        if self.owned:
+            self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+
+class PublishResult(NamedTuple):
+    """Outcome of a bulk publish, as indices into the published messages"""
+    nacked: list
+    returned: list
+
+
+class RabbitClient(AbstractRabbitMessenger):
+    """
+        Communicates with a RabbitMQ service
+    """
+    def __init__(self, context: RabbitContext, pool: RabbitConnectionPool = None):
+        super(RabbitClient, self).__init__(context, pool)
+        self.window = 1
+        self.delivery_tag = 0
+        #Published but unconfirmed messages, keyed by delivery tag
+        self.unconfirmed = OrderedDict()
+        self.published_at = {}
+        #Delivery tags being tracked by publish_many, and their failures
+        self.tracked = None
+        self.failures = {}
+        #Active consumers, their queues and locally buffered deliveries
+        self.consumers = {}
+        self.consumer_queues = {}
+        self.deliveries = {}
+        self.acks = None
+        #Queues being consumed, restored after a reconnect
+        self.consumed = {}
+        #Called with (queue, old name) when a reconnect renames a server named queue
+        self.on_renamed = None
+        #Prefetch the channel gives consumers started from now on
+        self.prefetch = None
+        #Where the next fan-in wait starts looking, taking queues in turn
+        self.turn = 0
+        #Bodies being received in chunks
+        self.chunks = RabbitChunkAssembler(context.chunk_buffer(), context.chunk_expiry())
+        self.connection_attempts = 10
+        self.retry_delay = 1
+        #Flow control: the broker's reason for blocking publishers, if it is
+        self.blocked = None
+        rate = context.publish_rate()
+        self.limiter = RabbitRateLimiter(rate, context.publish_burst()) if rate else None
+        #Publishes held back by the spool flow control policy, or while the
+        #broker is unreachable if spooled to disk
+        self.spooled = deque()
+        #While unreachable, when to try reconnecting next
+        self.retry_at = None
+        self.offline_attempts = 0
+        #Delayed publishes held here when there is no delayed exchange, and
+        #the (due, timer) set on the connection to release the earliest
+        self.scheduled = RabbitDelayScheduler()
+        self.timer = None
+
+    @property
+    def io(self):
+        """ The I/O thread owning the connection, if any """
+        return RabbitIOLoop.owner_of(self.connection)
+
+    def invoke(self, operation, *args, wait: bool = True, **kwargs):
+        """
+            Run an operation on the thread that owns the connection, which is
+            the I/O thread when one is running
+
+            Throws:
+                Any exception raised by the operation
+
+            Returns:
+                The result of the operation, or a future if not waiting
+        """
+        io_loop = self.io
+        if not io_loop or io_loop.on_loop():
+            return operation(*args, **kwargs)
+
+        future = io_loop.submit(operation, *args, **kwargs)
+        return future.result(self.context.timeout()) if wait else future
+
+    def start(self, publish: RabbitQueue = None, subscribe: RabbitQueue = None,
+              connection_attempts: int = 10, retry_delay: int = 1):
+        """
+            Start the client connection to the broker
+        """
+        if publish:
+            self.pub_queue = publish
+
+        if subscribe:
+            self.sub_queue = subscribe
+
+        self.connection_attempts = connection_attempts
+        self.retry_delay = retry_delay
+        self.connect(connection_attempts, retry_delay)
+
+    def reconnect(self, reason: Exception):
+        """
+            Re-establish a lost connection, retrying with jittered exponential
+            backoff. Queues, QoS and consumers are restored and unconfirmed
+            publishes are sent again. Server named queues get a new name.
+
+            Throws:
+                The original exception if reconnection is disabled or fails
+
+            Returns:
+                None
+        """
+        attempts = self.context.reconnect_attempts()
+        delay, max_delay = self.context.reconnect_backoff()
+        LOGGER.warning(f"Broker connection lost: {reason}")
+
+        for attempt in range(attempts):
+            time.sleep(random.uniform(0, min(max_delay, delay * 2 ** attempt)))
+            try:
+                self._restore()
+                LOGGER.info(f"Broker connection restored after {attempt + 1} attempt(s)")
+                return
+            except pika.exceptions.AMQPError as exc:
+                LOGGER.warning(f"Reconnect attempt {attempt + 1} failed: {exc}")
+        raise reason
+
+    def _restore(self, connection_attempts: int = None):
+        """ Open a new connection and rebuild the client state on it """
+        unconfirmed = list(self.unconfirmed.values())
+        consumed = list(self.consumed.values())
+
+        if self.pool:
+            self.pool.release(self.connection)
+        else:
+            RabbitConnectionPool.close_connection(self.connection)
+
+        #Buffered and unacknowledged deliveries are redelivered by the broker
+        self.consumers.clear()
+        self.consumer_queues.clear()
+        self.deliveries.clear()
+        self.temp_queues = []
+
+        renamed = []
+        for queue in [self.pub_queue, self.sub_queue] + consumed:
+            if queue and queue.exclusive and queue.name:
+                renamed.append((queue, queue.name))
+                queue.name = ''
+
+        self.connect(connection_attempts or self.connection_attempts, self.retry_delay)
+
+        for queue in consumed:
+            if queue not in (self.pub_queue, self.sub_queue):
+                self.declare_queue(queue)
+            self._consume(queue)
+
+        for queue, name in renamed:
+            LOGGER.warning(f"Server named queue {name} is now {queue.name}")
+            if self.on_renamed:
+                self.on_renamed(queue, name)
+
+        for publish in unconfirmed:
+            #Already encoded, so re-sent exactly as before
+            self._send(*publish)
+
+    def get_subscribe_queue(self):
+        """ Get the clients subscribe queue, default to None """
+        return self.sub_queue.name if self.sub_queue else None
+
+    def establish_connection(self, parameters: pika.ConnectionParameters):
+        """
+            Complete the connection request, declaring the publish queue
+        """
+        super(RabbitClient, self).establish_connection(parameters)
+        self.channel.add_on_cancel_callback(self._on_cancel)
+        self.acks = RabbitAcknowledger(self.channel, self.connection)
+        self.blocked = None
+        self.prefetch = None
+        #Timers do not survive the connection
+        self.timer = None
+        self.connection.add_on_connection_blocked_callback(self._on_blocked)
+        self.connection.add_on_connection_unblocked_callback(self._on_unblocked)
+        self.confirming = False
+
+        if self.pub_queue:
+            self.declare_queue(self.pub_queue)
+            if self.pub_queue.confirm_window > 1:
+                self.enable_confirm_window(self.pub_queue.confirm_window)
+            else:
+                self.channel.confirm_delivery()
+            self.confirming = True
+
+        if self.sub_queue:
+            self.declare_queue(self.sub_queue)
+            #Ensure the consumer only gets 'prefetch' unacknowledged message
+            self.channel.basic_qos(prefetch_count=self.sub_queue.prefetch)
+            self.prefetch = self.sub_queue.prefetch
+
+        self._arm_scheduled()
+
+    def enable_confirm_window(self, window: int):
+        """
+            Turn on windowed publisher confirms: up to 'window' messages may be
+            unconfirmed, tracked by delivery tag, before publishing blocks
+
+            Throws:
+                An exception if the broker does not support confirms
+
+            Returns:
+                None
+        """
+        #BlockingChannel only offers synchronous confirms, so register for
+        #Basic.Ack/Nack/Return on the underlying asynchronous channel. This is
+        #private to pika 0.13 (as pinned in requirements.txt), whose
+        #Channel.confirm_delivery takes the ack/nack callback as 'callback'
+        impl = getattr(self.channel, '_impl', None)
+        if not PIKA_0_13 or impl is None:
+            LOGGER.warning(f"Windowed confirms need pika 0.13, not {pika.__version__}: "
+                           f"publishes wait for each confirm")
+            self.channel.confirm_delivery()
+            self.window = 1
+            return
+
+        impl.confirm_delivery(callback=self._on_confirm)
+        impl.add_on_return_callback(self._on_return)
+        self.window = window
+        self.delivery_tag = 0
+        self.unconfirmed.clear()
+        self.published_at.clear()
+
+    def _on_confirm(self, frame):
+        """ Retire the publishes acknowledged (or rejected) by the broker """
+        method = frame.method
+        nacked = isinstance(method, pika.spec.Basic.Nack)
+
+        tags = [method.delivery_tag]
+        if method.multiple:
+            tags = [tag for tag in self.unconfirmed if tag <= method.delivery_tag]
+
+        now = time.monotonic()
+        for tag in tags:
+            self.unconfirmed.pop(tag, None)
+            published = self.published_at.pop(tag, None)
+            if published is not None:
+                self.metrics.confirmed(now - published)
+            if nacked:
+                self._failed(tag, 'nacked')
+
+    def _on_return(self, _channel, method, properties, _body):
+        """ Record an unroutable publish, it is still confirmed afterwards """
+        tag = (properties.headers or {}).get(CONFIRM_HEADER) if properties else None
+        if isinstance(tag, int):
+            self._failed(tag, 'returned', method.reply_text)
+
+    def _failed(self, tag: int, reason: str, text: str = ''):
+        if self.tracked is not None and tag in self.tracked:
+            self.failures[tag] = reason
+        else:
+            LOGGER.warning(f"Published message {tag} was {reason} by broker {text}")
+
+    def wait_for_confirms(self, timeout: int = None):
+        """
+            Wait until all windowed publishes have been confirmed
+
+            Throws:
+                RabbitTimedOutException on timeout
+
+            Returns:
+                None
+        """
+        self.invoke(self._drain_confirms, 0, timeout)
+
+    def declare_queue(self, queue: RabbitQueue) -> RabbitQueue:
+        """
+            Declare a queue, creating if required
+
+            Throws:
+                An exception if connection attempt is not successful
+
+            Returns:
+                The queue
+        """
+        return self.invoke(super(RabbitClient, self).declare_queue, queue)
+
+    def _drain_confirms(self, limit: int, timeout: int = None):
+        """ Process broker events until no more than 'limit' publishes are unconfirmed """
+        deadline = time.monotonic() + (timeout if timeout else self.context.timeout())
+
+        while len(self.unconfirmed) > limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RabbitTimedOutException("Publisher confirm timeout reached.")
+            self.connection.process_data_events(time_limit=remaining)
+
+    def basic_publish(self, message, queue: str, exchange: str = None,
+                      mode: int = 1, delay: int = 0, correlation: str = None,
+                      priority: int = None, expiration: float = None,
+                      mandatory: bool = False):
+        """
+            Publish a message to a queue, blocking only while the confirm window is full
+
+            Throws:
+                Exception - maybe access rights are insufficient on the queue
+
+            Returns:
+                The delivery tag in windowed confirm mode, otherwise None
+        """
+        if self.window <= 1:
+            return super(RabbitClient, self).basic_publish(message, queue, exchange,
+                                                           mode, delay, correlation,
+                                                           priority, expiration)
+
+        body, encoding = self.encode_body(message)
+        properties = self.message_properties(mode, delay, correlation, encoding,
+                                             priority, expiration)
+        return self._send(exchange if exchange else '', queue, body, properties, mandatory)
+
+    def _send(self, exchange: str, queue: str, body, properties: pika.BasicProperties,
+              mandatory: bool) -> int:
+        """ Publish an encoded message in windowed confirm mode, returning its tag """
+        self._drain_confirms(self.window - 1)
+
+        self.delivery_tag += 1
+        #Leaves message_id to the caller
+        if properties.headers is None:
+            properties.headers = {}
+        properties.headers[CONFIRM_HEADER] = self.delivery_tag
+
+        publish = (exchange, queue, body, properties, mandatory)
+        self.unconfirmed[self.delivery_tag] = publish
+        self.published_at[self.delivery_tag] = time.monotonic()
+        self.channel.basic_publish(*publish)
+        self.outbound += 1
+        self.metrics.sent(queue, body)
+        return self.delivery_tag
+
+    def publish_many(self, messages: list, queue: RabbitQueue = None, exchange: str = None,
+                     mode: int = 1, mandatory: bool = True, priority: int = None,
+                     expiration: float = None) -> PublishResult:
+        """
+            Publish a batch of messages, keeping the confirm window full
+
+            Throws:
+                Exception - maybe access rights are insufficient on the queue
+
+            Returns:
+                PublishResult holding the indices of nacked and returned messages
+        """
+        #Batches are never spooled, they wait for flow control instead
+        policy = 'fail' if self.context.flow_control() == 'fail' else 'block'
+
+        if self.io and not self.io.on_loop():
+            #Waiting for flow control cannot happen on the I/O thread
+            for _ in messages:
+                self._admit(policy)
+            return self.invoke(self._publish_many, messages, queue, exchange, mode,
+                               mandatory, priority, expiration, None)
+        return self._publish_many(messages, queue, exchange, mode, mandatory,
+                                  priority, expiration, policy)
+
+    def _publish_many(self, messages: list, queue: RabbitQueue, exchange: str, mode: int,
+                      mandatory: bool, priority: int, expiration: float,
+                      policy: str) -> PublishResult:
+        """ Publish a batch, applying flow control per message unless policy is None """
+        if not queue:
+            queue = self.pub_queue
+
+        nacked, returned = [], []
+
+        if self.window <= 1:
+            #Synchronous confirms, each publish reports its own outcome
+            for index, message in enumerate(messages):
+                if policy:
+                    self._admit(policy)
+                body, encoding = self.encode_body(message)
+                properties = self.message_properties(mode, encoding=encoding,
+                                                     priority=priority, expiration=expiration)
+                start = time.monotonic()
+                try:
+                    self.channel.publish(exchange if exchange else '', queue.name,
+                                         body, properties, mandatory)
+                except pika.exceptions.NackError:
+                    nacked.append(index)
+                except pika.exceptions.UnroutableError:
+                    returned.append(index)
+                self.outbound += 1
+                self.metrics.sent(queue.name, body)
+                if self.confirming:
+                    self.metrics.confirmed(time.monotonic() - start)
+            return PublishResult(nacked, returned)
+
+        self.tracked = {}
+        self.failures = {}
+        try:
+            for index, message in enumerate(messages):
+                if policy:
+                    self._admit(policy)
+                tag = self.basic_publish(message, queue.name, exchange, mode,
+                                         priority=priority, expiration=expiration,
+                                         mandatory=mandatory)
+                self.tracked[tag] = index
+            self.wait_for_confirms()
+
+            for tag, reason in self.failures.items():
+                (nacked if reason == 'nacked' else returned).append(self.tracked[tag])
+        finally:
+            self.tracked = None
+        return PublishResult(sorted(nacked), sorted(returned))
+
+    def publish(self, message, queue: RabbitQueue = None, exchange: str = None,
+                mode: int = 1, delay: int = 0, correlation: str = None,
+                priority: int = None, expiration: float = None):
+        """
+            Publish a message to a queue, optionally with a priority (for queues
+            declared with max_priority) and expiring after 'expiration' seconds
+            While the broker blocks publishers, or the publish rate limit is
+            reached, the context's flow control policy applies: block (until
+            the timeout), fail or spool the message until publishing resumes
+
+            With a disk spool (broker_spool_dir), publishes are also spooled
+            while the broker is unreachable and replayed, in order, once
+            reconnected, rather than raising
+
+            Without a delayed exchange (broker_delayed_exchange), delayed
+            messages are held by the client and published when due, by the
+            I/O thread if there is one, otherwise whenever the client next
+            processes broker events (e.g. while receiving), so delivery on
+            time depends on the client staying alive. Those not yet due when
+            the client stops are spooled to disk with their remaining delay if
+            there is a disk spool, otherwise published early. A crash loses them.
+
+            Throws:
+                Exception - maybe access rights are insufficient on the queue
+                RabbitFlowControlException if refused by flow control
+
+            Returns:
+                None
+        """
+        publish = (message, queue, exchange, mode, delay, correlation, priority, expiration)
+        self._open_spool()
+
+        if self.retry_at is not None and not self._recover():
+            return self._spool(publish)
+
+        try:
+            #Spooled messages go first, preserving publish order
+            while self.spooled:
+                if not self._admit():
+                    return self._spool(publish)
+                self._route_publish(*self.spooled[0])
+                self.spooled.popleft()
+
+            if not self._admit():
+                return self._spool(publish)
+            return self._route_publish(*publish)
+        except pika.exceptions.AMQPError as exc:
+            if not isinstance(self.spooled, RabbitDiskSpool) or not self._link_down(exc):
+                raise
+            self._offline(exc)
+            return self._spool(publish)
+
+    def flush_spool(self):
+        """
+            Publish any spooled messages, waiting for flow control to allow it
+
+            Throws:
+                RabbitTimedOutException if the broker stays blocked
+
+            Returns:
+                None
+        """
+        self._open_spool()
+        if self.retry_at is not None and not self._recover():
+            return
+
+        while self.spooled:
+            self._admit('block')
+            self._route_publish(*self.spooled[0])
+            self.spooled.popleft()
+
+    def _open_spool(self):
+        """ Open the disk spool, if configured, replaying what a previous run left """
+        if self.context.spool_dir() and not isinstance(self.spooled, RabbitDiskSpool):
+            held = self.spooled
+            self.spooled = RabbitDiskSpool(self.context)
+            if self.spooled:
+                LOGGER.info(f"{len(self.spooled)} spooled publishes to replay")
+            for publish in held:
+                self._spool(publish)
+
+    def _spool(self, publish: tuple):
+        """ Hold a publish back until flow control, or the broker, allows it """
+        if isinstance(self.spooled, RabbitDiskSpool):
+            try:
+                return self.spooled.append(publish)
+            except spool.SpoolFullError as exc:
+                raise RabbitFlowControlException('Publish spool is full.') from exc
+        if len(self.spooled) >= self.context.spool_limit():
+            raise RabbitFlowControlException('Publish spool is full.')
+        self.spooled.append(publish)
+
+    def _link_down(self, exc: Exception) -> bool:
+        """ Whether a failure was losing the broker, rather than a refusal """
+        if isinstance(exc, AUTHENTICATION_ERRORS):
+            return False
+        if isinstance(exc, pika.exceptions.AMQPConnectionError):
+            return True
+        return isinstance(exc, pika.exceptions.ChannelClosed) and \
+            not (self.connection and self.connection.is_open)
+
+    def _offline(self, exc: Exception):
+        """ The broker is unreachable, spool until the next reconnect attempt """
+        delay, max_delay = self.context.reconnect_backoff()
+        self.retry_at = time.monotonic() + min(max_delay, delay * 2 ** self.offline_attempts)
+        self.offline_attempts += 1
+        LOGGER.warning(f"Broker unreachable, spooling publishes: {exc}")
+
+    def _recover(self) -> bool:
+        """ Try to reconnect once it is time to, returning whether connected """
+        if time.monotonic() < self.retry_at:
+            return False
+        try:
+            self.invoke(self._restore, 1)
+        except pika.exceptions.AMQPError as exc:
+            self._offline(exc)
+            return False
+
+        LOGGER.info(f"Broker connection restored, replaying {len(self.spooled)} spooled publishes")
+        self.retry_at = None
+        self.offline_attempts = 0
+        return True
+
+    def _admit(self, policy: str = None) -> bool:
+        """
+            Apply flow control ahead of a publish, waiting while the broker
+            blocks publishers or the rate limit is reached, unless the policy
+            is to fail fast or spool
+
+            Throws:
+                RabbitFlowControlException if the policy is to fail
+                RabbitTimedOutException if still waiting after the timeout
+
+            Returns:
+                True to publish now, False to spool
+        """
+        policy = policy if policy else self.context.flow_control()
+        deadline = time.monotonic() + self.context.timeout()
+
+        while True:
+            if self.blocked:
+                wait, reason = None, f'Publishing blocked by broker: {self.blocked}'
+            else:
+                wait = self.limiter.take() if self.limiter else 0
+                if not wait:
+                    return True
+                reason = 'Publish rate limit reached.'
+
+            if policy == 'fail':
+                raise RabbitFlowControlException(reason)
+            if policy == 'spool':
+                return False
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RabbitTimedOutException(reason)
+            self._flow_wait(min(wait, remaining) if wait else remaining)
+
+    def _flow_wait(self, seconds: float):
+        """ Wait for flow control, servicing the connection unless the I/O thread does """
+        io_loop = self.io
+        if io_loop and not io_loop.on_loop():
+            if self.blocked:
+                io_loop.wait(lambda: not self.blocked, seconds)
+            else:
+                time.sleep(seconds)
+        else:
+            self.connection.process_data_events(time_limit=seconds)
+
+    def _on_blocked(self, frame):
+        """ The broker has stopped accepting publishes, e.g. a memory or disk alarm """
+        self.blocked = getattr(frame.method, 'reason', None) or 'resource alarm'
+        LOGGER.warning(f"Broker blocked publishing: {self.blocked}")
+        if self.io:
+            self.io.notify()
+
+    def _on_unblocked(self, _frame):
+        """ The broker accepts publishes again """
+        self.blocked = None
+        LOGGER.info("Broker unblocked publishing")
+        if self.io:
+            self.io.notify()
+
+    def _route_publish(self, *publish):
+        """ Publish on the thread owning the connection """
+        if self.io and not self.io.on_loop():
+            return self.invoke(self._publish, *publish)
+        return self._publish(*publish)
+
+    def _publish(self, message, queue: RabbitQueue = None, exchange: str = None,
+                 mode: int = 1, delay: int = 0, correlation: str = None,
+                 priority: int = None, expiration: float = None):
+        """ Publish a message admitted by flow control """
+        if not queue:
+            queue = self.pub_queue
+
+        if delay and not exchange and not self.context.delayed_exchange():
+            #No delayed message exchange, so hold the message until due
+            self.scheduled.push(time.monotonic() + delay,
+                                (message, queue, None, mode, 0, correlation, priority, expiration))
+            self._arm_scheduled()
+            return
+
+        if not exchange:
+            exchange = self.context.delayed_exchange() if delay else None
+
+        publish = (message, queue.name, exchange, mode, delay, correlation, priority, expiration)
+        chunk_size = self.context.chunk_size()
+        if chunk_size and RabbitMetrics.size(message) > chunk_size:
+            #Resumes by itself after a reconnect
+            self.publish_chunks(*publish)
+            return
+
+        try:
+            self.basic_publish(*publish)
+        except CONNECTION_ERRORS as exc:
+            if not self.context.reconnect_attempts():
+                raise
+            self.reconnect(exc)
+            if self.window <= 1:
+                #Windowed publishes were already re-sent by the reconnect
+                self.basic_publish(*publish)
+
+    def _arm_scheduled(self):
+        """ Set a timer on the connection for the earliest held publish """
+        due = self.scheduled.next_due()
+        if due is None or (self.timer and self.timer[0] <= due):
+            return
+        if self.timer:
+            self.connection.remove_timeout(self.timer[1])
+        self.timer = (due, self.connection.add_timeout(max(0, due - time.monotonic()),
+                                                       self._release_scheduled))
+
+    def _release_scheduled(self):
+        """ Publish the held messages now due, on the thread processing broker events """
+        self.timer = None
+        try:
+            publish = self.scheduled.ready(time.monotonic())
+            while publish:
+                self._publish(*publish)
+                self.scheduled.pop()
+                publish = self.scheduled.ready(time.monotonic())
+        finally:
+            if self.connection and self.connection.is_open:
+                self._arm_scheduled()
+
+    def _stop_scheduled(self):
+        """
+            Hand over the held publishes not yet due at close: to the disk spool
+            if there is one, keeping the delay left for the next run to honour,
+            otherwise to the broker early, rather than drop them
+        """
+        held = self.scheduled.drain(time.monotonic())
+        if isinstance(self.spooled, RabbitDiskSpool):
+            try:
+                while held:
+                    delay, publish = held[0]
+                    self.spooled.append(publish[:4] + (delay,) + publish[5:])
+                    held.pop(0)
+                return
+            except spool.SpoolFullError as exc:
+                LOGGER.warning(f"Spool full, {len(held)} delayed publishes not spooled at close: {exc}")
+
+        LOGGER.warning(f"{len(held)} delayed publishes not yet due at close, sent early")
+        try:
+            while held:
+                self._publish(*held[0][1])
+                held.pop(0)
+        except Exception as exc:
+            LOGGER.error(f"{len(held)} delayed publishes lost at close: {exc}")
+
+    def publish_chunks(self, message, queue: str, exchange: str = None,
+                       mode: int = 1, delay: int = 0, correlation: str = None,
+                       priority: int = None, expiration: float = None):
+        """
+            Publish a body as a series of chunks of the context's chunk size,
+            each carrying the transfer id, its sequence number, the number of
+            chunks and the body size, for the consumer to reassemble
+            The body is compressed, if enabled, before it is split
+            If the connection is lost part way, the transfer resumes from the
+            first chunk not yet sent once reconnected, keeping its id
+
+            Throws:
+                Exception - maybe access rights are insufficient on the queue
+
+            Returns:
+                None
+        """
+        if not exchange:
+            exchange = ''
+
+        body, encoding = self.encode_body(message)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        size = self.context.chunk_size()
+        count = max(1, -(-len(body) // size))
+        transfer = str(uuid.uuid4())
+
+        seq = 0
+        while seq < count:
+            chunk = body[seq * size:(seq + 1) * size]
+            properties = self.message_properties(mode, delay, correlation, encoding,
+                                                 priority, expiration)
+            properties.headers = dict(properties.headers or {})
+            properties.headers.update(zip(CHUNK_HEADERS, (transfer, seq, count, len(body))))
+            tag = self.delivery_tag
+            try:
+                if self.window > 1:
+                    self._send(exchange, queue, chunk, properties, False)
+                else:
+                    self.send_body(exchange, queue, chunk, properties)
+            except CONNECTION_ERRORS as exc:
+                if not self.context.reconnect_attempts():
+                    raise
+                #A chunk already given a delivery tag is re-sent by the reconnect
+                sent = self.window > 1 and self.delivery_tag != tag
+                self.reconnect(exc)
+                if not sent:
+                    continue
+            seq += 1
+
+    def _consume(self, queue: RabbitQueue) -> deque:
+        """ Start consuming a queue, unless already doing so, returning its buffer """
+        if queue.name not in self.consumers:
+            if not queue.direct and queue.prefetch != self.prefetch:
+                #Only affects consumers started afterwards, so each queue
+                #consumed on the channel keeps its own window
+                self.channel.basic_qos(prefetch_count=queue.prefetch)
+                self.prefetch = queue.prefetch
+            self.deliveries[queue.name] = deque()
+            tag = self.channel.basic_consume(self._on_delivery, queue.name,
+                                             no_ack=queue.direct,
+                                             exclusive=queue.exclusive)
+            self.consumers[queue.name] = tag
+            self.consumer_queues[tag] = queue.name
+            self.consumed[queue.name] = queue
+        return self.deliveries[queue.name]
+
+    def _on_delivery(self, _channel, method, properties, body):
+        """ Buffer a delivery until receive asks for it """
+        queue = self.consumer_queues.get(method.consumer_tag)
+        if queue is not None:
+            if not self.consumed[queue].direct:
+                self.acks.delivered(method.delivery_tag)
+            self.deliveries[queue].append((method, properties, body))
+            if self.io:
+                self.io.notify()
+
+    def _on_cancel(self, method_frame):
+        """ The broker cancelled a consumer, e.g. its queue was deleted """
+        queue = self.consumer_queues.pop(method_frame.method.consumer_tag, None)
+        if queue is not None:
+            LOGGER.warning(f"Consumer for {queue} cancelled by broker")
+            self.metrics.cancelled()
+            del self.consumers[queue]
+            self.deliveries[queue].append(None)
+            if self.io:
+                self.io.notify()
+
+    def cancel(self, queue: RabbitQueue):
+        """
+            Stop consuming a queue, returning any buffered messages to the broker
+
+            Throws:
+                Nothing
+
+            Returns:
+                None
+        """
+        if self.io and not self.io.on_loop():
+            return self.invoke(self.cancel, queue)
+
+        tag = self.consumers.pop(queue.name, None)
+        buffered = self.deliveries.pop(queue.name, deque())
+        self.consumed.pop(queue.name, None)
+        if tag is None or not self.channel.is_open:
+            return
+
+        self.consumer_queues.pop(tag, None)
+        self.channel.basic_cancel(tag)
+        if queue.direct:
+            self.reply_to = None
+            return
+        for msg in buffered:
+            if msg:
+                self.acks.reject(msg[0].delivery_tag)
+        self.acks.flush()
+
+    def direct_reply_queue(self) -> RabbitQueue:
+        """
+            Consume RabbitMQ's direct reply-to pseudo-queue, once per channel
+            Messages published afterwards carry it as their reply_to property,
+            so replies arrive here without declaring a reply queue
+
+            Throws:
+                An exception if the broker does not support direct reply-to
+
+            Returns:
+                The queue to receive replies from
+        """
+        if self.io and not self.io.on_loop():
+            return self.invoke(self.direct_reply_queue)
+
+        queue = self.consumed.get(DIRECT_REPLY_TO)
+        if not queue:
+            queue = RabbitQueue(DIRECT_REPLY_TO, persistent=True)
+            self._consume(queue)
+        self.reply_to = DIRECT_REPLY_TO
+        return queue
+
+    def _next_delivery(self, queue: RabbitQueue, timeout: int):
+        """ Wait for the next delivery, recording the time spent waiting """
+        _, method, properties, body = self._next_any([queue], timeout)
+        return method, properties, body
+
+    def _next_any(self, queues: list, timeout: int):
+        """
+            Wait for the next delivery from any of the queues, recording the
+            time spent waiting
+            Chunks are acknowledged as they are reassembled, the delivery of
+            a body's last chunk stands for the whole body
+        """
+        start = time.monotonic()
+        deadline = start + timeout
+        while True:
+            try:
+                queue, msg = self._wait_any(queues, max(0, deadline - time.monotonic()))
+            except RabbitTimedOutException:
+                self.metrics.waited(time.monotonic() - start, timed_out=True)
+                raise
+            method, properties, body = msg
+            self.metrics.received(queue.name, body)
+            if not RabbitChunkAssembler.chunked(properties):
+                break
+            body = self.chunks.add(properties, body)
+            if body is not None:
+                break
+            if not queue.direct:
+                self.invoke(self.acks.done, method.delivery_tag, queue.ack_batch,
+                            queue.ack_interval, wait=False)
+        self.metrics.waited(time.monotonic() - start)
+
+        body = self.decode_body(body, properties)
+        if self.context.body_view():
+            #A view of pika's bytes, or of the reassembled or decompressed body
+            body = memoryview(body)
+        elif isinstance(body, bytearray):
+            body = bytes(body)
+        return queue, method, properties, body
+
+    def _wait_any(self, queues: list, timeout: int):
+        """
+            Pop the next buffered delivery from any of the queues, processing
+            broker events until one arrives or the timeout expires
+            Queues with deliveries buffered are taken in turn, so a busy queue
+            cannot starve the others
+
+            Throws:
+                RabbitTimedOutException on timeout
+                RabbitConsumerException if a consumer was cancelled by the broker
+
+            Returns:
+                Tuple of (queue, (method, properties, body))
+        """
+        io_loop = self.io
+        if io_loop and not io_loop.on_loop():
+            #The I/O thread fills the buffers, just wait for them
+            buffers = [self.invoke(self._consume, queue) for queue in queues]
+            if not any(buffers):
+                self.invoke(self.acks.flush, wait=False)
+            deadline = time.monotonic() + timeout
+            while True:
+                if not io_loop.wait(lambda: any(buffers), max(0, deadline - time.monotonic())):
+                    if io_loop.quit.is_set():
+                        raise RabbitConsumerException('I/O thread has stopped.')
+                    raise RabbitTimedOutException("Operation timeout reached.")
+                try:
+                    return self._pop_any(queues, buffers)
+                except RabbitTimedOutException:
+                    #Another thread took the delivery first, wait for the next
+                    continue
+
+        buffers = [self._consume(queue) for queue in queues]
+        deadline = time.monotonic() + timeout
+
+        if not any(buffers):
+            #Nothing local, so release the broker's prefetch window before waiting
+            self.acks.flush()
+
+        while not any(buffers):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RabbitTimedOutException("Operation timeout reached.")
+            self.connection.process_data_events(time_limit=remaining)
+
+        return self._pop_any(queues, buffers)
+
+    def _pop_any(self, queues: list, buffers: list):
+        """ Take the next delivery from the first non-empty buffer in turn """
+        for offset in range(len(queues)):
+            index = (self.turn + offset) % len(queues)
+            try:
+                msg = self._pop_delivery(queues[index], buffers[index])
+            except IndexError:
+                #Empty, or emptied by another thread since the I/O thread woke us
+                continue
+            self.turn = index + 1
+            return queues[index], msg
+        raise RabbitTimedOutException("Operation timeout reached.")
+
+    def _pop_delivery(self, queue: RabbitQueue, buffer: deque):
+        """
+            Take the next delivery from a buffer
+
+            Throws:
+                IndexError if the buffer is empty
+        """
+        msg = buffer.popleft()
+        if not msg:
+            self.deliveries.pop(queue.name, None)
+            raise RabbitConsumerException('Consumer cancelled by broker.')
+        return msg
+
+    def receive(self, handler=None, timeout: int = 30, max_messages: int = 0,
+                queue: RabbitQueue = None, with_properties: bool = False,
+                dispatcher: RabbitDispatcher = None) -> str:
+        """
+            Start receiving messages, up to max_messages
+            The handler is called with (body, properties) if with_properties is set
+            Persistent queues keep their consumer (and buffer) between calls
+            Queues with ack_late only acknowledge once the handler returns,
+            a failing handler returns its message to the queue
+            With a dispatcher, handlers run on its pool with up to prefetch
+            messages in flight, each acknowledged once its handler returns
+
+            Throws:
+                Exception if consume fails
+                RabbitConsumerException if a reconnect renames the server named queue
 
             Returns:
                 The last message received
         """
+        if not queue:
+            queue = self.sub_queue
+
+        while True:
+            try:
+                if handler and dispatcher:
+                    return self._receive_dispatched(handler, timeout, max_messages, queue,
+                                                    with_properties, dispatcher)
+                return self._receive(handler, timeout, max_messages, queue, with_properties)
+            except CONNECTION_ERRORS as exc:
+                if not self.context.reconnect_attempts():
+                    LOGGER.error(exc)
+                    raise RabbitConsumerException('Consumer cancelled prior to timeout.') from exc
+                name = queue.name
+                self.reconnect(exc)
+                if queue.name != name:
+                    #Whatever was sent to the old name, e.g. a reply, is lost
+                    raise RabbitConsumerException(
+                        f"Queue {name} was renamed {queue.name} by a reconnect.") from exc
+
+    def _receive(self, handler, timeout: int, max_messages: int,
+                 queue: RabbitQueue, with_properties: bool) -> str:
+        """ Receive messages on the current connection """
         msgs = 0
         body = None
 
+        try:
+            while True:
+                method_frame, properties, body = self._next_delivery(queue, timeout)
+
+                msgs += 1
+                self.inbound += 1
+                #Direct reply-to deliveries are not acknowledged
+                tag = None if queue.direct else method_frame.delivery_tag
+
+                if tag and not queue.ack_late:
+                    self.invoke(self.acks.done, tag, queue.ack_batch, queue.ack_interval,
+                                wait=False)
+
+                if handler:
+                    try:
+                        #body is of type 'bytes' in Python 3+
+                        if with_properties:
+                            handler(body, properties)
+                        else:
+                            handler(body)
+                    except Exception:
+                        if tag:
+                            self.invoke(self.acks.reject, tag)
+                        raise
+
+                if tag and queue.ack_late:
+                    self.invoke(self.acks.done, tag, queue.ack_batch, queue.ack_interval,
+                                wait=False)
+
+                if not handler and not max_messages:
+                    break
+
+                #Stop consuming if message limit reached
+                if msgs == max_messages:
+                    break
+        except CONNECTION_ERRORS:
+            self.acks.clear()
+            raise
+        except pika.exceptions.AMQPError as exc:
+            LOGGER.error(exc)
+            self.acks.clear()
+        finally:
+            #Persistent queues leave a partial batch pending, it is flushed
+            #before the next wait for deliveries or when the client stops
+            if not queue.persistent:
+                self.cancel(queue)
+
+        if not msgs:
+            raise RabbitConsumerException('Consumer cancelled prior to timeout.')
+
+        return body
+
+    def iter_messages(self, queue: RabbitQueue = None, timeout: int = 30,
+                      max_messages: int = 0, max_bytes: int = 0):
+        """
+            Lazily yield (body, properties, ack_handle) for each delivery, until
+            max_messages or max_bytes of bodies (0 for no limit) have been
+            received, or none arrives within timeout seconds
+            The consumer (and buffer) is kept when iteration ends or the caller
+            stops early, as for persistent queues, until cancel or stop
+            Queues with ack_late leave settling to the ack_handle, a delivery
+            still unsettled is acknowledged when the next is requested and
+            returned to the queue if iteration is abandoned. Other deliveries
+            are acknowledged on receipt.
+            Given a list of queues, all are consumed on this channel, each with
+            its own prefetch window, and taken in turn when several have
+            deliveries waiting; ack_handle.queue is the one delivered from
+
+            Throws:
+                RabbitConsumerException if a consumer is cancelled
+
+            Returns:
+                Generator of (body, properties, RabbitAckHandle)
+        """
         if not queue:
             queue = self.sub_queue
+        queues = list(queue) if isinstance(queue, (list, tuple)) else [queue]
 
-        try:
-            for msg in self.channel.consume(
-                    queue.name,
-                    exclusive=queue.exclusive,
-                    inactivity_timeout=timeout):
+        for other in queues:
+            if other.name not in self.consumers and other not in (self.pub_queue, self.sub_queue):
+                self.invoke(self.declare_queue, other)
 
-                method_frame, properties, body = msg
-                if not method_frame and not properties and not body:
-                    raise RabbitTimedOutException("Operation timeout reached.")
+        msgs, size = 0, 0
+        handle = None
+
+        try:
+            while not max_messages or msgs < max_messages:
+                if max_bytes and size >= max_bytes:
+                    break
+                try:
+                    source, method_frame, properties, body = self._next_any(queues, timeout)
+                except RabbitTimedOutException:
+                    break
+                except CONNECTION_ERRORS as exc:
+                    self.acks.clear()
+                    if not self.context.reconnect_attempts():
+                        LOGGER.error(exc)
+                        raise RabbitConsumerException('Consumer cancelled prior to timeout.') from exc
+                    self.reconnect(exc)
+                    continue
 
                 msgs += 1
+                size += len(body)
                 self.inbound += 1
-                self.channel.basic_ack(method_frame.delivery_tag)
+                #Direct reply-to deliveries are not acknowledged
+                tag = None if source.direct else method_frame.delivery_tag
+
+                if tag and not source.ack_late:
+                    self.invoke(self.acks.done, tag, source.ack_batch, source.ack_interval,
+                                wait=False)
+                    tag = None
+
+                handle = RabbitAckHandle(self, source, tag)
+                yield body, properties, handle
+                #Asking for more means the last delivery was handled
+                handle.ack()
+        finally:
+            #Abandoned mid-delivery, e.g. the caller broke out of its loop
+            if handle and not handle.settled:
+                handle.reject()
+
+    def _receive_dispatched(self, handler, timeout: int, max_messages: int,
+                            queue: RabbitQueue, with_properties: bool,
+                            dispatcher: RabbitDispatcher) -> str:
+        """ Receive messages on the current connection, handling them on a pool """
+        msgs = 0
+        body = None
+        in_flight = set()
+        failures = []
 
-                if handler:
-                    #body is of type 'bytes' in Python 3+
-                    handler(body)
-                elif not max_messages:
+        try:
+            while True:
+                #Bound the messages in flight, the broker would stop at prefetch anyway
+                self._await_dispatched(dispatcher, in_flight, queue.prefetch)
+                if failures:
                     break
 
+                method_frame, properties, body = self._next_delivery(queue, timeout)
+
+                msgs += 1
+                self.inbound += 1
+                self._dispatch(dispatcher, handler, method_frame.delivery_tag, body,
+                               properties, with_properties, queue, in_flight, failures)
+
                 #Stop consuming if message limit reached
                 if msgs == max_messages:
                     break
+        except CONNECTION_ERRORS:
+            self.acks.clear()
+            raise
         except pika.exceptions.AMQPError as exc:
             LOGGER.error(exc)
+            self.acks.clear()
         finally:
-            self.channel.cancel()
+            try:
+                self._await_dispatched(dispatcher, in_flight, 1)
+            except CONNECTION_ERRORS:
+                #Unacknowledged messages are redelivered
+                pass
+            if not queue.persistent:
+                self.cancel(queue)
+
+        if failures:
+            raise failures[0]
 
         if not msgs:
             raise RabbitConsumerException('Consumer cancelled prior to timeout.')
 
         return body
 
+    def _dispatch(self, dispatcher: RabbitDispatcher, handler, tag: int, body, properties,
+                  with_properties: bool, queue: RabbitQueue, in_flight: set, failures: list):
+        """ Hand a delivery to the dispatcher, settling it on the connection thread """
+        connection = self.connection
+
+        def settle(exc):
+            try:
+                #After a reconnect the message is redelivered instead
+                if connection is self.connection and not queue.direct:
+                    if exc:
+                        self.acks.reject(tag)
+                    else:
+                        self.acks.done(tag, queue.ack_batch, queue.ack_interval)
+            finally:
+                with dispatcher.ready:
+                    in_flight.discard(tag)
+                    if exc:
+                        LOGGER.error(f"Handler failed: {exc}")
+                        failures.append(exc)
+                    dispatcher.ready.notify_all()
+
+        def completed(exc):
+            connection.add_callback_threadsafe(lambda: settle(exc))
+
+        with dispatcher.ready:
+            in_flight.add(tag)
+        args = (body, properties) if with_properties else (body,)
+        dispatcher.dispatch(handler, args, dispatcher.key_of(body, properties), completed)
+
+    def _await_dispatched(self, dispatcher: RabbitDispatcher, in_flight: set, limit: int):
+        """ Wait until fewer than limit dispatched messages remain unsettled """
+        connection = self.connection
+
+        while len(in_flight) >= limit:
+            io_loop = self.io
+            if io_loop and not io_loop.on_loop():
+                #The I/O thread settles, recheck periodically in case it reconnects
+                dispatcher.wait(lambda: len(in_flight) < limit, 1)
+                if io_loop.quit.is_set() or self.connection is not connection:
+                    return
+            else:
+                #Settlements are queued on the connection and wake it up
+                self.connection.process_data_events(time_limit=None)
+
+    def stop(self):
+        """
+            Wait for outstanding publisher confirms, then close
+
+            Throws:
+                Nothing
+
+            Returns:
+                None
+        """
+        io_loop = self.io
+        if io_loop and io_loop.client is self:
+            io_loop.stop()
+        elif io_loop:
+            #Another client's I/O thread owns the shared connection
+            try:
+                return self.invoke(self._stop)
+            except Exception:
+                return None
+        self._stop()
+
+    def _stop(self):
+        """ Flush confirms and acknowledgements, then close """
+        if self.spooled:
+            try:
+                self.flush_spool()
+            except Exception as exc:
+                LOGGER.warning(f"{len(self.spooled)} spooled publishes not sent at close: {exc}")
+        if self.scheduled:
+            #Without an I/O thread the timer only fires while events are processed
+            try:
+                self._release_scheduled()
+            except Exception as exc:
+                LOGGER.warning(f"Delayed publishes due at close not sent: {exc}")
+        if self.scheduled:
+            self._stop_scheduled()
+        if isinstance(self.spooled, RabbitDiskSpool):
+            if self.spooled:
+                LOGGER.warning(f"{len(self.spooled)} publishes left in the spool for the next run")
+            self.spooled.close()
+            self.spooled = deque()
+        if self.unconfirmed:
+            try:
+                self.wait_for_confirms()
+            except Exception as exc:
+                LOGGER.warning(f"{len(self.unconfirmed)} publishes unconfirmed at close: {exc}")
+        try:
+            if self.acks and self.channel.is_open:
+                self.acks.flush()
+        except Exception:
+            pass
+        super(RabbitClient, self).stop()
+
+
+class RabbitFuture(Future):
+    """
+        Outstanding pipelined request, resolved when the matching reply arrives
+        The request fails with RabbitTimedOutException once 'timeout' seconds
+        have passed without a reply, never if 0
+        Failures are re-raised as the replacement given for their type in
+        'errors', e.g. {RabbitTimedOutException: ServiceTimedOut}
+    """
+    def __init__(self, client, correlation: str, timeout: int,
+                 queue: RabbitQueue = None, decoder=None, errors: dict = None):
+        super().__init__()
+        self.client = client
+        self.correlation = correlation
+        self.timeout = timeout
+        self.queue = queue
+        self.decoder = decoder
+        self.errors = errors if errors else {}
+        self.started = time.monotonic()
+
+    def expiry(self) -> float:
+        """ Return when the request times out, None if never """
+        return self.started + self.timeout if self.timeout else None
+
+    def translate(self, exc: Exception) -> Exception:
+        """ Return the replacement for a failure, if any """
+        for kind, replacement in self.errors.items():
+            if isinstance(exc, kind) and not isinstance(exc, replacement):
+                error = replacement(exc)
+                error.__cause__ = exc
+                return error
+        return exc
+
+    def resolve(self, message):
+        """ Complete the future with a reply, decoding if required """
+        self.client.metrics.replied(time.monotonic() - self.started)
+        try:
+            self.set_result(self.decoder(message) if self.decoder else message)
+        except Exception as exc:
+            self.fail(exc)
+
+    def fail(self, exc: Exception):
+        """ Complete the future with a failure, unless already complete """
+        try:
+            self.set_exception(self.translate(exc))
+        except InvalidStateError:
+            pass
+
+    def wait(self, timeout: float = None):
+        """
+            Pump the reply queue from the calling thread for up to 'timeout'
+            seconds, or until the request times out if None; 0 polls once
+
+            Throws:
+                RabbitTimedOutException (or its replacement) if still unresolved
+
+            Returns:
+                Nothing
+        """
+        if not self.done():
+            self.client.wait_reply(self, timeout)
+        if not self.done():
+            raise self.translate(RabbitTimedOutException("Operation timeout reached."))
+
+    def result(self, timeout=None):
+        """
+            Wait for the reply, pumping the reply queue from the calling thread
+
+            Throws:
+                RabbitTimedOutException if no matching reply arrives in time
+
+            Returns:
+                The (decoded) reply
+        """
+        self.wait(timeout)
+        return super().result(0)
+
+    def exception(self, timeout=None):
+        self.wait(timeout)
+        return super().exception(0)
+
 
 class RabbitDualClient():
     """
         Communicates with a RabbitMQ service
+        Subscriber and publisher have dedicated connections, unless drawn from
+        'pool', by default CONNECTION_POOL if the context pools connections
     """
+    pool = None
+    #Client class used unless start_subscriber/start_publisher are given one
+    transport = None
+
     def __init__(self, context):
         """
             Class initializer
@@ -459,8 +2951,18 @@ class RabbitDualClient():
         self.subscriber = None
         self.publisher = None
         self.last_recv_msg = None
-
-    def start_subscriber(self, queue: RabbitQueue, client=RabbitClient):
+        #Pipelined requests awaiting a reply, keyed by correlation id
+        self.pending = {}
+        #Requests are added by callers and resolved by whichever thread pumps replies
+        self.pending_lock = threading.Lock()
+        #Connections are driven by one thread at a time, so one caller pumps
+        #replies while the others wait for it to resolve theirs
+        self.pump = threading.Condition()
+        self.pumping = False
+        #Shared by the subscriber and publisher
+        self.metrics = RabbitMetrics()
+
+    def start_subscriber(self, queue: RabbitQueue, client=None):
         """
             Start the subscriber connection to the broker
 
@@ -470,14 +2972,45 @@ class RabbitDualClient():
             Returns:
                 Nothing
         """
-        self.subscriber = client(self.context)
+        if not client:
+            client = self.transport if self.transport else RabbitClient
+        self.subscriber = client(self.context, pool=self.connection_pool())
+        self.subscriber.metrics = self.metrics
+        self.subscriber.on_renamed = self.renamed
         self.subscriber.start(subscribe=queue)
 
+    def connection_pool(self) -> RabbitConnectionPool:
+        """ The pool connections are drawn from, None for dedicated connections """
+        if self.pool:
+            return self.pool
+        return CONNECTION_POOL if self.context.pool_connections() else None
+
     def get_subscribe_queue(self):
         """ Get the clients subscribe queue, default to None """
         return self.subscriber.get_subscribe_queue()
 
-    def start_publisher(self, queue: RabbitQueue, client=RabbitClient):
+    def renamed(self, queue: RabbitQueue, name: str):
+        """
+            A reconnect has given a server named reply queue a new name, so the
+            replies to requests sent with the old one are lost: fail them
+
+            Throws:
+                Nothing
+
+            Returns:
+                Nothing
+        """
+        default = queue is self.subscriber.sub_queue
+        with self.pending_lock:
+            lost = [future for future in self.pending.values()
+                    if future.queue is queue or (future.queue is None and default)]
+            for future in lost:
+                del self.pending[future.correlation]
+        for future in lost:
+            future.fail(RabbitConsumerException(
+                f"Reply queue {name} was renamed {queue.name} by a reconnect."))
+
+    def start_publisher(self, queue: RabbitQueue, client=None):
         """
             Start the publisher connection to the broker
 
@@ -487,10 +3020,15 @@ class RabbitDualClient():
             Returns:
                 Nothing
         """
-        self.publisher = client(self.context)
+        if not client:
+            client = self.transport if self.transport else RabbitClient
+        self.publisher = client(self.context, pool=self.connection_pool())
+        self.publisher.metrics = self.metrics
         self.publisher.start(publish=queue)
 
-    def send_message(self, message, queue: RabbitQueue = None, delay: int = 0):
+    def send_message(self, message, queue: RabbitQueue = None, delay: int = 0,
+                     correlation: str = None, priority: int = None,
+                     expiration: float = None):
         """
             Publish a message, delaying delivery by 'delay' seconds
 
@@ -500,11 +3038,13 @@ class RabbitDualClient():
             Returns:
                 Nothing
         """
-        self.publisher.publish(message, queue, delay=delay)
+        self.publisher.publish(message, queue, delay=delay, correlation=correlation,
+                               priority=priority, expiration=expiration)
 
-    def receive_message(self, handler, timeout: int, max_messages: int):
+    def receive_message(self, handler, timeout: int, max_messages: int,
+                        dispatcher: RabbitDispatcher = None):
         """
-            Receive messages
+            Receive messages, handling them on the dispatcher's pool if given
 
             Throws:
                 An exception if receive is not successful
@@ -512,7 +3052,22 @@ class RabbitDualClient():
             Returns:
                 Nothing
         """
-        self.subscriber.receive(handler, timeout, max_messages)
+        self.subscriber.receive(handler, timeout, max_messages, dispatcher=dispatcher)
+
+    def iter_messages(self, timeout: int, max_messages: int = 0, max_bytes: int = 0,
+                      queues: list = None):
+        """
+            Lazily yield (body, properties, ack_handle) for each message received,
+            fanning in 'queues' over the subscriber's connection if given
+
+            Throws:
+                An exception if receive is not successful
+
+            Returns:
+                Generator of (body, properties, RabbitAckHandle)
+        """
+        return self.subscriber.iter_messages(queues, timeout=timeout, max_messages=max_messages,
+                                             max_bytes=max_bytes)
 
     def internal_handler(self, message):
         """
@@ -526,9 +3081,11 @@ class RabbitDualClient():
         """
         self.last_recv_msg = message
 
-    def invoke_service(self, message, timeout: int = 30, queue: RabbitQueue = None) -> str:
+    def invoke_service(self, message, timeout: int = 30, queue: RabbitQueue = None,
+                       priority: int = None) -> str:
         """
             Publish a message and receive a reply
+            The request expires unread once the caller has stopped waiting
 
             Throws:
                 An exception if not successful or timedout
@@ -538,21 +3095,189 @@ class RabbitDualClient():
         """
         self.last_recv_msg = None
         LOGGER.debug(f"Sending message: {message}")
-        self.send_message(message)
+        start = time.monotonic()
+        self.send_message(message, priority=priority, expiration=timeout if timeout else None)
 
         LOGGER.debug("Waiting for reply...")
         #Now wait for the reply
-        self.subscriber.receive(self.internal_handler, timeout, 1, queue)
+        self.receiver(queue).receive(self.internal_handler, timeout, 1, queue)
+        self.metrics.replied(time.monotonic() - start)
         LOGGER.debug(f"Received: {self.last_recv_msg}")
         return self.last_recv_msg
 
-    def mktemp_queue(self) -> RabbitQueue:
-        """ Create a temporary, broker defined queue """
+    def invoke_service_async(self, message, correlation, timeout: int = 30,
+                             queue: RabbitQueue = None, decoder=None,
+                             priority: int = None, errors: dict = None) -> RabbitFuture:
+        """
+            Publish a message without waiting for the reply
+            Many requests may be outstanding on the same reply queue,
+            replies are matched to requests by correlation id
+            The request expires unread once the timeout has passed
+            Failures are replaced as given by 'errors', see RabbitFuture
+
+            Throws:
+                An exception if publish is not successful
+
+            Returns:
+                A RabbitFuture, resolved with the (decoded) reply
+        """
+        future = RabbitFuture(self, str(correlation), timeout, queue, decoder, errors)
+        with self.pending_lock:
+            self.pending[future.correlation] = future
+        LOGGER.debug(f"Sending message ({future.correlation}): {message}")
+
+        try:
+            self.send_message(message, correlation=future.correlation, priority=priority,
+                              expiration=timeout if timeout else None)
+        except Exception:
+            with self.pending_lock:
+                self.pending.pop(future.correlation, None)
+            raise
+        return future
+
+    def reply_correlation(self, message, properties) -> str:
+        """
+            Determine the correlation id of a reply, over-ride for
+            services that only echo the id in the message body
+
+            Throws:
+                Nothing
+
+            Returns:
+                The correlation id, or None
+        """
+        return properties.correlation_id if properties else None
+
+    def reply_handler(self, message, properties):
+        """
+            Handler for pipelined replies - resolve the matching future
+
+            Throws:
+                Nothing
+
+            Returns:
+                Nothing
+        """
+        try:
+            correlation = self.reply_correlation(message, properties)
+        except Exception as exc:
+            #One unreadable reply must not fail the requests still waiting
+            LOGGER.error(f"Discarding unreadable reply: {exc}")
+            return
+
+        with self.pending_lock:
+            if correlation is None and len(self.pending) == 1:
+                #Service does not echo correlation ids, only one candidate
+                correlation = next(iter(self.pending))
+            future = self.pending.pop(str(correlation), None)
+
+        if not future:
+            LOGGER.warning(f"Discarding unmatched reply ({correlation})")
+            return
+        LOGGER.debug(f"Received ({correlation}): {message}")
+        future.resolve(message)
+
+    def wait_reply(self, future: RabbitFuture, timeout: float = None):
+        """
+            Receive replies until the given request is resolved, for up to
+            'timeout' seconds (until the request times out if None, 0 polls once)
+            Replies for other outstanding requests are resolved along the way
+            A request not resolved in its own timeout fails
+            Only one thread pumps at a time, others wait for it to resolve
+            their request, taking over once it stops
+
+            Throws:
+                Nothing, failures are set on the future
+
+            Returns:
+                Nothing
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        expiry = future.expiry()
+        polled = False
+
+        while not future.done():
+            now = time.monotonic()
+            if expiry is not None and now >= expiry:
+                self._withdraw(future, RabbitTimedOutException("Operation timeout reached."))
+                return
+            if deadline is not None and now >= deadline and polled:
+                return
+
+            limit = min(filter(None, (deadline, expiry)), default=None)
+            remaining = max(0, limit - now) if limit else self.context.timeout()
+            polled = True
+            if not self._take_pump(remaining):
+                continue
+            try:
+                self.receiver(future.queue).receive(self.reply_handler, remaining, 1,
+                                                    future.queue, with_properties=True)
+            except RabbitTimedOutException:
+                #Checked against the deadline and the request's timeout above
+                pass
+            except Exception as exc:
+                self._withdraw(future, exc)
+                return
+            finally:
+                self._release_pump()
+
+    def _take_pump(self, timeout: float) -> bool:
+        """
+            Become the thread pumping replies, or if another already is,
+            wait up to 'timeout' seconds for it to handle a reply and return False
+        """
+        with self.pump:
+            if self.pumping:
+                self.pump.wait(timeout)
+                return False
+            self.pumping = True
+            return True
+
+    def _release_pump(self):
+        """ Stop pumping replies, waking the waiting threads to check their requests """
+        with self.pump:
+            self.pumping = False
+            self.pump.notify_all()
+
+    def _withdraw(self, future: RabbitFuture, exc: Exception):
+        """ Stop waiting for a pipelined request's reply, failing its future """
+        with self.pending_lock:
+            self.pending.pop(future.correlation, None)
+        future.fail(exc)
+
+    def start_io(self):
+        """
+            Hand the broker connections over to dedicated I/O threads, a shared
+            connection gets a single thread
+
+            Throws:
+                Nothing
+
+            Returns:
+                Nothing
+        """
+        for client in (self.subscriber, self.publisher):
+            if client and not client.io:
+                RabbitIOLoop(client).start()
+
+    def mktemp_queue(self, persistent: bool = False) -> RabbitQueue:
+        """
+            Create a temporary, broker defined queue
+            With direct reply-to enabled in the context, no queue is created and
+            replies to the publisher's messages arrive on the pseudo-queue instead
+        """
+        if self.context.direct_reply():
+            return self.publisher.direct_reply_queue()
+
         #This allows for over-riding the class queue
-        queue = RabbitQueue()
+        queue = RabbitQueue(persistent=persistent)
         self.subscriber.declare_queue(queue)
         return queue
 
+    def receiver(self, queue: RabbitQueue = None) -> RabbitClient:
+        """ The client consuming a queue: direct replies go to the publisher's channel """
+        return self.publisher if queue and queue.direct else self.subscriber
+
     def stop(self):
         """
             Close connection to service
@@ -567,24 +3292,152 @@ class RabbitDualClient():
         self.publisher.stop()
 
 
-class RabbitHeartbeat():
+class RabbitIOLoop():
     """
-        Thread to keep the broker connection alive
+        Thread that owns a client's broker connection, processing broker events
+        (heartbeats, deliveries, confirms) as soon as they arrive. While it runs,
+        the client's operations from other threads are submitted to it and the
+        callers block on futures.
     """
+    #Running I/O threads, keyed by the connection they own
+    running = {}
+
     def __init__(self, client: RabbitClient):
-        self.quit = None
-        self.thread = threading.Thread(target=self.heartbeat, args=(client.connection,))
+        self.client = client
+        self.connection = None
+        self.quit = threading.Event()
+        self.ready = threading.Condition()
+        self.thread = None
 
-    def heartbeat(self, connection):
-        """ Thread that periodically processes pika events """
-        while not self.quit.wait(1.0):
-            connection.process_data_events()
+    @classmethod
+    def owner_of(cls, connection):
+        """ Return the I/O thread owning a connection, default to None """
+        return cls.running.get(id(connection)) if connection else None
 
-    def __enter__(self):
-        self.quit = threading.Event()
+    def on_loop(self) -> bool:
+        """ Whether the caller is the I/O thread itself """
+        return threading.current_thread() is self.thread
+
+    def start(self):
+        """
+            Start the thread, unless the connection already has one
+
+            Throws:
+                Nothing
+
+            Returns:
+                self
+        """
+        if self.owner_of(self.client.connection):
+            return self
+
+        self.connection = self.client.connection
+        self.running[id(self.connection)] = self
+        self.thread = threading.Thread(target=self.run, name='rabbit-io', daemon=True)
         self.thread.start()
         return self
 
-    def __exit__(self, *args):
+    def run(self):
+        """ Process broker events until stopped """
+        while not self.quit.is_set():
+            try:
+                if self.client.connection is not self.connection:
+                    #The client has reconnected
+                    self.running.pop(id(self.connection), None)
+                    self.connection = self.client.connection
+                    self.running[id(self.connection)] = self
+                #Submitted work wakes the connection, so no need to poll
+                self.connection.process_data_events(time_limit=None)
+            except CONNECTION_ERRORS as exc:
+                try:
+                    if not self.client.context.reconnect_attempts():
+                        raise
+                    self.client.reconnect(exc)
+                except Exception:
+                    LOGGER.error(f"I/O thread stopping: {exc}")
+                    self.quit.set()
+            except Exception as exc:
+                LOGGER.error(f"I/O thread stopping: {exc}")
+                self.quit.set()
+        self.notify()
+
+    def submit(self, operation, *args, **kwargs) -> Future:
+        """
+            Run an operation on the I/O thread
+
+            Throws:
+                Nothing, failures are set on the future
+
+            Returns:
+                A future for the result of the operation
+        """
+        future = Future()
+
+        def call():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(operation(*args, **kwargs))
+            except Exception as exc:
+                future.set_exception(exc)
+
+        if self.on_loop():
+            call()
+        elif self.quit.is_set():
+            future.set_exception(RabbitConsumerException('I/O thread has stopped.'))
+        else:
+            try:
+                self.connection.add_callback_threadsafe(call)
+            except Exception as exc:
+                future.set_exception(exc)
+        return future
+
+    def notify(self):
+        """ Wake threads waiting for deliveries """
+        with self.ready:
+            self.ready.notify_all()
+
+    def wait(self, predicate, timeout: float) -> bool:
+        """
+            Wait until predicate holds, the timeout expires or the thread stops
+
+            Returns:
+                The final value of the predicate
+        """
+        with self.ready:
+            self.ready.wait_for(lambda: predicate() or self.quit.is_set(), timeout)
+            return bool(predicate())
+
+    def stop(self):
+        """
+            Stop the thread, the connection is left open
+
+            Throws:
+                Nothing
+
+            Returns:
+                None
+        """
+        if not self.thread:
+            return
+
         self.quit.set()
-        self.thread.join()
+        if not self.on_loop():
+            try:
+                #Wake the thread from its wait for broker events
+                self.connection.add_callback_threadsafe(lambda: None)
+            except Exception:
+                pass
+            self.thread.join()
+        self.running.pop(id(self.connection), None)
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+#Former name, kept for compatibility
+RabbitHeartbeat = RabbitIOLoop
@@ -25,11 +25,19 @@ in DRL funded by the European Union under the Horizon 2020 Program.
 
 import pickle
 import base64
+import binascii
 import json
 import jsonpickle
 from abc import ABC, abstractmethod
 
 
+def text(message) -> str:
+    '''Decode a message held in any buffer (e.g. a memoryview) as UTF-8 text'''
+    if isinstance(message, (str, bytes, bytearray)):
+        return message
+    return str(message, 'utf-8')
+
+
 class SerializerABC(ABC):
     '''Basic serialization'''
 
@@ -39,7 +47,7 @@ class SerializerABC(ABC):
 
     @abstractmethod
     def deserialize(self, message: bytes) -> any:
-        '''Convert serialized message to dict'''
+        '''Convert serialized message, str or any bytes-like object, to dict'''
 
 
 class JsonSerializer(SerializerABC):
@@ -51,7 +59,7 @@ class JsonSerializer(SerializerABC):
 
     def deserialize(self, message: bytes) -> any:
         '''Convert serialized message to dict'''
-        return json.loads(message)
+        return json.loads(text(message))
 
 
 class JsonPickleSerializer(SerializerABC):
@@ -63,7 +71,7 @@ class JsonPickleSerializer(SerializerABC):
 
     def deserialize(self, message: bytes) -> any:
         '''Convert serialized message to dict'''
-        return jsonpickle.decode(message)
+        return jsonpickle.decode(text(message))
 
 
 class Base64Serializer(SerializerABC):
@@ -75,4 +83,8 @@ class Base64Serializer(SerializerABC):
 
     def deserialize(self, message: bytes) -> any:
         '''Convert serialized message to dict'''
-        return pickle.loads(base64.b64decode(message))
+        #b64decode copies a bytes-like object to bytes first, a2b_base64 reads
+        #the buffer (e.g. a memoryview or mmap) in place
+        if isinstance(message, str):
+            return pickle.loads(base64.b64decode(message))
+        return pickle.loads(binascii.a2b_base64(message))
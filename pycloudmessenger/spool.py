@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+#author markpurcell@ie.ibm.com
+
+"""Disk-backed, append-only record spool.
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import os
+import time
+import json
+import zlib
+import struct
+import logging
+import threading
+
+LOGGER = logging.getLogger(__package__)
+
+#Record header: payload length and CRC32
+HEADER = struct.Struct('>II')
+
+#When appends and consumption reach the disk
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+class SpoolFullError(Exception):
+    '''The spool has reached its size limit'''
+
+
+class DiskSpool():
+    '''
+        Write-ahead log of records, consumed first in first out. Records are
+        appended to segment files, a segment is deleted once fully consumed
+        and the read position is kept in a cursor file, so records survive
+        a restart. A torn record at the tail (e.g. a crash mid-write) is
+        discarded on opening. Not safe for use by several processes.
+
+        :param directory: where segments are kept, created if required
+        :param segment_size: bytes per segment before starting a new one
+        :param max_bytes: unconsumed bytes allowed, beyond which appends fail
+        :param fsync: always (each append and consume), interval or never
+        :param fsync_interval: seconds between syncs under the interval policy
+    '''
+    def __init__(self, directory: str, segment_size: int = 16 * 1024 * 1024,
+                 max_bytes: int = 1024 * 1024 * 1024, fsync: str = 'interval',
+                 fsync_interval: float = 1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise Exception(f'Unknown spool fsync policy {fsync}.')
+
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.synced = time.monotonic()
+        self.dirty = False
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(directory)
+                               if name.endswith('.seg') and name[:-4].isdigit())
+        self.head, self.offset = self.read_cursor()
+        self.segments = [segment for segment in self.segments if segment >= self.head]
+        if not self.segments or self.segments[0] != self.head:
+            self.offset = 0
+
+        #Count what is left, discarding any torn record at the tail
+        self.count, self.bytes = 0, 0
+        for index, segment in enumerate(self.segments):
+            start = self.offset if index == 0 else 0
+            count, end = self.scan(segment, start)
+            self.count += count
+            self.bytes += end - start
+            if end < os.path.getsize(self.path(segment)):
+                LOGGER.warning(f"Discarding torn spool record in segment {segment}")
+                with open(self.path(segment), 'r+b') as torn:
+                    torn.truncate(end)
+                for later in self.segments[index + 1:]:
+                    os.remove(self.path(later))
+                self.segments = self.segments[:index + 1]
+                break
+
+        if not self.segments:
+            self.segments = [self.head]
+        self.head = self.segments[0]
+        self.writer = open(self.path(self.segments[-1]), 'ab')
+        self.reader = None
+        self.peeked = None
+
+    def path(self, segment: int) -> str:
+        '''The file holding a segment'''
+        return os.path.join(self.directory, f'{segment:012d}.seg')
+
+    def read_cursor(self) -> tuple:
+        '''The (segment, offset) consumption has reached'''
+        try:
+            with open(os.path.join(self.directory, 'cursor')) as cursor:
+                position = json.load(cursor)
+            return position['segment'], position['offset']
+        except (OSError, ValueError, KeyError):
+            return (self.segments[0] if self.segments else 0), 0
+
+    def write_cursor(self):
+        '''Persist the consumption position, atomically replacing the last'''
+        name = os.path.join(self.directory, 'cursor')
+        with open(name + '.tmp', 'w') as cursor:
+            json.dump({'segment': self.head, 'offset': self.offset}, cursor)
+            if self.fsync != 'never':
+                cursor.flush()
+                os.fsync(cursor.fileno())
+        os.replace(name + '.tmp', name)
+
+    def scan(self, segment: int, offset: int) -> tuple:
+        '''Count the intact records of a segment from an offset, returning (count, end)'''
+        count = 0
+        with open(self.path(segment), 'rb') as records:
+            records.seek(offset)
+            while True:
+                record = self.read(records)
+                if record is None:
+                    return count, offset
+                count += 1
+                offset += HEADER.size + len(record)
+
+    @staticmethod
+    def read(records) -> bytes:
+        '''Read the next record, None at the end or if it is torn or corrupt'''
+        header = records.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        length, crc = HEADER.unpack(header)
+        data = records.read(length)
+        if len(data) < length or zlib.crc32(data) != crc:
+            return None
+        return data
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, data: bytes):
+        '''
+            Add a record at the tail
+
+            Throws:
+                SpoolFullError if the record would exceed max_bytes
+        '''
+        size = HEADER.size + len(data)
+        with self.lock:
+            if self.bytes + size > self.max_bytes:
+                raise SpoolFullError(f'Spool {self.directory} is full.')
+
+            if self.writer.tell() and self.writer.tell() + size > self.segment_size:
+                self.writer.close()
+                self.segments.append(self.segments[-1] + 1)
+                self.writer = open(self.path(self.segments[-1]), 'ab')
+
+            self.writer.write(HEADER.pack(len(data), zlib.crc32(data)) + data)
+            self.writer.flush()
+            self.count += 1
+            self.bytes += size
+            self.sync()
+
+    def peek(self) -> bytes:
+        '''The record at the head, None if the spool is empty'''
+        with self.lock:
+            if self.peeked is None and self.count:
+                if not self.reader:
+                    self.reader = open(self.path(self.head), 'rb')
+                self.reader.seek(self.offset)
+                self.peeked = self.read(self.reader)
+            return self.peeked
+
+    def pop(self):
+        '''Consume the record at the head, as returned by peek'''
+        if self.peek() is None:
+            return
+
+        with self.lock:
+            self.offset += HEADER.size + len(self.peeked)
+            self.count -= 1
+            self.bytes -= HEADER.size + len(self.peeked)
+            self.peeked = None
+
+            if not self.count:
+                #Drained, so start afresh rather than keep consumed segments
+                self.reader.close()
+                self.reader = None
+                self.writer.close()
+                for segment in self.segments:
+                    os.remove(self.path(segment))
+                self.segments = [self.segments[-1] + 1]
+                self.head, self.offset = self.segments[0], 0
+                self.writer = open(self.path(self.head), 'ab')
+            elif self.offset >= os.path.getsize(self.path(self.head)) and len(self.segments) > 1:
+                self.reader.close()
+                self.reader = None
+                os.remove(self.path(self.segments.pop(0)))
+                self.head, self.offset = self.segments[0], 0
+
+            self.dirty = True
+            self.sync()
+
+    def sync(self, force: bool = False):
+        '''
+            Sync appended records and the read position to disk, as the policy
+            requires. Under 'never' the read position is still saved at
+            intervals, leaving the OS to write it back.
+        '''
+        now = time.monotonic()
+        if not force and self.fsync != 'always' and now - self.synced < self.fsync_interval:
+            return
+        if self.fsync != 'never':
+            os.fsync(self.writer.fileno())
+        if self.dirty:
+            self.write_cursor()
+            self.dirty = False
+        self.synced = now
+
+    def close(self):
+        '''Sync everything and close the segment files'''
+        with self.lock:
+            self.writer.flush()
+            self.sync(force=True)
+            self.writer.close()
+            if self.reader:
+                self.reader.close()
+                self.reader = None
@@ -14,5 +14,8 @@ setup(
         'requests>=2.18.4',
         'jsonpickle'
     ],
+    extras_require={
+        'compression': ['lz4', 'zstandard']
+    },
     url='https://github.com/IBM/pycloudmessenger'
 )
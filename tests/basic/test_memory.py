@@ -0,0 +1,1128 @@
+#!/usr/bin/env python3
+#author markpurcell@ie.ibm.com
+
+"""In-process broker tests.
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one or more
+ * contributor license agreements.  See the NOTICE file distributed with
+ * this work for additional information regarding copyright ownership.
+ * The ASF licenses this file to You under the Apache License, Version 2.0
+ * (the "License"); you may not use this file except in compliance with
+ * the License.  You may obtain a copy of the License at
+ *
+ *     http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ */
+"""
+
+import ssl
+import json
+import base64
+import time
+import asyncio
+import logging
+import tempfile
+import tracemalloc
+import threading
+import unittest
+import pika
+import pycloudmessenger.rabbitmq as rabbitmq
+import pycloudmessenger.aiorabbitmq as aiorabbitmq
+import pycloudmessenger.rabbitmemory as rabbitmemory
+import pycloudmessenger.serializer as serializer
+import pycloudmessenger.compression as compression
+import pycloudmessenger.ffl.fflapi as fflapi
+import pycloudmessenger.castor.castorapi as castorapi
+
+LOGGER = logging.getLogger(__package__)
+
+ARGS = {'broker_host': 'memory', 'broker_port': 5672, 'broker_vhost': '/',
+        'broker_user': 'user', 'broker_password': 'password',
+        'broker_request_queue': 'feeds', 'broker_response_queue': 'replies',
+        'broker_delayed_exchange': 'delayed'}
+
+
+class MemoryBrokerTests(unittest.TestCase):
+    def setUp(self):
+        self.context = rabbitmq.RabbitContext(ARGS)
+        self.broker = rabbitmemory.MemoryBroker()
+        self.client = rabbitmemory.MemoryClient.on(self.broker)
+
+    def test_users(self):
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue(self.context.feeds(), purge=True),
+                         subscribe=rabbitmq.RabbitQueue(self.context.replies()))
+            client.publish(json.dumps({'action': 'Outbound'}))
+
+            with self.client(self.context) as server:
+                server.start(subscribe=rabbitmq.RabbitQueue(self.context.feeds()))
+                self.assertEqual(json.loads(server.receive(timeout=1)), {'action': 'Outbound'})
+                server.publish('the reply', rabbitmq.RabbitQueue(self.context.replies()))
+
+            self.assertEqual(client.receive(timeout=1), b'the reply')
+
+    def test_delay(self):
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('delayed'),
+                         subscribe=rabbitmq.RabbitQueue('delayed'))
+            start = time.monotonic()
+            client.publish('later', delay=1)
+
+            with self.assertRaises(rabbitmq.RabbitTimedOutException):
+                client.receive(timeout=0.5)
+            self.assertEqual(client.receive(timeout=2), b'later')
+            self.assertGreaterEqual(time.monotonic() - start, 1)
+
+    def test_prefetch(self):
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('work', confirm_window=10),
+                         subscribe=rabbitmq.RabbitQueue('work', prefetch=2, persistent=True))
+            self.assertEqual(client.publish_many([str(i) for i in range(5)]),
+                             rabbitmq.PublishResult([], []))
+
+            client.receive(timeout=1)
+            queue = self.broker.queues['work']
+            #One acknowledged, two more delivered, leaving two at the broker
+            self.assertEqual(len(queue.messages), 2)
+
+    def test_exclusive(self):
+        with self.client(self.context) as owner:
+            owner.start(subscribe=rabbitmq.RabbitQueue())
+            name = owner.get_subscribe_queue()
+            self.assertTrue(name.startswith('amq.gen-'))
+
+            with self.client(self.context) as other:
+                other.start(subscribe=rabbitmq.RabbitQueue(name))
+                with self.assertRaises(rabbitmq.RabbitConsumerException):
+                    other.receive(timeout=1)
+
+        self.assertNotIn(name, self.broker.queues)
+
+    def test_user_id(self):
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('work'))
+            client.context = rabbitmq.RabbitContext(ARGS, user='someone-else')
+
+            with self.assertRaises(pika.exceptions.ChannelClosed):
+                client.publish('spoofed')
+
+    def test_invoke_service(self):
+        dual = rabbitmq.RabbitDualClient(self.context)
+        dual.transport = self.client
+        dual.start_subscriber(rabbitmq.RabbitQueue(persistent=True))
+        dual.start_publisher(rabbitmq.RabbitQueue(self.context.feeds()))
+
+        def service():
+            with self.client(self.context) as server:
+                server.start(subscribe=rabbitmq.RabbitQueue(self.context.feeds()))
+
+                def handler(body, properties):
+                    request = json.loads(body)
+                    server.publish(request['value'].upper(),
+                                   rabbitmq.RabbitQueue(request['reply_to']),
+                                   correlation=properties.correlation_id)
+                server.receive(handler, timeout=2, max_messages=2, with_properties=True)
+
+        thread = threading.Thread(target=service)
+        thread.start()
+        try:
+            futures = [dual.invoke_service_async(
+                json.dumps({'value': value, 'reply_to': dual.get_subscribe_queue()}),
+                value, timeout=2) for value in ('a', 'b')]
+            self.assertEqual([future.result() for future in futures], [b'A', b'B'])
+        finally:
+            thread.join()
+            dual.stop()
+
+    def test_metrics(self):
+        exported = []
+        with self.client(self.context) as client:
+            client.metrics.add_exporter(exported.append)
+            client.start(publish=rabbitmq.RabbitQueue('work'),
+                         subscribe=rabbitmq.RabbitQueue('work'))
+            client.publish('12345')
+            client.receive(timeout=1)
+            with self.assertRaises(rabbitmq.RabbitTimedOutException):
+                client.receive(timeout=0.1)
+            client.metrics.export()
+
+        snapshot = exported[0]
+        self.assertEqual(snapshot['queues']['work'],
+                         {'messages_in': 1, 'messages_out': 1, 'bytes_in': 5, 'bytes_out': 5})
+        self.assertEqual(snapshot['timeouts'], 1)
+        self.assertGreaterEqual(snapshot['idle_seconds'], 0.1)
+        self.assertEqual(snapshot['confirm_latency_ms']['count'], 1)
+
+    def test_direct_reply(self):
+        self.context.args['broker_direct_reply'] = True
+        dual = rabbitmq.RabbitDualClient(self.context)
+        dual.transport = self.client
+        dual.start_subscriber(None)
+        dual.start_publisher(rabbitmq.RabbitQueue(self.context.feeds()))
+        queue = dual.mktemp_queue()
+        self.assertEqual(queue.name, rabbitmq.DIRECT_REPLY_TO)
+
+        with self.client(self.context) as server:
+            server.start(subscribe=rabbitmq.RabbitQueue(self.context.feeds()))
+            dual.send_message('request')
+
+            def handler(body, properties):
+                self.assertTrue(properties.reply_to.startswith(rabbitmq.DIRECT_REPLY_TO + '.'))
+                server.publish(body.upper(), rabbitmq.RabbitQueue(properties.reply_to))
+            server.receive(handler, timeout=1, max_messages=1, with_properties=True)
+
+        self.assertEqual(dual.receiver(queue).receive(timeout=1, queue=queue), b'REQUEST')
+        queues = len(self.broker.queues)
+        dual.stop()
+        self.assertEqual(len(self.broker.queues), queues - 1)
+
+    def test_declare_cache(self):
+        with self.client(self.context) as client:
+            client.start(subscribe=rabbitmq.RabbitQueue('durable', durable=True))
+            declares = []
+            declare = client.channel.queue_declare
+            client.channel.queue_declare = lambda **kwargs: declares.append(kwargs) or declare(**kwargs)
+
+            client.declare_queue(rabbitmq.RabbitQueue('durable', durable=True))
+            self.assertEqual(declares, [])
+
+            client.context.args['broker_declare_verify'] = True
+            client.declare_queue(rabbitmq.RabbitQueue('durable', durable=True))
+            self.assertEqual(declares, [{'queue': 'durable', 'passive': True}])
+
+            client.declare_queue(rabbitmq.RabbitQueue('durable', durable=True, auto_delete=True))
+            self.assertEqual(len(declares), 2)
+
+    def test_compression(self):
+        self.context.args['broker_compression'] = 'deflate'
+        self.context.args['broker_compression_threshold'] = 100
+        small, large = 'x' * 10, json.dumps({'model': [0.5] * 1000})
+
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('work'),
+                         subscribe=rabbitmq.RabbitQueue('work'))
+            client.publish(small)
+            client.publish(large)
+
+            wire = [message[1] for message in self.broker.queues['work'].messages]
+            self.assertEqual(wire[0], small.encode('utf-8'))
+            self.assertLess(len(wire[1]), len(large) / 10)
+
+            self.assertEqual(client.receive(timeout=1), small.encode('utf-8'))
+            self.assertEqual(client.receive(timeout=1), large.encode('utf-8'))
+
+    @unittest.skipUnless(compression.zstandard, 'zstandard is not installed')
+    def test_zstd_threads(self):
+        codec = compression.ZstdCodec()
+        body = json.dumps({'model': [0.5] * 10000}).encode('utf-8')
+        compressors, results = [], []
+
+        def work():
+            for _ in range(20):
+                results.append(codec.decompress(codec.compress(body)) == body)
+            compressors.append(codec.local.compressor)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        #Each thread compressed with its own zstandard objects
+        self.assertEqual(results, [True] * 80)
+        self.assertEqual(len({id(compressor) for compressor in compressors}), 4)
+
+    def test_flow_control(self):
+        self.context.args['broker_flow_control'] = 'fail'
+
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('work'),
+                         subscribe=rabbitmq.RabbitQueue('work'))
+            self.broker.block()
+            client.connection.process_data_events()
+            self.assertEqual(client.blocked, 'low on memory')
+            with self.assertRaises(rabbitmq.RabbitFlowControlException):
+                client.publish('refused')
+
+            self.context.args['broker_flow_control'] = 'spool'
+            client.publish('first')
+            client.publish('second')
+            self.assertEqual(len(client.spooled), 2)
+
+            self.broker.unblock()
+            client.connection.process_data_events()
+            client.publish('third')
+            self.assertEqual([client.receive(timeout=1) for _ in range(3)],
+                             [b'first', b'second', b'third'])
+
+    def test_rate_limit(self):
+        limiter = rabbitmq.RabbitRateLimiter(10, burst=2)
+        self.assertEqual(limiter.take(), 0)
+        self.assertEqual(limiter.take(), 0)
+        self.assertGreater(limiter.take(), 0.05)
+
+    def test_failover(self):
+        self.context.args['broker_hosts'] = ['down:5671', 'up', ('spare', 5673)]
+        self.assertEqual(self.context.hosts(),
+                         [('down', 5671), ('up', 5672), ('spare', 5673)])
+        tried = []
+
+        class Cluster(self.client):
+            def open_connection(self, parameters):
+                tried.append(parameters.host)
+                if parameters.host == 'down':
+                    raise pika.exceptions.AMQPConnectionError('unreachable')
+                return super(Cluster, self).open_connection(parameters)
+
+        for _ in range(3):
+            with Cluster(self.context) as client:
+                client.start(publish=rabbitmq.RabbitQueue('work'), retry_delay=0)
+        #Round robin spreads clients over the cluster, skipping the node that is down
+        self.assertEqual(tried, ['down', 'up', 'up', 'spare'])
+
+    def test_queue_arguments(self):
+        queue = rabbitmq.RabbitQueue('jobs', max_priority=10, message_ttl=60000)
+        with self.client(self.context) as client:
+            client.start(publish=queue, subscribe=queue)
+            self.assertEqual(self.broker.queues['jobs'].arguments,
+                             {'x-max-priority': 10, 'x-message-ttl': 60000})
+            client.publish('model update')
+            client.publish('stale', expiration=0.05)
+            client.publish('stop', priority=5)
+            time.sleep(0.1)
+
+            self.assertEqual(client.receive(timeout=1), b'stop')
+            self.assertEqual(client.receive(timeout=1), b'model update')
+            with self.assertRaises(rabbitmq.RabbitTimedOutException):
+                client.receive(timeout=0.2)
+
+            bounded = rabbitmq.RabbitQueue('bounded', max_length=1, overflow='reject-publish')
+            client.declare_queue(bounded)
+            result = client.publish_many(['kept', 'rejected'], bounded)
+            self.assertEqual(result.nacked, [1])
+
+        with self.assertRaises(Exception):
+            rabbitmq.RabbitQueue('votes', queue_type='quorum')
+
+    def test_disk_spool(self):
+        with tempfile.TemporaryDirectory() as spool_dir:
+            self.context.args['broker_spool_dir'] = spool_dir
+            self.context.args['broker_reconnect_delay'] = 0
+            wire = lambda: [message[1] for message in self.broker.queues['work'].messages]
+
+            with self.client(self.context) as client:
+                client.start(publish=rabbitmq.RabbitQueue('work'))
+                client.publish('first')
+                self.broker.partition()
+                client.publish('second')
+                client.publish(b'third')
+                self.assertEqual(len(client.spooled), 2)
+
+                self.broker.heal()
+                client.publish('fourth')
+                self.assertEqual(wire(), [b'first', b'second', b'third', b'fourth'])
+
+                self.broker.partition()
+                client.publish('fifth')
+
+            #Left on disk at close, replayed ahead of the next run's publishes
+            self.broker.heal()
+            with self.client(self.context) as client:
+                client.start(publish=rabbitmq.RabbitQueue('work'))
+                client.publish('sixth')
+            self.assertEqual(wire()[-2:], [b'fifth', b'sixth'])
+
+    def test_iter_messages(self):
+        with self.client(self.context) as client:
+            queue = rabbitmq.RabbitQueue('work', prefetch=10, ack_late=True)
+            client.start(publish=rabbitmq.RabbitQueue('work', confirm_window=10), subscribe=queue)
+            client.publish_many([str(i) * 4 for i in range(6)])
+
+            bodies = [body for body, _, _ in client.iter_messages(timeout=1, max_bytes=8)]
+            self.assertEqual(bodies, [b'0000', b'1111'])
+
+            for body, properties, handle in client.iter_messages(timeout=1):
+                if body == b'3333':
+                    handle.reject()
+                    handle.ack()
+                if body == b'4444':
+                    break
+
+            #Stopping early keeps the consumer, the abandoned delivery returns
+            self.assertIn(queue.name, client.consumers)
+            bodies = [body for body, _, _ in client.iter_messages(timeout=0.5)]
+            self.assertEqual(sorted(bodies), [b'3333', b'4444', b'5555'])
+
+    def test_fan_in(self):
+        with self.client(self.context) as client:
+            tasks = [rabbitmq.RabbitQueue(name, prefetch=prefetch)
+                     for name, prefetch in (('busy', 2), ('quiet', 5))]
+            client.start(subscribe=tasks[0])
+            client.publish_many([f'busy{i}' for i in range(6)], tasks[0])
+            client.publish_many(['quiet0', 'quiet1'], tasks[1])
+
+            received = [(handle.queue.name, body) for body, _, handle
+                        in client.iter_messages(tasks, timeout=0.5, max_messages=4)]
+            #Taken in turn, tagged with the queue each came from
+            self.assertEqual(received, [('busy', b'busy0'), ('quiet', b'quiet0'),
+                                        ('busy', b'busy1'), ('quiet', b'quiet1')])
+            #Each consumer on the one channel keeps its own prefetch window
+            self.assertEqual(len(self.broker.queues['busy'].messages), 2)
+
+    def test_chunked(self):
+        self.context.args['broker_chunk_size'] = 1000
+        model = bytes(range(256)) * 14
+
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('models'),
+                         subscribe=rabbitmq.RabbitQueue('models', persistent=True))
+            client.publish(model)
+            client.publish('small')
+            self.assertEqual(len(self.broker.queues['models'].messages), 5)
+
+            self.assertEqual(client.receive(timeout=1), model)
+            self.assertEqual(client.receive(timeout=1), b'small')
+            self.assertFalse(client.chunks.transfers)
+
+    def test_chunk_eviction(self):
+        def chunk(transfer, seq):
+            headers = dict(zip(rabbitmq.CHUNK_HEADERS, (transfer, seq, 3, 60)))
+            return pika.BasicProperties(headers=headers), bytes([seq]) * 20
+
+        chunks = rabbitmq.RabbitChunkAssembler(100, expiry=0.1)
+        self.assertIsNone(chunks.add(*chunk('a', 0)))
+        #No room for both bodies, so the one least recently added to goes
+        with self.assertLogs(rabbitmq.LOGGER, 'WARNING') as logs:
+            self.assertIsNone(chunks.add(*chunk('b', 0)))
+        self.assertIn('Dropping incomplete chunked body a', logs.output[0])
+        self.assertEqual((list(chunks.transfers), chunks.held), (['b'], 60))
+
+        #A late chunk of a dropped body starts it again, still incomplete
+        self.assertIsNone(chunks.add(*chunk('b', 1)))
+        with self.assertLogs(rabbitmq.LOGGER, 'WARNING'):
+            self.assertIsNone(chunks.add(*chunk('a', 1)))
+        self.assertEqual(list(chunks.transfers), ['a'])
+
+        #Stale partial bodies expire when the next chunk arrives
+        time.sleep(0.15)
+        with self.assertLogs(rabbitmq.LOGGER, 'WARNING') as logs:
+            self.assertIsNone(chunks.add(*chunk('c', 0)))
+        self.assertIn('Dropping chunked body a, 1 chunks received', logs.output[0])
+        self.assertEqual((list(chunks.transfers), chunks.held), (['c'], 60))
+        chunks.add(*chunk('c', 2))
+        self.assertEqual(chunks.add(*chunk('c', 1)), bytes([0] * 20 + [1] * 20 + [2] * 20))
+        self.assertEqual((chunks.transfers, chunks.held), ({}, 0))
+
+    def test_castor_reconnect(self):
+        self.context.args.update({'broker_reconnect_attempts': 3, 'broker_reconnect_delay': 0})
+        reply_to = lambda request: request['serviceRequest']['requestor']['replyTo']
+        messenger = castorapi.CastorMessenger(self.context)
+        messenger.transport = self.client
+
+        with messenger:
+            before = messenger.catalog.request_sensor_data('meter', 'from', 'to')
+            lost = messenger.invoke_service_async(before, timeout=10)
+            self.broker.partition()
+            self.broker.heal()
+
+            #The reply was addressed to the old server named queue
+            with self.assertRaises(castorapi.ConsumerException):
+                lost.result(timeout=5)
+
+            #Later requests are answered on the new one
+            after = messenger.catalog.request_sensor_data('meter', 'from', 'to')
+            self.assertNotEqual(reply_to(after), reply_to(before))
+            self.assertEqual(reply_to(after), messenger.get_subscribe_queue())
+            future = messenger.invoke_service_async(after, timeout=10)
+            with self.client(self.context) as server:
+                server.start(publish=rabbitmq.RabbitQueue(reply_to(after)))
+                reply = {'serviceResponse': {'service': {'status': 200, 'result': 'ok'}}}
+                server.publish(json.dumps(reply), correlation=future.correlation)
+            self.assertEqual(future.result(timeout=2), 'ok')
+
+    def test_persistent_consumers(self):
+        messenger = type('Messenger', (fflapi.Messenger,), {'transport': self.client})
+        for persistent in (False, True):
+            with messenger(fflapi.Context(ARGS, persistent_consumers=persistent)) as ffl:
+                self.assertIs(ffl.subscriber.sub_queue.persistent, persistent)
+                #Only a persistent consumer outlives a receive
+                ffl.send_message('{}', rabbitmq.RabbitQueue(ffl.get_subscribe_queue()))
+                ffl.receive(timeout=1)
+                self.assertEqual(bool(ffl.subscriber.consumers), persistent)
+
+    def test_castor_correlation(self):
+        messenger = castorapi.AsyncCastorMessenger(self.context)
+        with self.assertRaisesRegex(ValueError, 'correlationID'):
+            asyncio.run(messenger.invoke_service({'serviceRequest': {'service': {}}}))
+        with self.assertRaisesRegex(ValueError, 'correlationID'):
+            castorapi.CastorMessenger(self.context).invoke_service_async({})
+
+    def test_client_delay(self):
+        del self.context.args['broker_delayed_exchange']
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('deadlines'),
+                         subscribe=rabbitmq.RabbitQueue('deadlines', persistent=True))
+            start = time.monotonic()
+            client.publish('later', delay=0.4)
+            client.publish('sooner', delay=0.2)
+            #Held by the client, as the broker would ignore x-delay
+            self.assertEqual((client.outbound, len(client.scheduled)), (0, 2))
+
+            self.assertEqual(client.receive(timeout=2), b'sooner')
+            self.assertGreaterEqual(time.monotonic() - start, 0.2)
+            self.assertEqual(client.receive(timeout=2), b'later')
+            self.assertGreaterEqual(time.monotonic() - start, 0.4)
+
+    def test_client_delay_at_stop(self):
+        del self.context.args['broker_delayed_exchange']
+        client = self.client(self.context)
+        client.start(publish=rabbitmq.RabbitQueue('deadlines'))
+        client.publish('due', delay=0.1)
+        client.publish('never', delay=60)
+        #Nothing services the connection before the stop
+        time.sleep(0.2)
+        with self.assertLogs(rabbitmq.LOGGER, 'WARNING') as logs:
+            client.stop()
+
+        #Sent when due, or early rather than dropped
+        wire = lambda: [message[1] for message in self.broker.queues['deadlines'].messages]
+        self.assertEqual(wire(), [b'due', b'never'])
+        self.assertIn('1 delayed publishes not yet due at close, sent early', logs.output[0])
+
+        #A disk spool keeps them, with their remaining delay, for the next run
+        with tempfile.TemporaryDirectory() as spool_dir:
+            self.context.args['broker_spool_dir'] = spool_dir
+            with self.client(self.context) as client:
+                client.start(publish=rabbitmq.RabbitQueue('deadlines'))
+                client.publish('spooled', delay=0.3)
+
+            with self.client(self.context) as client:
+                client.start(publish=rabbitmq.RabbitQueue('deadlines'),
+                             subscribe=rabbitmq.RabbitQueue('deadlines', persistent=True))
+                client.receive(timeout=1)
+                client.receive(timeout=1)
+                client.flush_spool()
+                self.assertEqual(len(client.scheduled), 1)
+                self.assertEqual(client.receive(timeout=2), b'spooled')
+
+    def test_body_view(self):
+        self.context.args['broker_body_view'] = True
+        self.context.args['broker_chunk_size'] = 1000
+        model = serializer.Base64Serializer().serialize(list(range(1000)))
+        message = serializer.JsonSerializer().serialize({'model': model})
+
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('models'),
+                         subscribe=rabbitmq.RabbitQueue('models', persistent=True))
+            client.publish(message)
+            client.publish(model)
+
+            #Reassembled in place, and handed out without a copy
+            body = client.receive(timeout=1)
+            self.assertIsInstance(body, memoryview)
+            self.assertEqual(serializer.JsonSerializer().deserialize(body), {'model': model})
+            body = client.receive(timeout=1)
+            self.assertEqual(serializer.Base64Serializer().deserialize(body), list(range(1000)))
+
+    def test_body_view_memory(self):
+        model = bytes(8 * 1024 * 1024)
+        encoded = serializer.Base64Serializer().serialize(model).encode('utf-8')
+
+        def peak(body):
+            tracemalloc.start()
+            try:
+                self.assertEqual(serializer.Base64Serializer().deserialize(body), model)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        #Decoded from the view in place, so no more memory than from bytes,
+        #where a copy of the encoded body would add a third
+        whole = peak(encoded)
+        view = peak(memoryview(encoded))
+        self.assertLess(view, whole * 1.05)
+
+    def test_tls_cache(self):
+        pem = base64.b64encode(b'-----BEGIN CERTIFICATE-----').decode('utf-8')
+        contexts = [rabbitmq.RabbitContext(dict(ARGS, broker_cert_b64=pem)) for _ in range(2)]
+        #One PEM file per certificate, and one SSLContext per set of options
+        self.assertIs(contexts[0].cert_file, contexts[1].cert_file)
+        options = {'ssl_version': ssl.PROTOCOL_TLS_CLIENT, 'cert_reqs': ssl.CERT_NONE}
+        self.assertIs(rabbitmq.TLS_CACHE.context(dict(options)),
+                      rabbitmq.TLS_CACHE.context(dict(options)))
+
+    def test_tls_session_reuse(self):
+        class Socket():
+            session_reused = False
+
+            def __init__(self, session):
+                self.session = session if session else object()
+
+        class Context():
+            def __init__(self):
+                self.sessions = []
+
+            def wrap_socket(self, _sock, do_handshake_on_connect, session):
+                self.sessions.append(session)
+                return Socket(session)
+
+        cache = rabbitmq.RabbitTLSCache()
+        options = {'cert_reqs': ssl.CERT_NONE}
+        context = cache.contexts[cache.key(options)] = Context()
+        node = pika.ConnectionParameters('node1', 5671, ssl=True, ssl_options=options)
+        other = pika.ConnectionParameters('node2', 5671, ssl=True, ssl_options=options)
+
+        #The first connection to a node makes a full handshake, the next resumes its session
+        first = cache.wrap(None, node)
+        cache.keep(first, node)
+        cache.wrap(None, node)
+        cache.wrap(None, other)
+        self.assertEqual(context.sessions, [None, first.session, None])
+
+        #The hooks RabbitTLSConnection overrides are those of the pinned pika
+        if rabbitmq.PIKA_0_13:
+            for hook in ('_wrap_socket', '_adapter_connect'):
+                self.assertTrue(callable(getattr(pika.SelectConnection, hook, None)))
+
+    def test_confirms_after_consume(self):
+        with self.client(self.context) as client:
+            queue = rabbitmq.RabbitQueue('work', confirm_window=5)
+            client.start(publish=queue, subscribe=queue)
+            client.publish('one')
+            self.assertEqual(client.receive(timeout=1), b'one')
+
+            #Confirm sequence numbers are independent of delivery tags
+            client.publish('two')
+            client.wait_for_confirms()
+            self.assertFalse(client.unconfirmed)
+
+    def test_ack_coalescing(self):
+        class Channel():
+            def __init__(self):
+                self.acks = []
+            def basic_ack(self, tag, multiple=False):
+                self.acks.append((tag, multiple))
+
+        #Batch only, no time limit
+        channel = Channel()
+        acks = rabbitmq.RabbitAcknowledger(channel)
+        for tag in range(1, 21):
+            acks.delivered(tag)
+            acks.done(tag, batch=10, interval=0)
+        self.assertEqual(channel.acks, [(10, True), (20, True)])
+
+        #Interval only, the batch is never reached
+        channel = Channel()
+        acks = rabbitmq.RabbitAcknowledger(channel)
+        for tag in range(1, 6):
+            acks.delivered(tag)
+            acks.done(tag, batch=1000, interval=50)
+        self.assertEqual(channel.acks, [])
+        time.sleep(0.06)
+        acks.delivered(6)
+        acks.done(6, batch=1000, interval=50)
+        self.assertEqual(channel.acks, [(6, True)])
+
+        #With the connection, a timer flushes an idle consumer's acks
+        class Connection():
+            def __init__(self):
+                self.timers = []
+            def add_timeout(self, deadline, callback):
+                self.timers.append((deadline, callback))
+                return self.timers[-1]
+            def remove_timeout(self, timer):
+                self.timers.remove(timer)
+
+        channel, connection = Channel(), Connection()
+        acks = rabbitmq.RabbitAcknowledger(channel, connection)
+        for tag in range(1, 4):
+            acks.delivered(tag)
+            acks.done(tag, batch=1000, interval=50)
+        self.assertEqual(len(connection.timers), 1)
+        self.assertLessEqual(connection.timers[0][0], 0.05)
+        connection.timers.pop()[1]()
+        self.assertEqual(channel.acks, [(3, True)])
+
+        #A batch reached first cancels the timer
+        acks.delivered(4)
+        acks.done(4, batch=2, interval=50)
+        acks.delivered(5)
+        acks.done(5, batch=2, interval=50)
+        self.assertEqual((channel.acks[-1], connection.timers), ((5, True), []))
+
+        #The broker must be able to deliver a full batch
+        with self.assertRaises(ValueError):
+            rabbitmq.RabbitQueue('work', prefetch=5, ack_batch=10)
+        self.assertEqual(rabbitmq.RabbitQueue('work', prefetch=0, ack_batch=10).prefetch, 0)
+
+    def test_chunked_reconnect(self):
+        self.context.args.update({'broker_chunk_size': 1000, 'broker_reconnect_attempts': 3,
+                                  'broker_reconnect_delay': 0})
+        model = bytes(range(256)) * 20
+
+        for window in (1, 5):
+            with self.client(self.context) as client:
+                client.start(publish=rabbitmq.RabbitQueue('models', confirm_window=window))
+                send = client._send if window > 1 else client.send_body
+                calls = []
+
+                def flaky(*args, send=send, calls=calls):
+                    calls.append(1)
+                    if len(calls) == 3:
+                        #The connection drops part way through the transfer
+                        self.broker.partition()
+                        self.broker.heal()
+                    return send(*args)
+
+                setattr(client, '_send' if window > 1 else 'send_body', flaky)
+                client.publish(model)
+                client.wait_for_confirms()
+
+            with self.client(self.context) as consumer:
+                consumer.start(subscribe=rabbitmq.RabbitQueue('models'))
+                self.assertEqual(consumer.receive(timeout=1), model)
+                self.assertEqual(len(consumer.chunks.transfers), 0)
+                with self.assertRaises(rabbitmq.RabbitTimedOutException):
+                    consumer.receive(timeout=0.2)
+
+    async def serve(self, reply, count: int, reverse: bool = False):
+        """ Answer 'count' requests on the feeds queue with reply(body, properties) """
+        async with rabbitmemory.AsyncMemoryClient.on(self.broker)(self.context) as server:
+            await server.start(subscribe=rabbitmq.RabbitQueue(self.context.feeds()))
+            requests = [await server.next_message(server.sub_queue, timeout=2)
+                        for _ in range(count)]
+            for body, properties in reversed(requests) if reverse else requests:
+                answer, queue = reply(body, properties)
+                await server.publish(answer, rabbitmq.RabbitQueue(queue),
+                                     correlation=properties.correlation_id)
+
+    async def dual_client(self, dual=None):
+        """ Start an asyncio dual client on the broker """
+        if not dual:
+            dual = aiorabbitmq.AsyncRabbitDualClient(self.context)
+        dual.transport = rabbitmemory.AsyncMemoryClient.on(self.broker)
+        await dual.start_subscriber(rabbitmq.RabbitQueue())
+        await dual.start_publisher(rabbitmq.RabbitQueue(self.context.feeds()))
+        return dual
+
+    def test_async_invoke_service(self):
+        async def run():
+            dual = await self.dual_client()
+            try:
+                queue = dual.subscriber.sub_queue
+                #Replies come back in reverse order, and are matched by correlation id
+                service = asyncio.ensure_future(self.serve(
+                    lambda body, _: (body.upper(), queue.name), 3, reverse=True))
+                replies = await asyncio.gather(*[
+                    dual.invoke_service(value, timeout=2, queue=queue, correlation=value)
+                    for value in ('a', 'b', 'c')])
+                await service
+                self.assertEqual(replies, [b'A', b'B', b'C'])
+                self.assertEqual(list(dual.reply_pumps), [queue.name])
+
+                #A second reply queue gets its own pump
+                other = await dual.mktemp_queue()
+                service = asyncio.ensure_future(self.serve(
+                    lambda body, _: (body.upper(), other.name), 1))
+                self.assertEqual(await dual.invoke_service('d', timeout=2, queue=other,
+                                                           correlation='d'), b'D')
+                await service
+                self.assertEqual(set(dual.reply_pumps), {queue.name, other.name})
+            finally:
+                await dual.stop()
+        asyncio.run(run())
+
+    def test_async_reply_pump_failures(self):
+        class Dual(aiorabbitmq.AsyncRabbitDualClient):
+            def reply_correlation(self, message, properties):
+                if message == b'garbled':
+                    raise ValueError('unreadable reply')
+                return super().reply_correlation(message, properties)
+
+        async def run():
+            dual = await self.dual_client(Dual(self.context))
+            try:
+                queue = dual.subscriber.sub_queue
+
+                def reply(body, properties):
+                    return (b'garbled' if body == b'bad' else body.upper()), queue.name
+
+                #An unreadable reply is logged and dropped, the others still arrive
+                service = asyncio.ensure_future(self.serve(reply, 2))
+                with self.assertLogs(level='ERROR'):
+                    bad = dual.invoke_service('bad', timeout=0.5, queue=queue, correlation='1')
+                    good = dual.invoke_service('good', timeout=2, queue=queue, correlation='2')
+                    results = await asyncio.gather(bad, good, return_exceptions=True)
+                await service
+                self.assertIsInstance(results[0], rabbitmq.RabbitTimedOutException)
+                self.assertEqual(results[1], b'GOOD')
+
+                #Losing the connection fails waiting requests at once, not at their timeout
+                start = time.monotonic()
+                waiting = asyncio.ensure_future(
+                    dual.invoke_service('lost', timeout=5, queue=queue, correlation='3'))
+                await asyncio.sleep(0.05)
+                self.broker.partition()
+                with self.assertRaises(rabbitmq.RabbitConsumerException):
+                    await waiting
+                self.assertLess(time.monotonic() - start, 2)
+            finally:
+                self.broker.heal()
+                await dual.stop()
+        asyncio.run(run())
+
+    def test_async_messenger(self):
+        context = fflapi.Context(ARGS)
+        encoder = context.serializer()
+
+        def reply(body, _):
+            request = encoder.deserialize(body)['serviceRequest']
+            name = request['service']['args'][0]['params'][0]
+            answer = {'calls': [{'count': 1, 'data': [{'task_name': name}]}]}
+            return encoder.serialize(answer), request['requestor']['replyTo']
+
+        async def run():
+            messenger = fflapi.AsyncMessenger(context)
+            messenger.transport = rabbitmemory.AsyncMemoryClient.on(self.broker)
+            async with messenger:
+                service = asyncio.ensure_future(self.serve(reply, 2))
+                infos = await asyncio.gather(messenger.task_info('one'),
+                                             messenger.task_info('two'))
+                await service
+                self.assertEqual(infos, [{'task_name': 'one'}, {'task_name': 'two'}])
+
+                with self.assertRaises(fflapi.TimedOutException):
+                    await messenger._invoke_service(
+                        messenger.catalog.msg_task_info('unanswered'), timeout=0.3)
+        asyncio.run(run())
+
+    def test_connection_pool(self):
+        pool = rabbitmq.RabbitConnectionPool()
+        first = self.client(self.context, pool=pool)
+        first.start(publish=rabbitmq.RabbitQueue('work'))
+        second = self.client(self.context, pool=pool)
+        second.start(subscribe=rabbitmq.RabbitQueue('work'))
+
+        #The same thread and connection details share a connection, not a channel
+        connection = first.connection
+        self.assertIs(second.connection, connection)
+        self.assertIsNot(second.channel, first.channel)
+        first.publish('shared')
+        self.assertEqual(second.receive(timeout=1), b'shared')
+
+        #Released, it stays open for the next client
+        first.stop()
+        second.stop()
+        self.assertTrue(connection.is_open)
+        with self.client(self.context, pool=pool) as third:
+            third.start(publish=rabbitmq.RabbitQueue('work'))
+            self.assertIs(third.connection, connection)
+
+        #Each thread has its own
+        opened = []
+
+        def worker():
+            with self.client(self.context, pool=pool) as client:
+                client.start(publish=rabbitmq.RabbitQueue('work'))
+                opened.append(client.connection)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        self.assertIsNot(opened[0], connection)
+        self.assertEqual(len(pool.connections), 2)
+
+        pool.close()
+        self.assertFalse(pool.connections)
+        self.assertFalse(connection.is_open or opened[0].is_open)
+
+    def test_connection_pool_opt_in(self):
+        dual = rabbitmq.RabbitDualClient(self.context)
+        dual.transport = self.client
+        dual.start_publisher(rabbitmq.RabbitQueue('work'))
+        connection = dual.publisher.connection
+        dual.publisher.stop()
+        self.assertIsNone(dual.publisher.pool)
+        self.assertFalse(connection.is_open)
+
+        context = rabbitmq.RabbitContext(dict(ARGS, broker_pool_connections=True))
+        dual = rabbitmq.RabbitDualClient(context)
+        dual.transport = self.client
+        try:
+            dual.start_publisher(rabbitmq.RabbitQueue('work'))
+            self.assertIs(dual.publisher.pool, rabbitmq.CONNECTION_POOL)
+            connection = dual.publisher.connection
+            dual.publisher.stop()
+            self.assertTrue(connection.is_open)
+        finally:
+            rabbitmq.CONNECTION_POOL.close()
+        self.assertFalse(connection.is_open)
+
+    def test_io_loop(self):
+        dual = rabbitmq.RabbitDualClient(self.context)
+        dual.transport = self.client
+        dual.start_subscriber(rabbitmq.RabbitQueue(persistent=True))
+        dual.start_publisher(rabbitmq.RabbitQueue(self.context.feeds()))
+        dual.start_io()
+        loops = [dual.subscriber.io, dual.publisher.io]
+        connections = [dual.subscriber.connection, dual.publisher.connection]
+
+        def service():
+            with self.client(self.context) as server:
+                server.start(subscribe=rabbitmq.RabbitQueue(self.context.feeds()))
+
+                def handler(body, properties):
+                    request = json.loads(body)
+                    server.publish(request['value'].upper(),
+                                   rabbitmq.RabbitQueue(request['reply_to']),
+                                   correlation=properties.correlation_id)
+                server.receive(handler, timeout=2, max_messages=3, with_properties=True)
+
+        thread = threading.Thread(target=service)
+        thread.start()
+        try:
+            #Each connection gets its own thread, which runs operations submitted to it
+            self.assertIsNot(loops[0], loops[1])
+            self.assertTrue(all(loop.thread.is_alive() for loop in loops))
+            self.assertEqual(dual.publisher.invoke(threading.current_thread), loops[1].thread)
+            dual.start_io()
+            self.assertEqual([dual.subscriber.io, dual.publisher.io], loops)
+
+            request = {'value': 'a', 'reply_to': dual.get_subscribe_queue()}
+            self.assertEqual(dual.invoke_service(json.dumps(request), timeout=2), b'A')
+            futures = [dual.invoke_service_async(
+                json.dumps({'value': value, 'reply_to': dual.get_subscribe_queue()}),
+                value, timeout=2) for value in ('b', 'c')]
+            self.assertEqual([future.result() for future in futures], [b'B', b'C'])
+        finally:
+            thread.join()
+            dual.stop()
+
+        #Stopping joins the threads and closes the connections
+        self.assertFalse(any(loop.thread for loop in loops))
+        self.assertFalse(any(rabbitmq.RabbitIOLoop.owner_of(conn) for conn in connections))
+        self.assertFalse(any(conn.is_open for conn in connections))
+
+    def test_dispatcher_ordering(self):
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('work'),
+                         subscribe=rabbitmq.RabbitQueue('work', prefetch=6))
+            for seq in range(12):
+                client.publish(json.dumps({'key': 'abc'[seq % 3], 'seq': seq}))
+
+            lock = threading.Lock()
+            handled = {'a': [], 'b': [], 'c': []}
+            active = {'a': 0, 'b': 0, 'c': 0}
+            overlap = []
+
+            def handler(body):
+                message = json.loads(body)
+                with lock:
+                    active[message['key']] += 1
+                    overlap.append((active[message['key']], sum(active.values())))
+                #Earlier messages take longer, so would finish last if not chained
+                time.sleep(0.002 * (12 - message['seq']))
+                with lock:
+                    active[message['key']] -= 1
+                    handled[message['key']].append(message['seq'])
+
+            with rabbitmq.RabbitDispatcher(
+                    workers=4, key=lambda body, _: json.loads(body)['key']) as dispatcher:
+                client.receive(handler, timeout=1, max_messages=12, dispatcher=dispatcher)
+
+            #Each key is handled one at a time and in order, different keys concurrently
+            self.assertEqual(handled, {'a': [0, 3, 6, 9], 'b': [1, 4, 7, 10],
+                                       'c': [2, 5, 8, 11]})
+            self.assertEqual(max(per_key for per_key, _ in overlap), 1)
+            self.assertGreater(max(total for _, total in overlap), 1)
+
+    def test_dispatcher_acks(self):
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('work'),
+                         subscribe=rabbitmq.RabbitQueue('work', prefetch=4))
+            for seq in range(4):
+                client.publish(str(seq))
+
+            unacked = []
+
+            def handler(body):
+                #A message is only acknowledged once its handler has returned
+                unacked.append(int(body) in [int(message[1]) for _, message in
+                                             client.channel.unacked.values()])
+                #The last, so all have been dispatched before the failure
+                if body == b'3':
+                    raise ValueError('handler failed')
+
+            with rabbitmq.RabbitDispatcher(workers=2) as dispatcher:
+                with self.assertRaises(ValueError):
+                    client.receive(handler, timeout=1, max_messages=4, dispatcher=dispatcher)
+            self.assertEqual(len(unacked), 4)
+            self.assertTrue(all(unacked))
+
+            #The others were acknowledged, the failed message was returned to the queue
+            self.assertFalse(client.channel.unacked)
+            self.assertEqual(client.receive(timeout=1), b'3')
+            with self.assertRaises(rabbitmq.RabbitTimedOutException):
+                client.receive(timeout=0.2)
+
+    def test_connect_arguments(self):
+        class NoHosts(self.client):
+            def candidates(self, connection_attempts, retry_delay):
+                return []
+
+        with self.client(self.context) as client:
+            with self.assertRaises(ValueError):
+                client.start(publish=rabbitmq.RabbitQueue('work'), connection_attempts=0)
+
+        with NoHosts(self.context) as client:
+            with self.assertRaises(pika.exceptions.AMQPConnectionError):
+                client.start(publish=rabbitmq.RabbitQueue('work'))
+
+        async def run():
+            client = rabbitmemory.AsyncMemoryClient.on(self.broker)(self.context)
+            with self.assertRaises(ValueError):
+                await client.start(publish=rabbitmq.RabbitQueue('work'), connection_attempts=0)
+        asyncio.run(run())
+
+    def test_future_wait(self):
+        class Dual(rabbitmq.RabbitDualClient):
+            def reply_correlation(self, message, properties):
+                if message == b'garbled':
+                    raise ValueError('unreadable reply')
+                return super().reply_correlation(message, properties)
+
+        dual = Dual(self.context)
+        dual.transport = self.client
+        dual.start_subscriber(rabbitmq.RabbitQueue(persistent=True))
+        dual.start_publisher(rabbitmq.RabbitQueue(self.context.feeds()))
+        try:
+            future = dual.invoke_service_async('request', 'a', timeout=5)
+
+            #A zero timeout polls, leaving the request outstanding
+            start = time.monotonic()
+            with self.assertRaises(rabbitmq.RabbitTimedOutException):
+                future.result(timeout=0)
+            self.assertLess(time.monotonic() - start, 0.5)
+            self.assertFalse(future.done())
+
+            #An unreadable reply to some other request is dropped
+            with self.client(self.context) as server:
+                server.start(publish=rabbitmq.RabbitQueue(dual.get_subscribe_queue()))
+                server.publish('garbled', correlation='b')
+                server.publish('reply', correlation='a')
+            with self.assertLogs(level='ERROR'):
+                self.assertEqual(future.result(), b'reply')
+
+            #Failures are raised as the replacements given
+            future = dual.invoke_service_async('request', 'c', timeout=0.2,
+                                               errors=fflapi.SERVICE_ERRORS)
+            with self.assertRaises(fflapi.TimedOutException):
+                future.result()
+            self.assertIsInstance(future.exception(), fflapi.TimedOutException)
+            self.assertFalse(dual.pending)
+        finally:
+            dual.stop()
+
+    def test_future_threads(self):
+        dual = rabbitmq.RabbitDualClient(self.context)
+        dual.transport = self.client
+        dual.start_subscriber(rabbitmq.RabbitQueue(persistent=True))
+        dual.start_publisher(rabbitmq.RabbitQueue(self.context.feeds()))
+
+        #Track how many threads are inside the connection at once
+        receive, inside, most = dual.subscriber.receive, [], []
+
+        def counted(*args, **kwargs):
+            inside.append(1)
+            most.append(len(inside))
+            try:
+                return receive(*args, **kwargs)
+            finally:
+                inside.pop()
+
+        dual.subscriber.receive = counted
+        try:
+            #Pumped by the callers, then with the I/O thread filling the buffers
+            for io_thread in (False, True):
+                if io_thread:
+                    dual.start_io()
+                futures = [dual.invoke_service_async('request', str(index), timeout=5)
+                           for index in range(8)]
+                results = {}
+
+                def wait(future, results=results):
+                    results[future.correlation] = future.result()
+
+                threads = [threading.Thread(target=wait, args=(future,)) for future in futures]
+                for thread in threads:
+                    thread.start()
+                time.sleep(0.1)
+                with self.client(self.context) as server:
+                    server.start(publish=rabbitmq.RabbitQueue(dual.get_subscribe_queue()))
+                    for index in reversed(range(8)):
+                        server.publish(f'reply {index}', correlation=str(index))
+                for thread in threads:
+                    thread.join(timeout=5)
+
+                self.assertEqual(results, {str(index): f'reply {index}'.encode()
+                                           for index in range(8)})
+                self.assertEqual(max(most), 1)
+                self.assertFalse(dual.pending)
+        finally:
+            dual.stop()
+
+    def test_returned_message_id(self):
+        self.broker = rabbitmemory.MemoryBroker(auto_create=False)
+        client = rabbitmemory.MemoryClient.on(self.broker)(self.context)
+        client.start(publish=rabbitmq.RabbitQueue('work', durable=True, confirm_window=5))
+        try:
+            properties = client.message_properties
+
+            def identified(*args, **kwargs):
+                result = properties(*args, **kwargs)
+                result.message_id = 'order-1'
+                return result
+
+            client.message_properties = identified
+            self.assertEqual(client.publish_many(['kept']).returned, [])
+            self.assertEqual(client.publish_many(['lost', 'lost'],
+                                                 rabbitmq.RabbitQueue('nowhere')).returned, [0, 1])
+
+            #Returns are matched by a header of their own, the caller's id is kept
+            properties = self.broker.queues['work'].messages[0][0]
+            self.assertEqual(properties.message_id, 'order-1')
+            self.assertIn(rabbitmq.CONFIRM_HEADER, properties.headers)
+        finally:
+            client.stop()
+
+    def test_confirm_latency(self):
+        with self.client(self.context) as client:
+            client.start(publish=rabbitmq.RabbitQueue('work'))
+            client.publish('default queue')
+            client.publish('explicit queue', rabbitmq.RabbitQueue('other'))
+            client.publish_many(['batch'], rabbitmq.RabbitQueue('other'))
+            #Every confirmed publish is timed, whatever its queue
+            self.assertEqual(client.metrics.snapshot()['confirm_latency_ms']['count'], 3)
+
+        with self.client(self.context) as client:
+            client.start(subscribe=rabbitmq.RabbitQueue('work'))
+            client.publish('unconfirmed', rabbitmq.RabbitQueue('other'))
+            client.publish_many(['unconfirmed'], rabbitmq.RabbitQueue('other'))
+            self.assertEqual(client.metrics.snapshot()['confirm_latency_ms']['count'], 0)
+
+        #Without the pika internals windowed confirms fall back to synchronous ones
+        pika_0_13 = rabbitmq.PIKA_0_13
+        rabbitmq.PIKA_0_13 = False
+        try:
+            with self.client(self.context) as client:
+                with self.assertLogs(level='WARNING'):
+                    client.start(publish=rabbitmq.RabbitQueue('work', confirm_window=5))
+                self.assertEqual(client.window, 1)
+                client.publish('confirmed')
+                self.assertEqual(client.metrics.snapshot()['confirm_latency_ms']['count'], 1)
+        finally:
+            rabbitmq.PIKA_0_13 = pika_0_13